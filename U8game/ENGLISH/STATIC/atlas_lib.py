@@ -0,0 +1,223 @@
+# atlas_lib.py
+# Texture atlases of decoded U8 shape frames.
+# - SkylinePacker: bottom-left skyline rectangle packer.
+# - Atlas: a few large palette-index pages (uint8, 255 = transparent) plus a
+#   table of (shape, frame) -> page, rect, hotspot and UVs. Pages are colored
+#   with a palette_lib.Palette at display time, so palette swaps only touch
+#   the pages. Saved as one .npz that loads in a single read.
+#
+# Usage:
+#   python atlas_lib.py U8SHAPES.FLX u8shapes_atlas.npz [page_size]
+#
+# Requirements: numpy (pygame for Atlas.surfaces, Pillow for Atlas.images)
+
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from shape_lib import ShapeFile, TRANSPARENT_INDEX
+
+ATLAS_DTYPE = np.dtype([
+    ("shape", "<u2"), ("frame", "<u2"),
+    ("page", "<u2"),
+    ("x", "<u2"), ("y", "<u2"), ("w", "<u2"), ("h", "<u2"),
+    ("xoff", "<i2"), ("yoff", "<i2"),
+    ("u0", "<f4"), ("v0", "<f4"), ("u1", "<f4"), ("v1", "<f4"),
+])
+
+
+# ---------- Packing ----------
+
+class SkylinePacker:
+    """
+    Skyline bottom-left packer for one page. The skyline is a list of
+    [x, y, width] segments covering the page width; a rectangle goes where
+    its top edge ends up lowest (then leftmost).
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.skyline: List[List[int]] = [[0, 0, width]]
+        self.used_area = 0
+
+    def _fit(self, i: int, w: int, h: int) -> Optional[int]:
+        """y at which a w-wide rect starting at segment i would sit, or None."""
+        x = self.skyline[i][0]
+        if x + w > self.width:
+            return None
+        y = 0
+        remaining = w
+        while remaining > 0:
+            sx, sy, sw = self.skyline[i]
+            y = max(y, sy)
+            if y + h > self.height:
+                return None
+            remaining -= sw
+            i += 1
+        return y
+
+    def insert(self, w: int, h: int) -> Optional[Tuple[int, int]]:
+        """Places a w x h rectangle; returns its (x, y) or None if it does not fit."""
+        best = None   # (top, x, index, y)
+        for i in range(len(self.skyline)):
+            y = self._fit(i, w, h)
+            if y is not None:
+                cand = (y + h, self.skyline[i][0], i, y)
+                if best is None or cand < best:
+                    best = cand
+        if best is None:
+            return None
+        _, x, i, y = best
+        self._add(i, x, y + h, w)
+        self.used_area += w * h
+        return x, y
+
+    def _add(self, i: int, x: int, top: int, w: int):
+        sky = self.skyline
+        sky.insert(i, [x, top, w])
+        j = i + 1
+        right = x + w
+        # cut away the segments now under the new one
+        while j < len(sky) and sky[j][0] < right:
+            sx, sy, sw = sky[j]
+            if sx + sw <= right:
+                del sky[j]
+            else:
+                sky[j] = [right, sy, sx + sw - right]
+                break
+        # merge neighbours of equal height
+        k = 0
+        while k < len(sky) - 1:
+            if sky[k][1] == sky[k + 1][1]:
+                sky[k][2] += sky[k + 1][2]
+                del sky[k + 1]
+            else:
+                k += 1
+
+    def occupancy(self) -> float:
+        return self.used_area / float(self.width * self.height)
+
+
+# ---------- Atlas ----------
+
+class Atlas:
+    """Index pages (n, H, W) uint8 and an ATLAS_DTYPE table, one row per frame."""
+
+    def __init__(self, pages: np.ndarray, table: np.ndarray):
+        self.pages = pages
+        self.table = table
+        self._rows: Dict[Tuple[int, int], int] = {
+            (int(s), int(f)): i for i, (s, f) in enumerate(zip(table["shape"], table["frame"]))}
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __contains__(self, key) -> bool:
+        return key in self._rows
+
+    def lookup(self, shape: int, frame: int):
+        """Table row of (shape, frame); raises KeyError if it is not in the atlas."""
+        return self.table[self._rows[(shape, frame)]]
+
+    def rect(self, shape: int, frame: int) -> Tuple[int, Tuple[int, int, int, int], int, int]:
+        """(page, (x, y, w, h), xoff, yoff) for blitting a sub-rect."""
+        r = self.lookup(shape, frame)
+        return int(r["page"]), (int(r["x"]), int(r["y"]), int(r["w"]), int(r["h"])), int(r["xoff"]), int(r["yoff"])
+
+    def pixels(self, shape: int, frame: int) -> np.ndarray:
+        """The frame's (h, w) index array (a view into its page)."""
+        r = self.lookup(shape, frame)
+        x, y = int(r["x"]), int(r["y"])
+        return self.pages[int(r["page"]), y:y + int(r["h"]), x:x + int(r["w"])]
+
+    def surfaces(self, palette) -> list:
+        """One RGBA pygame Surface per page."""
+        return [palette.to_surface(p) for p in self.pages]
+
+    def images(self, palette) -> list:
+        """One RGBA PIL Image per page."""
+        return [palette.to_image(p) for p in self.pages]
+
+    def save(self, path):
+        np.savez(path, pages=self.pages, table=self.table)
+
+    @classmethod
+    def load(cls, path) -> "Atlas":
+        with np.load(path) as z:
+            return cls(z["pages"], z["table"])
+
+
+def build_atlas(shapes: ShapeFile, keys=None, page_size: int = 1024, padding: int = 1) -> Atlas:
+    """
+    Decodes frames and packs them into index pages.
+
+    Args:
+        shapes: An open shape_lib.ShapeFile.
+        keys: (shape, frame) pairs to pack; defaults to every frame.
+        page_size (int): Page width/height; grown to fit the largest frame.
+        padding (int): Transparent gap kept around each frame.
+
+    Returns:
+        Atlas: The packed atlas.
+    """
+    index = shapes.index
+    if keys is None:
+        keys = [(s, f) for s in range(index.num_shapes) for f in range(index.frame_counts[s])]
+    keys = list(keys)
+    decoded = shapes.decode_many(keys)
+    frames = []
+    for k, (s, f) in enumerate(keys):
+        try:
+            px, xoff, yoff, _ = decoded[k]
+        except ValueError:
+            continue
+        frames.append((s, f, px, xoff, yoff))
+
+    size = page_size
+    for _, _, px, _, _ in frames:
+        size = max(size, px.shape[0] + padding, px.shape[1] + padding)
+
+    # tallest first packs tightest on a skyline
+    frames.sort(key=lambda t: (-t[2].shape[0], -t[2].shape[1]))
+    packers: List[SkylinePacker] = []
+    pages: List[np.ndarray] = []
+    table = np.zeros(len(frames), dtype=ATLAS_DTYPE)
+    for row, (s, f, px, xoff, yoff) in enumerate(frames):
+        h, w = px.shape
+        pos = None
+        for page, packer in enumerate(packers):
+            pos = packer.insert(w + padding, h + padding)
+            if pos is not None:
+                break
+        if pos is None:
+            packers.append(SkylinePacker(size, size))
+            pages.append(np.full((size, size), TRANSPARENT_INDEX, dtype=np.uint8))
+            page = len(packers) - 1
+            pos = packers[page].insert(w + padding, h + padding)
+        x, y = pos
+        pages[page][y:y + h, x:x + w] = px
+        table[row] = (s, f, page, x, y, w, h, xoff, yoff,
+                      x / size, y / size, (x + w) / size, (y + h) / size)
+    order = np.lexsort((table["frame"], table["shape"]))
+    pages_arr = np.stack(pages) if pages else np.zeros((0, size, size), dtype=np.uint8)
+    return Atlas(pages_arr, table[order])
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python atlas_lib.py <U8SHAPES.FLX> <out.npz> [page_size]")
+        sys.exit(1)
+    page_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+    with ShapeFile(sys.argv[1]) as sf:
+        atlas = build_atlas(sf, page_size=page_size)
+    atlas.save(sys.argv[2])
+    used = int((atlas.table["w"].astype(np.int64) * atlas.table["h"]).sum())
+    total = atlas.pages.size
+    print(f"{len(atlas)} frames on {len(atlas.pages)} page(s) of {atlas.pages.shape[1]}px, "
+          f"{100.0 * used / max(1, total):.1f}% filled -> {sys.argv[2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# cache_lib.py
+# Bounded LRU cache for decoded frames (surfaces, images, index arrays).
+# - FrameCache: LRU eviction against a byte budget, sized from the actual
+#   pixel buffers held by each entry; thread-safe.
+# - Counters for hits, misses, evictions and bytes resident.
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+# Rough fixed cost per entry (dict slot, key tuple, wrapper objects).
+ENTRY_OVERHEAD = 200
+
+
+def sizeof(value) -> int:
+    """
+    Bytes held by a cached value: ndarray/bytes buffers, pygame Surfaces
+    (pitch * height), PIL Images (w * h * bands), and tuples, lists or plain
+    objects (e.g. dataclasses) of those.
+    """
+    if value is None or isinstance(value, (int, float, str)):
+        return 0
+    nbytes = getattr(value, "nbytes", None)           # numpy arrays
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if hasattr(value, "get_pitch"):                   # pygame.Surface
+        return value.get_pitch() * value.get_height()
+    if hasattr(value, "getbands") and hasattr(value, "size"):   # PIL.Image
+        w, h = value.size
+        return w * h * len(value.getbands())
+    if isinstance(value, (tuple, list)):
+        return sum(sizeof(v) for v in value)
+    if hasattr(value, "__dict__"):
+        return sum(sizeof(v) for v in vars(value).values())
+    return 0
+
+
+class FrameCache:
+    """
+    LRU mapping with a byte budget.
+
+    Entries are charged sizeof(value) + ENTRY_OVERHEAD (or an explicit
+    nbytes). Inserting past the budget evicts least recently used entries;
+    a single entry larger than the whole budget is not kept.
+    """
+
+    def __init__(self, max_bytes: int, sizer: Callable = sizeof):
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()   # key -> (value, nbytes)
+        self._lock = threading.RLock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes: Optional[int] = None):
+        if nbytes is None:
+            nbytes = self.sizer(value) + ENTRY_OVERHEAD
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            if nbytes > self.max_bytes:
+                return value
+            self._data[key] = (value, nbytes)
+            self.bytes += nbytes
+            self._evict()
+        return value
+
+    def get_or_load(self, key, loader: Callable):
+        """Cached value of key, calling loader() (and caching it) on a miss."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return self.put(key, loader())
+
+    def discard(self, key) -> bool:
+        """Drops key if present; returns whether it was cached."""
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is None:
+                return False
+            self.bytes -= old[1]
+            return True
+
+    def keys(self) -> list:
+        """Snapshot of the keys, least recently used first."""
+        with self._lock:
+            return list(self._data)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._data:
+            _, (_, nbytes) = self._data.popitem(last=False)
+            self.bytes -= nbytes
+            self.evictions += 1
+
+    def resize(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def items(self):
+        """Snapshot of (key, value) pairs, least recently used first."""
+        with self._lock:
+            return [(k, v[0]) for k, v in self._data.items()]
+
+    def replace_all(self, fn: Callable):
+        """Replaces every value with fn(key, value) in place (e.g. re-coloring), keeping LRU order."""
+        with self._lock:
+            for key, (value, _) in list(self._data.items()):
+                self.put(key, fn(key, value))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def summary(self) -> str:
+        s = self.stats()
+        return (f"{s['entries']} frames, {s['bytes'] / 1048576:.1f}/{s['max_bytes'] / 1048576:.0f} MB, "
+                f"hit {100 * s['hit_rate']:.0f}%, {s['evictions']} evicted")
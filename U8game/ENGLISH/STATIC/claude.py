@@ -2,6 +2,9 @@ import pygame
 import struct
 from pathlib import Path
 
+import decode_shapes
+import shape_lib
+
 class Button:
     def __init__(self, x, y, width, height, text, color=(100, 100, 100), hover_color=(150, 150, 150)):
         self.rect = pygame.Rect(x, y, width, height)
@@ -123,12 +126,7 @@ class GUI:
 
 class U8ShapeViewer:
     def __init__(self, shape_file: str, pal_file: str):
-        # Match BASIC arrays
-        self.typ_pos = [0] * 2048  # DIM TypPos(0 TO 2047) AS LONG
-        self.typ_siz = [0] * 2048  # DIM TypSiz(0 TO 2047) AS LONG
-        self.frm_pos = [0] * 1550  # DIM FrmPos(0 TO 1549) AS LONG
-        self.frm_siz = [0] * 1550  # DIM FrmSiz(0 TO 1549) AS LONG
-        self.lin_pos = [0] * 200   # DIM LinPos(0 TO 199) AS LONG
+        self.shapes = None  # shape_lib.ShapeFile, opened on first draw
         
         # Fixed screen center positions like BASIC
         self.st_x_pos = 160  # Center X = 160 in mode 13
@@ -175,6 +173,7 @@ class U8ShapeViewer:
     
     def load_palette(self, filename: str) -> None:
         """Direct translation of palette loading from BASIC."""
+        self.pal_file = filename
         self.palette = []
         with open(filename, 'rb') as f:
             f.seek(4)  # Start at 5 in BASIC = offset 4 in Python
@@ -183,249 +182,84 @@ class U8ShapeViewer:
                 val = (val << 2)  # Convert 6-bit to 8-bit color
                 self.palette.append(val)
     
+    def decode_current_frame(self, filename):
+        """Decodes shape GoTyp, frame GoFrm; returns (surface, header) or None."""
+        if self.shapes is None or self.shapes.path != str(filename):
+            if self.shapes is not None:
+                self.shapes.close()
+            self.shapes = shape_lib.ShapeFile(filename)
+        shapes = self.shapes
+        num_typ = shapes.num_shapes
+        if self.go_typ < 0 or self.go_typ > num_typ - 1:
+            print(f"Error: Invalid shape type: {self.go_typ}, file has {num_typ} shapes")
+            return None
+        num_frm = shapes.frame_count(self.go_typ)
+        if num_frm < 1:
+            print(f"Error: Invalid shape data at type {self.go_typ}")
+            return None
+        if self.go_frm < 0 or self.go_frm > num_frm - 1:
+            print(f"Error: Invalid frame number: {self.go_frm}, for this shape, there are {num_frm} frames")
+            return None
+
+        typ_num, frm_num = struct.unpack_from('<HH', shapes.data, shapes.frame_info(self.go_typ, self.go_frm).offset)
+        pixels, x_off, y_off, compr = shapes.decode(self.go_typ, self.go_frm)
+        y_len, x_len = pixels.shape
+
+        # Index image -> RGBA, uncovered pixels stay transparent
+        surface = pygame.Surface((x_len, y_len), pygame.SRCALPHA)
+        if x_len and y_len:
+            frame = pygame.image.frombuffer(pixels.tobytes(), (x_len, y_len), "P")
+            frame.set_palette([tuple(self.palette[i:i + 3]) for i in range(0, 768, 3)])
+            frame.set_colorkey(shape_lib.TRANSPARENT_INDEX)
+            surface.blit(frame, (0, 0))
+        return surface, (x_len, y_len, x_off, y_off, typ_num, frm_num, compr, num_frm)
+
     def load_and_display_shape(self, filename: str) -> None:
-        """Direct translation of BASIC shape loading and display."""
-        with open(filename, 'rb') as f:
-            f.seek(84)  # 85 in BASIC = offset 84
-            num_typ = struct.unpack('<H', f.read(2))[0]
-            
-            if self.go_typ < 0 or self.go_typ > num_typ - 1:
-                return
-            
-            f.seek(128)  # 129 in BASIC = offset 128
-            for ct in range(num_typ):
-                self.typ_pos[ct] = struct.unpack('<I', f.read(4))[0] + 1
-                self.typ_siz[ct] = struct.unpack('<I', f.read(4))[0]
-            
-            if self.typ_siz[self.go_typ] < 1:
-                return
-            
-            f.seek(self.typ_pos[self.go_typ] - 1)
-            f.read(4)  # Skip unknown bytes
-            num_frm = struct.unpack('<H', f.read(2))[0]
-            
-            if self.go_frm < 0 or self.go_frm > num_frm - 1:
-                return
-            
-            # Read frame info
-            for ct in range(num_frm):
-                tmp1 = f.read(1)[0]
-                tmp2 = f.read(1)[0]
-                tmp3 = f.read(1)[0]
-                self.frm_pos[ct] = tmp3 * 65536 + tmp2 * 256 + tmp1 + self.typ_pos[self.go_typ]
-                f.read(1)  # Skip unknown byte
-                tmp1 = f.read(1)[0]
-                tmp2 = f.read(1)[0]
-                self.frm_siz[ct] = tmp2 * 256 + tmp1
-            
-            if self.frm_siz[self.go_frm] < 1:
-                return
-            
-            f.seek(self.frm_pos[self.go_frm] - 1)
-            typ_num = struct.unpack('<H', f.read(2))[0]
-            frm_num = struct.unpack('<H', f.read(2))[0]
-            f.read(4)  # Skip unknown
-            compr = struct.unpack('<H', f.read(2))[0]
-            x_len = struct.unpack('<H', f.read(2))[0]
-            y_len = struct.unpack('<H', f.read(2))[0]
-            x_off = struct.unpack('<h', f.read(2))[0]
-            y_off = struct.unpack('<h', f.read(2))[0]
-            
-            # Read line positions
-            for ct in range(y_len):
-                start = f.tell()
-                self.lin_pos[ct] = start
-                tmp1 = f.read(1)[0]
-                tmp2 = f.read(1)[0]
-                tmp_pos = tmp2 * 256 + tmp1
-                self.lin_pos[ct] = self.lin_pos[ct] + tmp_pos
-            
-            # Initialize drawing
-            surface = pygame.Surface((x_len, y_len))
-            surface.fill((0, 0, 0))
-            
-            # Start exact BASIC drawing loop
-            x_pos = x_len
-            y_pos = -1
-            
-            while True:
-                while x_pos >= x_len:
-                    y_pos += 1
-                    if y_pos >= y_len:
-                        break
-                    f.seek(self.lin_pos[y_pos])
-                    x_pos = f.read(1)[0]
-                
-                if y_pos >= y_len:
-                    break
-                
-                dat_len = f.read(1)[0]
-                
-                if compr == 1:
-                    if (dat_len & 1) == 1:
-                        dat_len = dat_len >> 1
-                        color = f.read(1)[0]
-                        for i in range(dat_len):
-                            if x_pos + i < x_len:
-                                r = self.palette[color * 3]
-                                g = self.palette[color * 3 + 1]
-                                b = self.palette[color * 3 + 2]
-                                surface.set_at((x_pos + i, y_pos), (r, g, b))
-                    else:
-                        dat_len = dat_len >> 1
-                        for i in range(dat_len):
-                            color = f.read(1)[0]
-                            if x_pos + i < x_len:
-                                r = self.palette[color * 3]
-                                g = self.palette[color * 3 + 1]
-                                b = self.palette[color * 3 + 2]
-                                surface.set_at((x_pos + i, y_pos), (r, g, b))
-                else:
-                    for i in range(dat_len):
-                        color = f.read(1)[0]
-                        if x_pos + i < x_len:
-                            r = self.palette[color * 3]
-                            g = self.palette[color * 3 + 1]
-                            b = self.palette[color * 3 + 2]
-                            surface.set_at((x_pos + i, y_pos), (r, g, b))
-                
-                x_pos += dat_len
-                if x_pos < x_len:
-                    x_pos += f.read(1)[0]
-            
-            # Clear screen and display frame
-            self.screen.fill((0, 0, 0))
-            disp_x = 400 - x_off
-            disp_y = 300 - y_off
-            self.screen.blit(surface, (disp_x, disp_y))
-            
-            # Draw metadata
-            self.draw_metadata(self.screen, x_len, y_len, x_off, y_off, typ_num, frm_num, compr, num_frm)
-            
-            # Draw GUI elements
-            self.gui.draw(self.screen)
-            
-            pygame.display.flip()
+        """Decodes the current frame and draws it centered like the BASIC viewer."""
+        decoded = self.decode_current_frame(filename)
+        if decoded is None:
+            return
+        surface, (x_len, y_len, x_off, y_off, typ_num, frm_num, compr, num_frm) = decoded
+
+        # Clear screen and display frame
+        self.screen.fill((0, 0, 0))
+        disp_x = 400 - x_off
+        disp_y = 300 - y_off
+        self.screen.blit(surface, (disp_x, disp_y))
+        
+        # Draw metadata
+        self.draw_metadata(self.screen, x_len, y_len, x_off, y_off, typ_num, frm_num, compr, num_frm)
+        
+        # Draw GUI elements
+        self.gui.draw(self.screen)
+        
+        pygame.display.flip()
 
     def export_current_frame(self, filename: str) -> None:
         """Export the current frame as a PNG."""
-        with open("U8SHAPES.FLX", 'rb') as f:
-            f.seek(84)
-            num_typ = struct.unpack('<H', f.read(2))[0]
-            
-            if self.go_typ < 0 or self.go_typ > num_typ - 1:
-                return
-            
-            f.seek(128)
-            for ct in range(num_typ):
-                self.typ_pos[ct] = struct.unpack('<I', f.read(4))[0] + 1
-                self.typ_siz[ct] = struct.unpack('<I', f.read(4))[0]
-            
-            if self.typ_siz[self.go_typ] < 1:
-                return
-            
-            f.seek(self.typ_pos[self.go_typ] - 1)
-            f.read(4)
-            num_frm = struct.unpack('<H', f.read(2))[0]
-            
-            if self.go_frm < 0 or self.go_frm > num_frm - 1:
-                return
-            
-            # Read frame info
-            for ct in range(num_frm):
-                tmp1 = f.read(1)[0]
-                tmp2 = f.read(1)[0]
-                tmp3 = f.read(1)[0]
-                self.frm_pos[ct] = tmp3 * 65536 + tmp2 * 256 + tmp1 + self.typ_pos[self.go_typ]
-                f.read(1)
-                tmp1 = f.read(1)[0]
-                tmp2 = f.read(1)[0]
-                self.frm_siz[ct] = tmp2 * 256 + tmp1
-            
-            if self.frm_siz[self.go_frm] < 1:
-                return
-            
-            f.seek(self.frm_pos[self.go_frm] - 1)
-            typ_num = struct.unpack('<H', f.read(2))[0]
-            frm_num = struct.unpack('<H', f.read(2))[0]
-            f.read(4)
-            compr = struct.unpack('<H', f.read(2))[0]
-            x_len = struct.unpack('<H', f.read(2))[0]
-            y_len = struct.unpack('<H', f.read(2))[0]
-            x_off = struct.unpack('<h', f.read(2))[0]
-            y_off = struct.unpack('<h', f.read(2))[0]
-            
-            # Read line positions
-            for ct in range(y_len):
-                start = f.tell()
-                self.lin_pos[ct] = start
-                tmp1 = f.read(1)[0]
-                tmp2 = f.read(1)[0]
-                tmp_pos = tmp2 * 256 + tmp1
-                self.lin_pos[ct] = self.lin_pos[ct] + tmp_pos
-            
-            # Create surface for export - just the frame size
-            surface = pygame.Surface((x_len, y_len))
-            surface.fill((0, 0, 0))
-            
-            # Start exact BASIC drawing loop
-            x_pos = x_len
-            y_pos = -1
-            
-            while True:
-                while x_pos >= x_len:
-                    y_pos += 1
-                    if y_pos >= y_len:
-                        break
-                    f.seek(self.lin_pos[y_pos])
-                    x_pos = f.read(1)[0]
-                
-                if y_pos >= y_len:
-                    break
-                
-                dat_len = f.read(1)[0]
-                
-                if compr == 1:
-                    if (dat_len & 1) == 1:
-                        dat_len = dat_len >> 1
-                        color = f.read(1)[0]
-                        for i in range(dat_len):
-                            if x_pos + i < x_len:
-                                r = self.palette[color * 3]
-                                g = self.palette[color * 3 + 1]
-                                b = self.palette[color * 3 + 2]
-                                surface.set_at((x_pos + i, y_pos), (r, g, b))
-                    else:
-                        dat_len = dat_len >> 1
-                        for i in range(dat_len):
-                            color = f.read(1)[0]
-                            if x_pos + i < x_len:
-                                r = self.palette[color * 3]
-                                g = self.palette[color * 3 + 1]
-                                b = self.palette[color * 3 + 2]
-                                surface.set_at((x_pos + i, y_pos), (r, g, b))
-                else:
-                    for i in range(dat_len):
-                        color = f.read(1)[0]
-                        if x_pos + i < x_len:
-                            r = self.palette[color * 3]
-                            g = self.palette[color * 3 + 1]
-                            b = self.palette[color * 3 + 2]
-                            surface.set_at((x_pos + i, y_pos), (r, g, b))
-                
-                x_pos += dat_len
-                if x_pos < x_len:
-                    x_pos += f.read(1)[0]
-            
-            # Save just the frame without any GUI elements
-            pygame.image.save(surface, filename)
-            
-            # Show export notification
-            font = pygame.font.Font(None, 24)
-            text = font.render(f"Exported {filename}", True, (0, 255, 0))
-            self.screen.blit(text, (10, 460))
-            pygame.display.flip()
+        decoded = self.decode_current_frame("U8SHAPES.FLX")
+        if decoded is None:
+            return
+        surface = decoded[0]
+
+        # Save just the frame without any GUI elements
+        pygame.image.save(surface, filename)
+        
+        # Show export notification
+        font = pygame.font.Font(None, 24)
+        text = font.render(f"Exported {filename}", True, (0, 255, 0))
+        self.screen.blit(text, (10, 460))
+        pygame.display.flip()
     
+    def export_all_frames(self, out_dir: str) -> None:
+        """Export every frame of every shape as PNGs, decoded in parallel by decode_shapes."""
+        report = decode_shapes.decode_archive("U8SHAPES.FLX", out_dir, "png", self.pal_file)
+        print(report.summary())
+        font = pygame.font.Font(None, 24)
+        text = font.render(f"Exported {report.frames} frames to {out_dir}", True, (0, 255, 0))
+        self.screen.blit(text, (10, 460))
+        pygame.display.flip()
+
     def run(self) -> None:
         """Handle input and display."""
         running = True
@@ -452,6 +286,8 @@ class U8ShapeViewer:
                     elif gui_event == 'export':
                         filename = f"shape_{self.go_typ:04d}_frame_{self.go_frm:04d}.png"
                         self.export_current_frame(filename)
+                    elif gui_event == 'export_all':
+                        self.export_all_frames("export_all")
                     elif isinstance(gui_event, tuple):
                         if gui_event[0] == 'goto_shape':
                             self.go_typ = gui_event[1]
@@ -4,7 +4,11 @@ import sys
 import tkinter as tk
 from tkinter import filedialog
 from pathlib import Path
+
+import numpy as np
+
 import flx_lib
+from shape_lib import encode_lines
 
 
 def browse_file(title, filetypes):
@@ -15,83 +19,23 @@ def browse_file(title, filetypes):
     return file_path
 
 def read_pixel_data(surface):
-    """Extracts the raw pixel data as a list of color indices."""
+    """Extracts the pixels as a (height, width) array of color indices (red channel, 255 = transparent)."""
     width, height = surface.get_size()
-    pixels = []
-    for y in range(height):
-        for x in range(width):
-           pixels.append(surface.get_at((x, y)))
+    rgba = np.frombuffer(pygame.image.tobytes(surface, "RGBA"), dtype=np.uint8).reshape(height, width, 4)
+    pixels = np.where((rgba == 0).all(axis=2), 255, rgba[:, :, 0]).astype(np.uint8)
     return pixels, width, height
 
 
 def rle_encode(pixels, width, height):
-    """Compresses pixel data using RLE."""
-    rle_data = bytearray()
-    line_offsets = []
-    current_pos = 0
-    compression_type = 1 # Hard code compression type, always 1
-
+    """Compresses pixel data using RLE (compression 1, smallest runs per line via shape_lib)."""
     try:
-        for y in range(height):
-            print(f"Starting line {y}")
-            line_offsets.append(len(rle_data))
-            x = 0
-            while x < width:
-                print(f"  x={x}  current rle_data={len(rle_data)}")
-                start_x = x
-                skip_pixels = 0
-                while x < width and pixels[y * width + x] == (0,0,0,0):
-                    skip_pixels+=1
-                    x+=1
-                
-                print(f"    skip_pixels={skip_pixels}")
-
-                rle_data.append(skip_pixels)
-
-                if x >= width:
-                    print(f"    end of line")
-                    continue
-
-
-                if compression_type == 0: # this should never run, but is here in case we change compression type
-                  
-                    print(f"    comp 0 rle start")
-                    run_data = bytearray()
-                    while x < width and pixels[y * width + x] != (0,0,0,0):
-                       run_data.append(pixels[y * width + x][0])
-                       x+=1
-
-                    print(f"    comp 0 rle end.  len(run_data)={len(run_data)}")
-                    rle_data.append(len(run_data))
-                    rle_data.extend(run_data)
-                
-                elif compression_type == 1:
-                  
-                  print(f"    comp 1 rle start")
-                  if  x < width and pixels[y * width + x] != (0,0,0,0):
-                    
-                    r = pixels[y*width+x][0]
-                    if x+1 < width and pixels[y*width+x] == pixels[y*width+x+1]:
-                      repeat_count = 0
-                      while x < width and pixels[y*width+x] == pixels[y*width+start_x] and pixels[y*width+x] != (0,0,0,0):
-                           repeat_count += 1
-                           x+=1
-
-                      print(f"    comp 1 repeat: repeat_count={repeat_count}, r={r}")
-                      rle_data.append((repeat_count << 1)|1)
-                      rle_data.append(r)
-
-                    else:
-                        run_data = bytearray()
-                        while x < width and pixels[y * width + x] != (0,0,0,0):
-                          run_data.append(pixels[y * width + x][0])
-                          x+=1
-
-                        print(f"    comp 1 rle end.  len(run_data)={len(run_data)}")
-                        rle_data.append(len(run_data)<<1)
-                        rle_data.extend(run_data)
-
-        return bytes(rle_data), line_offsets
+        lines = encode_lines(np.asarray(pixels, dtype=np.uint8).reshape(height, width))
+        line_offsets = []
+        pos = 0
+        for line in lines:
+            line_offsets.append(pos)
+            pos += len(line)
+        return b"".join(lines), line_offsets
     except Exception as e:
       print(f"Error in rle_encode: {e}")
       sys.exit(1)
@@ -105,10 +49,6 @@ def create_minimal_flx(output_filename, input_png):
         output_filename (str): The path to the output FLX file.
     """
     try:
-        flx = flx_lib.FlxFile("") # Create a new FlxFile with no data
-        flx.file_data = bytearray() # Remove old data
-
-        
         surface = pygame.image.load(input_png)
         pixels, width, height = read_pixel_data(surface)
         rle_data, line_offsets = rle_encode(pixels, width, height)
@@ -141,19 +81,8 @@ def create_minimal_flx(output_filename, input_png):
         shape_data.extend(struct.pack("<H", len(frame_data)))
         
         
-        flx.num_types = 1
-        flx.type_positions = [128]
-        flx.type_sizes = [len(shape_data)]
-        
-        
-        with open(output_filename,'wb') as f:
-            ods = flx_lib.OAutoBufferDataSource()
-            flx._write_header(ods, [shape_data,frame_data,rle_data])
-            ods.write(shape_data, len(shape_data))
-            ods.write(frame_data, len(frame_data))
-            ods.write(rle_data, len(rle_data))
-            f.write(ods.getBuf())
-            print(f"Generated minimal file {output_filename}")
+        flx_lib.write_flx(output_filename, [shape_data, frame_data, rle_data])
+        print(f"Generated minimal file {output_filename}")
             
     except Exception as e:
             print(f"An error occurred {e}")
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# decode_shapes.py
+# Bulk-decodes every frame of a U8 shape archive (U8SHAPES.FLX) across
+# worker processes, to export or just validate the whole archive.
+# - Shapes are sharded into contiguous ranges of roughly equal pixel count.
+# - Each worker opens its own shape_lib.ShapeFile (its own mmap) and decodes
+#   its shapes in batches of frames (ShapeFile.decode_many).
+# - Output: PNG per frame, .npy index array per frame, or one packed .npz
+#   (frame table + all index pixels back to back). "none" only validates.
+# - Prints frames/sec and MB/s (compressed frame data in, index pixels out).
+#
+# Usage:
+#   python decode_shapes.py U8SHAPES.FLX --format png --out frames
+#   python decode_shapes.py U8SHAPES.FLX --format pack --out u8shapes_frames.npz
+#   python decode_shapes.py U8SHAPES.FLX --workers 8          (validate only)
+#
+# Requirements: numpy (Pillow for --format png)
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from palette_lib import Palette
+from shape_lib import ShapeFile, ShapeIndex
+
+FORMATS = ("none", "npy", "png", "pack")
+BATCH_PIXELS = 1 << 22      # pixels per decode_many call (bounds its index arrays)
+
+# Frame table of a packed archive; pixels[offset:offset+width*height] is
+# the frame's (height, width) index array.
+PACK_DTYPE = np.dtype([
+    ("shape", "<u2"), ("frame", "<u2"),
+    ("width", "<u2"), ("height", "<u2"),
+    ("xoff", "<i2"), ("yoff", "<i2"),
+    ("offset", "<u8"),
+])
+
+
+@dataclass
+class DecodeReport:
+    frames: int = 0
+    pixels: int = 0            # decoded index bytes
+    bytes_in: int = 0          # compressed frame bytes (frame table sizes)
+    seconds: float = 0.0
+    workers: int = 1
+    errors: List[Tuple[int, int, str]] = field(default_factory=list)
+
+    @property
+    def frames_per_sec(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_in_per_sec(self) -> float:
+        return self.bytes_in / self.seconds / 1e6 if self.seconds else 0.0
+
+    @property
+    def mb_out_per_sec(self) -> float:
+        return self.pixels / self.seconds / 1e6 if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.frames} frames in {self.seconds:.2f}s with {self.workers} worker(s): "
+                f"{self.frames_per_sec:.0f} frames/s, {self.mb_in_per_sec:.1f} MB/s in, "
+                f"{self.mb_out_per_sec:.1f} MB/s out, {len(self.errors)} error(s)")
+
+
+# ---------- Sharding ----------
+
+def shard_shapes(index: ShapeIndex, count: int, shapes=None) -> List[List[int]]:
+    """
+    Splits shapes into at most `count` contiguous runs of roughly equal
+    pixel count (sum of frame width*height), skipping shapes with no frames.
+    """
+    if shapes is None:
+        shapes = range(index.num_shapes)
+    weights = []
+    for s in shapes:
+        a, b = index.first[s], index.first[s + 1]
+        if a == b:
+            continue
+        px = sum(index.width[i] * index.height[i] for i in range(a, b))
+        weights.append((s, px + 64 * (b - a)))   # + per-frame overhead
+    if not weights:
+        return []
+    total = sum(w for _, w in weights)
+    target = total / max(1, count)
+    shards, cur, acc = [], [], 0
+    for s, w in weights:
+        cur.append(s)
+        acc += w
+        if acc >= target and len(shards) < count - 1:
+            shards.append(cur)
+            cur, acc = [], 0
+    if cur:
+        shards.append(cur)
+    return shards
+
+
+# ---------- Worker ----------
+
+def _batches(index: ShapeIndex, shapes: List[int]):
+    """Consecutive runs of shapes of about BATCH_PIXELS pixels, for decode_many."""
+    batch, px = [], 0
+    for s in shapes:
+        batch.append(s)
+        px += sum(index.width[i] * index.height[i] for i in range(index.first[s], index.first[s + 1]))
+        if px >= BATCH_PIXELS:
+            yield batch
+            batch, px = [], 0
+    if batch:
+        yield batch
+
+
+def _decode_shard(flx_path: str, pal_path: Optional[str], shapes: List[int], fmt: str, out: Optional[str]):
+    """Runs in a worker process; returns counters, errors and (pack) table rows + pixels."""
+    palette = Palette.load(pal_path) if fmt == "png" else None
+    rows, chunks, errors = [], [], []
+    frames = pixels = bytes_in = 0
+    with ShapeFile(flx_path) as sf:
+        index = sf.index
+        for batch in _batches(index, shapes):
+            keys = [(s, f) for s in batch for f in range(index.frame_count(s))]
+            decoded = sf.decode_many(keys)
+            for k, (s, f) in enumerate(keys):
+                try:
+                    px, xoff, yoff, _ = decoded[k]
+                except ValueError as e:
+                    errors.append((s, f, str(e)))
+                    continue
+                h, w = px.shape
+                frames += 1
+                pixels += px.size
+                bytes_in += index.size[index.first[s] + f]
+                if fmt == "npy":
+                    np.save(os.path.join(out, f"shape_{s:04d}_frame_{f:04d}.npy"), px)
+                elif fmt == "png":
+                    palette.to_image(px).save(os.path.join(out, f"shape_{s:04d}_frame_{f:04d}.png"))
+                elif fmt == "pack":
+                    rows.append((s, f, w, h, xoff, yoff, 0))
+                    chunks.append(px.tobytes())
+    return frames, pixels, bytes_in, errors, rows, b"".join(chunks)
+
+
+# ---------- API ----------
+
+def decode_archive(flx_path, out=None, fmt: str = "none", pal_path=None,
+                   workers: Optional[int] = None, shapes=None) -> DecodeReport:
+    """
+    Decodes every frame of an archive in parallel.
+
+    Args:
+        flx_path: Shape archive (U8SHAPES.FLX).
+        out: Output directory (png/npy) or .npz file (pack).
+        fmt (str): One of FORMATS.
+        pal_path: Palette for png output; defaults to U8PAL.PAL next to flx_path.
+        workers (int): Process count; defaults to os.cpu_count(). 1 decodes
+            in this process.
+        shapes: Shape numbers to decode; defaults to all.
+
+    Returns:
+        DecodeReport: Counters, timing and per-frame decode errors.
+
+    Raises:
+        ValueError: On an unknown format or missing output path.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}")
+    if fmt != "none" and not out:
+        raise ValueError(f"--out is required for format {fmt!r}")
+    flx_path = os.fspath(flx_path)
+    if fmt == "png" and pal_path is None:
+        pal_path = os.path.join(os.path.dirname(os.path.abspath(flx_path)), "U8PAL.PAL")
+    if fmt in ("png", "npy"):
+        os.makedirs(out, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    index = ShapeIndex.load(flx_path)   # builds the sidecar once, before the workers read it
+    # a few shards per worker keeps the pool busy when shard costs differ
+    shards = shard_shapes(index, workers * 4 if workers > 1 else 1, shapes)
+    args = [(flx_path, pal_path, shard, fmt, out) for shard in shards]
+    if workers == 1:
+        results = [_decode_shard(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_decode_shard, *zip(*args))) if args else []
+
+    report = DecodeReport(workers=workers)
+    all_rows, all_pixels = [], []
+    for frames, pixels, bytes_in, errors, rows, blob in results:
+        report.frames += frames
+        report.pixels += pixels
+        report.bytes_in += bytes_in
+        report.errors.extend(errors)
+        all_rows.extend(rows)
+        all_pixels.append(blob)
+    if fmt == "pack":
+        table = np.array(all_rows, dtype=PACK_DTYPE)
+        sizes = table["width"].astype(np.uint64) * table["height"]
+        table["offset"] = np.cumsum(sizes) - sizes
+        np.savez(out, table=table, pixels=np.frombuffer(b"".join(all_pixels), dtype=np.uint8))
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def load_pack(path):
+    """Reads a packed archive; returns {(shape, frame): (pixels, xoff, yoff)}."""
+    with np.load(path) as z:
+        table, pixels = z["table"], z["pixels"]
+    frames = {}
+    for row in table:
+        w, h, off = int(row["width"]), int(row["height"]), int(row["offset"])
+        frames[(int(row["shape"]), int(row["frame"]))] = (
+            pixels[off:off + w * h].reshape(h, w), int(row["xoff"]), int(row["yoff"]))
+    return frames
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Decode every frame of a U8 shape archive.")
+    ap.add_argument("flx", nargs="?", default="U8SHAPES.FLX")
+    ap.add_argument("--format", choices=FORMATS, default="none")
+    ap.add_argument("--out", help="output directory (png/npy) or .npz file (pack)")
+    ap.add_argument("--pal", help="palette for png output (default: U8PAL.PAL next to the FLX)")
+    ap.add_argument("--workers", type=int, default=None)
+    a = ap.parse_args()
+
+    try:
+        report = decode_archive(a.flx, a.out, a.format, a.pal, a.workers)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    for s, f, msg in report.errors[:20]:
+        print(f"shape {s} frame {f}: {msg}")
+    print(report.summary())
+    sys.exit(1 if report.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# export_tiles.py
+# Exports U8 maps as slippy-map tile pyramids: <out>/<map>/<z>/<x>/<y>.png
+# - The deepest level is 1:1 (one screen pixel per projected unit); each
+#   level above halves the scale, level 0 is a single tile.
+# - Tiles are rendered straight from map_lib.ScreenIndex grid queries and
+#   parent tiles are built from their four children, depth-first, so a map
+#   is never held as one image (memory: a few tiles per level).
+# - Each tile's inputs (objects on it, the shape records they use, palette,
+#   tile origin) are hashed into <out>/<map>/tiles.json; unchanged tiles are
+#   neither rendered nor written on the next run, and tiles that vanished
+#   are deleted.
+# - Maps are spread over worker processes.
+#
+# Usage:
+#   python export_tiles.py --out tiles                    (all maps)
+#   python export_tiles.py --out tiles --maps 3 5 --format webp --workers 4
+#
+# Requirements: numpy, Pillow
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from hashlib import blake2b
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from cache_lib import FrameCache
+from flx_lib import FlxIndex
+from map_lib import NUM_MAPS, GlobTable, MapFile, ScreenIndex, map_items, open_nonfixed
+from palette_lib import Palette
+from shape_lib import ShapeFile
+
+TILE_SIZE = 256
+FORMATS = ("png", "webp")
+MANIFEST_NAME = "tiles.json"
+# Bump when the rendering changes, so old manifests stop matching.
+RENDER_VERSION = 1
+FRAME_CACHE_BYTES = 64 * 1024 * 1024
+
+
+@dataclass
+class MapReport:
+    map: int
+    levels: int = 0
+    rendered: int = 0
+    skipped: int = 0
+    removed: int = 0
+    seconds: float = 0.0
+
+
+# ---------- Inputs ----------
+
+class _Sources:
+    """Per-process open archives, the frame cache and shape record digests."""
+
+    def __init__(self, static: str, nonfixed: Optional[str], glob_bias: bool):
+        self.shapes = ShapeFile(os.path.join(static, "U8SHAPES.FLX"))
+        self.records = FlxIndex.from_buffer(self.shapes.data)
+        self.palette = Palette.load(os.path.join(static, "U8PAL.PAL"))
+        self.fixed = MapFile(os.path.join(static, "FIXED.DAT"))
+        self.nonfixed = open_nonfixed(nonfixed) if nonfixed else None
+        glob_path = os.path.join(static, "GLOB.FLX")
+        self.globs = GlobTable.load(glob_path) if os.path.exists(glob_path) else None
+        self.y_bias = -576 if glob_bias else 0
+        self.frames = FrameCache(FRAME_CACHE_BYTES)
+        self._shape_digests: Dict[int, bytes] = {}
+        self.base_digest = blake2b(
+            b"%d %d" % (RENDER_VERSION, TILE_SIZE) + self.palette.lut.tobytes(), digest_size=16).digest()
+
+    def close(self):
+        self.shapes.close()
+        self.fixed.close()
+        if self.nonfixed:
+            self.nonfixed.close()
+
+    def map_items(self, idx: int) -> np.ndarray:
+        return map_items(idx, self.fixed, self.nonfixed, self.globs, self.y_bias)
+
+    def shape_digest(self, shape: int) -> bytes:
+        d = self._shape_digests.get(shape)
+        if d is None:
+            off, size = self.records[shape]
+            d = blake2b(self.shapes.data[off:off + size], digest_size=8).digest()
+            self._shape_digests[shape] = d
+        return d
+
+    def frame_image(self, shape: int, frame: int) -> Optional[Image.Image]:
+        def load():
+            try:
+                pixels = self.shapes.decode(shape, frame).pixels
+            except (IndexError, ValueError):
+                return None
+            return self.palette.to_image(pixels) if pixels.size else None
+        return self.frames.get_or_load((shape, frame), load)
+
+    def prefetch(self, shapes, frames):
+        """Decodes the valid frames not cached yet in one batch (ShapeFile.decode_many)."""
+        counts = self.shapes.index.frame_counts
+        keys = sorted({(s, f) for s, f in zip(shapes, frames)
+                       if 0 <= s < len(counts) and 0 <= f < counts[s] and (s, f) not in self.frames})
+        if not keys:
+            return
+        decoded = self.shapes.decode_many(keys)
+        for k, key in enumerate(keys):
+            try:
+                pixels = decoded[k].pixels
+            except ValueError:
+                pixels = None
+            self.frames.put(key, self.palette.to_image(pixels) if pixels is not None and pixels.size else None)
+
+
+# ---------- Tiles ----------
+
+def _composite(dst: Image.Image, src: Image.Image, x: int, y: int):
+    """alpha_composite with src clipped to dst (PIL rejects negative dest)."""
+    sx, sy = max(0, -x), max(0, -y)
+    w = min(src.width - sx, dst.width - max(0, x))
+    h = min(src.height - sy, dst.height - max(0, y))
+    if w > 0 and h > 0:
+        dst.alpha_composite(src, dest=(max(0, x), max(0, y)), source=(sx, sy, sx + w, sy + h))
+
+
+def _downsample(children, t: int) -> Image.Image:
+    """Four child tiles (or None) -> one parent tile at half scale."""
+    big = Image.new("RGBa", (2 * t, 2 * t))
+    for (dx, dy), img in children:
+        if img is not None:
+            big.paste(img.convert("RGBa"), (dx * t, dy * t))
+    return big.reduce(2).convert("RGBA")
+
+
+class _MapExport:
+    def __init__(self, src: _Sources, idx: int, out: str, fmt: str):
+        self.src = src
+        self.out = os.path.join(out, f"{idx:03d}")
+        self.fmt = fmt
+        self.report = MapReport(idx)
+        self.scene = ScreenIndex(src.map_items(idx), src.shapes.index, clamp_frames=False)
+        self.old, self.old_fmt = {}, fmt
+        try:
+            with open(os.path.join(self.out, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                old = json.load(f)
+            self.old, self.old_fmt = old.get("tiles", {}), old.get("format", fmt)
+        except (OSError, ValueError):
+            pass
+        self.tiles: Dict[str, str] = {}
+        self.origin = None
+        self.zmax = 0
+
+    def _path(self, key: str, fmt: str = None) -> str:
+        return os.path.join(self.out, *key.split("/")) + "." + (fmt or self.fmt)
+
+    def _save(self, img: Image.Image, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        if self.fmt == "webp":
+            img.save(tmp, "WEBP", lossless=True)
+        else:
+            img.save(tmp, "PNG")
+        os.replace(tmp, path)
+
+    def _unchanged(self, key: str, digest: str) -> bool:
+        return (self.old_fmt == self.fmt and self.old.get(key) == digest
+                and os.path.exists(self._path(key)))
+
+    def _leaf(self, tx: int, ty: int):
+        t = TILE_SIZE
+        left, top = self.origin[0] + tx * t, self.origin[1] + ty * t
+        vis = self.scene.visible(left, top, left + t, top + t)
+        if not len(vis):
+            return None
+        items = self.scene.items[vis]
+        h = blake2b(self.src.base_digest, digest_size=16)
+        h.update(b"%d %d" % (left, top))
+        h.update(np.ascontiguousarray(items).tobytes())
+        for s in np.unique(items["shape"]).tolist():
+            h.update(self.src.shape_digest(s))
+        digest = h.hexdigest()
+        key = f"{self.zmax}/{tx}/{ty}"
+        return self._emit(key, digest, lambda: self._render_leaf(vis, left, top))
+
+    def _render_leaf(self, vis, left: int, top: int) -> Image.Image:
+        img = Image.new("RGBA", (TILE_SIZE, TILE_SIZE))
+        shapes, frames = self.scene.items["shape"][vis].tolist(), self.scene.items["frame"][vis].tolist()
+        self.src.prefetch(shapes, frames)
+        for (x0, y0, _, _), shape, frame in zip(self.scene.boxes[vis].tolist(), shapes, frames):
+            fr = self.src.frame_image(shape, frame)
+            if fr is not None:
+                _composite(img, fr, x0 - left, y0 - top)
+        return img
+
+    def _node(self, z: int, tx: int, ty: int):
+        """(digest, image loader) of tile z/tx/ty, or None when it is empty."""
+        if z == self.zmax:
+            return self._leaf(tx, ty)
+        kids = [((dx, dy), self._node(z + 1, 2 * tx + dx, 2 * ty + dy)) for dy in (0, 1) for dx in (0, 1)]
+        kids = [(pos, k) for pos, k in kids if k is not None]
+        if not kids:
+            return None
+        h = blake2b(digest_size=16)
+        for (dx, dy), (digest, _) in kids:
+            h.update(b"%d%d" % (dx, dy) + digest.encode())
+        key = f"{z}/{tx}/{ty}"
+        return self._emit(key, h.hexdigest(),
+                          lambda: _downsample([(pos, load()) for pos, (_, load) in kids], TILE_SIZE))
+
+    def _emit(self, key: str, digest: str, render):
+        path = self._path(key)
+        self.tiles[key] = digest
+        if self._unchanged(key, digest):
+            self.report.skipped += 1
+            return digest, lambda: Image.open(path).convert("RGBA")
+        img = render()
+        self._save(img, path)
+        self.report.rendered += 1
+        return digest, lambda: img
+
+    def run(self) -> MapReport:
+        start = time.perf_counter()
+        bounds = self.scene.bounds()
+        if bounds is not None:
+            # leaf tiles sit on a TILE_SIZE grid of screen coordinates
+            t = TILE_SIZE
+            self.origin = (bounds[0] // t * t, bounds[1] // t * t)
+            span = max(bounds[2] - self.origin[0], bounds[3] - self.origin[1])
+            self.zmax = max(0, math.ceil(math.log2(span / TILE_SIZE))) if span > TILE_SIZE else 0
+            self.report.levels = self.zmax + 1
+            self._node(0, 0, 0)
+        stale = set(self.old) if self.old_fmt != self.fmt else set(self.old) - set(self.tiles)
+        for key in stale:
+            try:
+                os.remove(self._path(key, self.old_fmt))
+                self.report.removed += 1
+            except OSError:
+                pass
+        if self.tiles or self.old:
+            os.makedirs(self.out, exist_ok=True)
+            manifest = {"format": self.fmt, "tile_size": TILE_SIZE,
+                        "levels": self.report.levels,
+                        "origin": list(self.origin) if self.origin else None,
+                        "tiles": self.tiles}
+            tmp = os.path.join(self.out, MANIFEST_NAME + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=0, sort_keys=True)
+            os.replace(tmp, os.path.join(self.out, MANIFEST_NAME))
+        self.report.seconds = time.perf_counter() - start
+        return self.report
+
+
+# ---------- Worker / API ----------
+
+REQUIRED_FILES = ("U8SHAPES.FLX", "U8PAL.PAL", "FIXED.DAT")
+
+
+def check_inputs(static: str, nonfixed: Optional[str] = None):
+    """Raises FileNotFoundError here rather than in every pool worker's initializer."""
+    for path in [os.path.join(static, name) for name in REQUIRED_FILES] + ([nonfixed] if nonfixed else []):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} not found")
+
+
+_worker_sources: Optional[_Sources] = None
+
+
+def _init_worker(static, nonfixed, glob_bias):
+    global _worker_sources
+    _worker_sources = _Sources(static, nonfixed, glob_bias)
+
+
+def _export_map(idx: int, out: str, fmt: str) -> MapReport:
+    return _MapExport(_worker_sources, idx, out, fmt).run()
+
+
+def export_maps(static, out, maps=None, fmt: str = "png", nonfixed=None,
+                glob_bias: bool = False, workers: Optional[int] = None) -> List[MapReport]:
+    """
+    Exports the tile pyramids of several maps.
+
+    Args:
+        static: STATIC directory (U8SHAPES.FLX, U8PAL.PAL, FIXED.DAT, GLOB.FLX).
+        out: Output root; each map goes to <out>/<map:03d>/.
+        maps: Map numbers; defaults to every map in FIXED.DAT.
+        fmt (str): "png" or "webp" (lossless).
+        nonfixed: NONFIXED.DAT to overlay, or None.
+        glob_bias (bool): Apply the old -576 glob Y bias.
+        workers (int): Processes; defaults to os.cpu_count(). 1 runs here.
+
+    Returns:
+        list: One MapReport per map, in map order.
+
+    Raises:
+        ValueError: On an unknown format.
+        FileNotFoundError: If an input archive is missing.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}")
+    static = os.fspath(static)
+    check_inputs(static, os.fspath(nonfixed) if nonfixed else None)
+    if maps is None:
+        with MapFile(os.path.join(static, "FIXED.DAT")) as mf:
+            maps = [i for i in range(min(len(mf), NUM_MAPS)) if len(mf.objects(i))]
+    workers = workers or os.cpu_count() or 1
+    init = (static, os.fspath(nonfixed) if nonfixed else None, glob_bias)
+    if workers == 1:
+        _init_worker(*init)
+        try:
+            return [_export_map(m, out, fmt) for m in maps]
+        finally:
+            _worker_sources.close()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init) as pool:
+        return list(pool.map(_export_map, maps, [out] * len(maps), [fmt] * len(maps)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export U8 maps as z/x/y tile pyramids.")
+    ap.add_argument("--static", default=".", help="STATIC directory (default: current)")
+    ap.add_argument("--out", required=True, help="output root directory")
+    ap.add_argument("--maps", type=int, nargs="*", help="map numbers (default: all non-empty)")
+    ap.add_argument("--format", choices=FORMATS, default="png")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--nonfixed", help="NONFIXED.DAT or saved game (U8SAVE.000) to overlay "
+                                        "(default: ../GAMEDAT/NONFIXED.DAT if present)")
+    src.add_argument("--no-nonfixed", action="store_true")
+    ap.add_argument("--glob-bias", action="store_true", help="apply the old -576 glob Y bias")
+    ap.add_argument("--workers", type=int, default=None)
+    a = ap.parse_args()
+
+    nonfixed = a.nonfixed
+    if nonfixed is None and not a.no_nonfixed:
+        guess = os.path.join(os.path.dirname(os.path.abspath(a.static)), "GAMEDAT", "NONFIXED.DAT")
+        nonfixed = guess if os.path.exists(guess) else None
+
+    start = time.perf_counter()
+    try:
+        reports = export_maps(a.static, a.out, a.maps, a.format, nonfixed, a.glob_bias, a.workers)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    except BrokenProcessPool as e:
+        print(f"Error: an export worker failed to start ({e})")
+        sys.exit(1)
+    for r in reports:
+        print(f"map {r.map:3d}: {r.levels} levels, {r.rendered} rendered, {r.skipped} unchanged, "
+              f"{r.removed} removed ({r.seconds:.2f}s)")
+    total = {k: sum(getattr(r, k) for r in reports) for k in ("rendered", "skipped", "removed")}
+    print(f"{len(reports)} maps in {time.perf_counter() - start:.2f}s: {total['rendered']} tiles rendered, "
+          f"{total['skipped']} unchanged, {total['removed']} removed")
+
+
+if __name__ == "__main__":
+    main()
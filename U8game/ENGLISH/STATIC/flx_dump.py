@@ -13,7 +13,7 @@ def dump_flx_data(filename, output_filename):
     """
 
     try:
-        flx = flx_lib.FlxFile(filename)
+        flx = flx_lib.FlxFile(filename, use_mmap=True)
     except FileNotFoundError as e:
         print(e)
         sys.exit(1)
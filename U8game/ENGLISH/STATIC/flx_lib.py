@@ -1,76 +1,731 @@
+import mmap
 import struct
+import sys
+from array import array
 from pathlib import Path
 import os
 
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+
 class OAutoBufferDataSource:
+	"""
+	Growable little-endian write buffer (Pentagram's OAutoBufferDataSource).
+
+	Capacity at least doubles whenever a write runs past it, so a long run of
+	sequential writes costs amortized O(1) per byte. The logical size is the
+	furthest position written; getBuf() trims the buffer to it.
+	"""
 	def __init__(self,initial_size = 1024):
 		self.buf = bytearray(initial_size)
 		self.pos = 0
+		self.size = 0
 
 	def clear(self):
 		self.pos = 0
-
-	def write(self, data, size):
-		if (self.pos + size) > len(self.buf):
-			self.buf.extend(bytearray((self.pos + size) - len(self.buf)))
+		self.size = 0
+
+	def _reserve(self, end):
+		"""Makes room for writing up to end, growing geometrically."""
+		if end > len(self.buf):
+			self.buf.extend(bytes(max(end, 2 * len(self.buf), 64) - len(self.buf)))
+		if end > self.size:
+			self.size = end
+
+	def write(self, data, size = None):
+		"""Writes size bytes of data (all of it when size is None)."""
+		if size is None:
+			size = memoryview(data).nbytes
+		self._reserve(self.pos + size)
 		self.buf[self.pos:self.pos+size] = data
 		self.pos+=size
 
 	def write1(self, data):
-		if (self.pos + 1) > len(self.buf):
-			self.buf.extend(bytearray(1))
+		self._reserve(self.pos + 1)
 		self.buf[self.pos] = data
 		self.pos+=1
 
 	def write2(self, data):
-		if (self.pos + 2) > len(self.buf):
-			self.buf.extend(bytearray(2))
-		self.buf[self.pos:self.pos+2] = struct.pack("<H",data)
+		self._reserve(self.pos + 2)
+		_U16.pack_into(self.buf, self.pos, data)
 		self.pos+=2
 
 	def write4(self, data):
-		if (self.pos + 4) > len(self.buf):
-			self.buf.extend(bytearray(4))
-		self.buf[self.pos:self.pos+4] = struct.pack("<I",data)
+		self._reserve(self.pos + 4)
+		_U32.pack_into(self.buf, self.pos, data)
 		self.pos+=4
 
+	def write_struct(self, st, *values):
+		"""
+		Packs values with a struct.Struct (or format string) in one call.
+
+		Args:
+			st: struct.Struct instance or format string, e.g. "<8H".
+			*values: The values to pack.
+		"""
+		if not isinstance(st, struct.Struct):
+			st = struct.Struct(st)
+		self._reserve(self.pos + st.size)
+		st.pack_into(self.buf, self.pos, *values)
+		self.pos+=st.size
+
+	def write_array(self, data):
+		"""
+		Writes an array.array, NumPy array or other buffer as raw bytes.
+
+		array.array data is byteswapped to little-endian on big-endian hosts;
+		NumPy arrays should already have a little-endian dtype ("<u2", ...).
+		"""
+		if isinstance(data, array) and data.itemsize > 1 and sys.byteorder != "little":
+			data = array(data.typecode, data)
+			data.byteswap()
+		view = memoryview(data)
+		if not view.c_contiguous:
+			view = memoryview(view.tobytes())
+		self.write(view.cast("B"))
+
+	def fill(self, value, count):
+		"""Writes count copies of the byte value."""
+		self._reserve(self.pos + count)
+		self.buf[self.pos:self.pos+count] = bytes((value,)) * count
+		self.pos+=count
+
 	def seek(self, pos):
 		self.pos = pos
 
 	def getPos(self):
 		return self.pos
 
+	def getSize(self):
+		return self.size
+
 	def getBuf(self):
+		"""The written bytes (the buffer itself, trimmed to getSize())."""
+		del self.buf[self.size:]
 		return self.buf
 
+FLX_SIGNATURE_SIZE = 0x52
+FLX_COUNT_OFFSET = 0x54
+FLX_TABLE_OFFSET = 0x80
+# Older viewer scripts assumed the record table started at 0x90. Only used
+# as a fallback when the Pentagram layout does not validate.
+FLX_LEGACY_TABLE_OFFSET = 0x90
+
+
+class FlxIndex:
+    """
+    Packed record table of an FLX archive.
+
+    Offsets and sizes are stored interleaved in a single array('I'), i.e. 8
+    bytes per record, and are exposed as the strided memoryviews `offsets`
+    and `sizes` (both also accept NumPy's buffer protocol).
+
+    Header layout (Pentagram FlexFile):
+        0x00..0x51  title, padded with 0x1A
+        0x54        u32 record count (older docs: u16)
+        0x80        count * (u32 offset, u32 size)
+    """
+    __slots__ = ("count", "table_offset", "table", "offsets", "sizes", "__weakref__")
+
+    def __init__(self, table: array, table_offset: int = FLX_TABLE_OFFSET):
+        self.table = table
+        self.count = len(table) // 2
+        self.table_offset = table_offset
+        view = memoryview(table)
+        self.offsets = view[0::2]
+        self.sizes = view[1::2]
+
+    @staticmethod
+    def is_flex(buf) -> bool:
+        """
+        Checks the 0x1A title padding the same way Pentagram's FlexFile does.
+
+        Args:
+            buf: Any object supporting the buffer protocol (bytes, mmap, ...).
+
+        Returns:
+            bool: True if the header looks like an FLX archive.
+        """
+        if len(buf) < FLX_TABLE_OFFSET:
+            return False
+        head = bytes(buf[:FLX_SIGNATURE_SIZE])
+        i = head.find(0x1A)
+        if i < 0:
+            return False
+        return head[i:] == b"\x1a" * (FLX_SIGNATURE_SIZE - i)
+
+    @staticmethod
+    def _table_fits(buf, table_offset: int, count: int, file_size: int) -> bool:
+        end = table_offset + count * 8
+        if end > len(buf):
+            return False
+        for off, size in struct.iter_unpack("<II", buf[table_offset:end]):
+            if size and (off < end or off + size > file_size):
+                return False
+        return True
+
+    @classmethod
+    def detect_layout(cls, buf, file_size: int = None):
+        """
+        Works out the record count and table position of an FLX header.
+
+        The count is read as a u32 at 0x54 and falls back to a u16 when the
+        upper half holds junk. The table is taken from 0x80 unless its entries
+        point outside the file, in which case the legacy 0x90 layout is tried.
+
+        Args:
+            buf: The archive, or at least its header and record table.
+            file_size (int): Size of the whole archive if buf is only a prefix.
+
+        Returns:
+            tuple: (count, table_offset)
+        Raises:
+            ValueError: If no known layout matches the data.
+        """
+        if not cls.is_flex(buf):
+            raise ValueError("Not an FLX archive (missing 0x1A header padding)")
+        if file_size is None:
+            file_size = len(buf)
+        count32 = struct.unpack_from("<I", buf, FLX_COUNT_OFFSET)[0]
+        count16 = count32 & 0xFFFF
+        for count in dict.fromkeys((count32, count16)):
+            for table_offset in (FLX_TABLE_OFFSET, FLX_LEGACY_TABLE_OFFSET):
+                if cls._table_fits(buf, table_offset, count, file_size):
+                    return count, table_offset
+        raise ValueError("FLX record table does not match any known header layout")
+
+    @classmethod
+    def from_buffer(cls, buf, file_size: int = None) -> "FlxIndex":
+        """
+        Parses the record table out of an in-memory or mapped archive.
+
+        Args:
+            buf: The archive contents (bytes, bytearray, mmap or memoryview).
+            file_size (int): Size of the whole archive if buf is only a prefix.
+
+        Returns:
+            FlxIndex: The parsed index.
+        Raises:
+            ValueError: If the header cannot be recognised.
+        """
+        count, table_offset = cls.detect_layout(buf, file_size)
+        table = array("I")
+        table.frombytes(buf[table_offset:table_offset + count * 8])
+        if sys.byteorder != "little":
+            table.byteswap()
+        return cls(table, table_offset)
+
+    @classmethod
+    def from_file(cls, path) -> "FlxIndex":
+        """
+        Reads only the header and record table of an archive on disk.
+
+        Args:
+            path: The path to the FLX file.
+
+        Returns:
+            FlxIndex: The parsed index.
+        Raises:
+            ValueError: If the header cannot be recognised.
+        """
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read(FLX_TABLE_OFFSET)
+            if not cls.is_flex(head):
+                raise ValueError(f"Not an FLX archive: {path}")
+            count = struct.unpack_from("<I", head, FLX_COUNT_OFFSET)[0]
+            want = min(size, FLX_LEGACY_TABLE_OFFSET + count * 8)
+            data = head + f.read(want - len(head))
+        return cls.from_buffer(data, size)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int):
+        """Returns (offset, size) of a record."""
+        if index < 0 or index >= self.count:
+            raise IndexError("Invalid record index")
+        return self.table[2 * index], self.table[2 * index + 1]
+
+    def __iter__(self):
+        table = self.table
+        for i in range(0, len(table), 2):
+            yield table[i], table[i + 1]
+
+    def offset(self, index: int) -> int:
+        return self[index][0]
+
+    def size(self, index: int) -> int:
+        return self[index][1]
+
+    def nbytes(self) -> int:
+        """Memory held by the packed table."""
+        return self.table.itemsize * len(self.table)
+
+
+_index_cache = {}
+
+def get_flx_index(path) -> FlxIndex:
+    """
+    Returns the FlxIndex for an archive, parsing its table once per process.
+
+    Entries are keyed on the resolved path plus size and mtime, so an archive
+    rewritten on disk is re-parsed on the next call.
+
+    Args:
+        path: The path to the FLX file.
+
+    Returns:
+        FlxIndex: The shared index for the file.
+    """
+    real = os.path.realpath(path)
+    st = os.stat(real)
+    key = (real, st.st_size, st.st_mtime_ns)
+    index = _index_cache.get(real)
+    if index is None or index[0] != key:
+        index = (key, FlxIndex.from_file(real))
+        _index_cache[real] = index
+    return index[1]
+
+
+FLX_TITLE_SIZE = 0x50
+FLX_SIZE_OFFSET = 0x5C
+
+
+def flx_header(sizes) -> bytearray:
+    """
+    Builds the header and record table for records of the given sizes.
+
+    The layout is the one FlxFile._write_header produces: 0x1A title padding,
+    the record count at 0x54, 1 at 0x58, the file size at 0x5C and then one
+    (offset, size) pair per record at 0x80, with offset 0 for empty records.
+    The table is packed in a single call.
+
+    Args:
+        sizes: Record sizes in bytes, in record order.
+
+    Returns:
+        bytearray: The first 0x80 + 8 * count bytes of the archive.
+    """
+    sizes = list(sizes)
+    count = len(sizes)
+    head = bytearray(FLX_TABLE_OFFSET + 8 * count)
+    head[:FLX_TITLE_SIZE + 2] = b"\x1a" * (FLX_TITLE_SIZE + 2)
+    table = [0] * (2 * count)
+    table[1::2] = sizes
+    offset = len(head)
+    for i, size in enumerate(sizes):
+        if size:
+            table[2 * i] = offset
+            offset += size
+    struct.pack_into("<III", head, FLX_COUNT_OFFSET, count, 1, offset)
+    struct.pack_into(f"<{2 * count}I", head, FLX_TABLE_OFFSET, *table)
+    return head
+
+
+def _record_chunks(record):
+    """Yields the bytes of one write_flx record source as memoryviews."""
+    if record is None:
+        return
+    try:
+        view = memoryview(record)
+    except TypeError:
+        for chunk in record:
+            yield memoryview(chunk)
+        return
+    yield view
+
+
+def stage_flx(path, records, count: int = None):
+    """
+    Writes an FLX archive record by record to <path>.tmp, without assembling
+    it in memory and without touching path itself.
+
+    Each record is either a bytes-like object (bytes, bytearray, a memoryview
+    into another archive's mapping, ...), None for an empty record, or an
+    iterable of bytes-like chunks (e.g. a generator encoding frames on the
+    fly). The data goes to the file in one sequential pass behind a zeroed
+    header; the header and table are filled in afterwards, so only the table
+    is ever held in memory.
+
+    Splitting the write from commit_flx lets a caller that reads the records
+    from a mapping of path release that mapping before the rename (Windows
+    refuses to replace a file that is open or mapped).
+
+    Args:
+        path: Final output file.
+        records: Iterable of record sources, in record order.
+        count (int): Number of records, for iterables without len(); taken
+            from len(records) when omitted.
+
+    Returns:
+        tuple: (temporary file path, size of the archive in bytes).
+    Raises:
+        ValueError: If records yields a different number of records than count.
+    """
+    if count is None:
+        if not hasattr(records, "__len__"):
+            records = list(records)
+        count = len(records)
+    tmp = os.fspath(path) + ".tmp"
+    sizes = array("I")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(bytes(FLX_TABLE_OFFSET + 8 * count))
+            for record in records:
+                size = 0
+                for chunk in _record_chunks(record):
+                    f.write(chunk)
+                    size += chunk.nbytes
+                sizes.append(size)
+            if len(sizes) != count:
+                raise ValueError(f"Expected {count} FLX records, got {len(sizes)}")
+            total = f.tell()
+            f.seek(0)
+            f.write(flx_header(sizes))
+    except BaseException:
+        discard_flx(tmp)
+        raise
+    return tmp, total
+
+
+def commit_flx(tmp, path):
+    """Renames a stage_flx temporary file over path; the temporary file is removed if that fails."""
+    try:
+        os.replace(tmp, path)
+    except BaseException:
+        discard_flx(tmp)
+        raise
+
+
+def discard_flx(tmp):
+    """Removes a stage_flx temporary file, if it is still there."""
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+
+def write_flx(path, records, count: int = None) -> int:
+    """
+    stage_flx followed by commit_flx: the archive is written to <path>.tmp
+    and renamed over path. Records must not come from a mapping of path
+    itself on Windows; use the two halves and release the mapping between
+    them there.
+
+    Returns:
+        int: Size of the written archive in bytes.
+    Raises:
+        ValueError: If records yields a different number of records than count.
+    """
+    tmp, total = stage_flx(path, records, count)
+    commit_flx(tmp, path)
+    return total
+
+
+class FlxPatcher:
+    """
+    Replaces records of an FLX archive on disk without rewriting the rest.
+
+    A record that still fits its slot is overwritten in place; one that grew
+    is extended into free space right behind it, or moved to the first free
+    gap that holds it, or appended at the end of the file. Only the record
+    data and its 8-byte table entry (plus the file size at 0x5C when the file
+    grows) are written, and the table entry is written last. Bytes that
+    another table entry also points to are never overwritten: a record
+    sharing its data is always moved.
+
+    Only a record that moves is switched over atomically by that entry: an
+    interrupted save then leaves the old record in effect. Data overwritten
+    in place (write_into, or replace when the record fits its slot or grows
+    into the gap behind it) is not crash safe; an interrupted write leaves
+    the record half old, half new. Keep a backup of the archive.
+
+    Free space is every byte between the record table and the end of the file
+    that no record uses, found from the table when the archive is opened and
+    kept in a sorted, coalesced free-list as records move. FlxFile.write_all
+    compacts an archive that has collected holes.
+    """
+
+    def __init__(self, path, mirror: bytearray = None):
+        """
+        Args:
+            path: The FLX file, opened for update.
+            mirror (bytearray): Optional in-memory copy of the file that gets
+                every write too (e.g. an editor's loaded archive).
+
+        Raises:
+            ValueError: If the header cannot be recognised.
+        """
+        self.path = path
+        self.mirror = mirror
+        self.index = FlxIndex.from_file(path)
+        self._file = open(path, "r+b")
+        self.end = os.fstat(self._file.fileno()).st_size
+        self._file.seek(FLX_SIZE_OFFSET)
+        self.size_field = struct.unpack("<I", self._file.read(4))[0]
+        self.free = self._find_free()
+
+    def _find_free(self):
+        """Sorted [offset, size] gaps not covered by any record."""
+        pos = self.index.table_offset + 8 * self.index.count
+        free = []
+        for off, size in sorted((off, size) for off, size in self.index if size):
+            if off > pos:
+                free.append([pos, off - pos])
+            pos = max(pos, off + size)
+        if self.end > pos:
+            free.append([pos, self.end - pos])
+        return free
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def free_bytes(self) -> int:
+        """Total size of the free-list."""
+        return sum(size for _, size in self.free)
+
+    # ---------- free-list ----------
+
+    def _shared(self, index: int, off: int, size: int) -> bool:
+        """True if a record other than index overlaps [off, off + size)."""
+        for i, (o, s) in enumerate(self.index):
+            if i != index and s and o < off + size and off < o + s:
+                return True
+        return False
+
+    def is_shared(self, index: int) -> bool:
+        """True if another record points into this record's bytes."""
+        off, size = self.index[index]
+        return bool(size) and self._shared(index, off, size)
+
+    def _release(self, index: int, off: int, size: int):
+        """Returns a span to the free-list unless another record still uses it."""
+        if size <= 0 or self._shared(index, off, size):
+            return
+        k = 0
+        while k < len(self.free) and self.free[k][0] < off:
+            k += 1
+        self.free.insert(k, [off, size])
+        # coalesce with the neighbours
+        if k + 1 < len(self.free) and off + size == self.free[k + 1][0]:
+            self.free[k][1] += self.free.pop(k + 1)[1]
+        if k > 0 and self.free[k - 1][0] + self.free[k - 1][1] == off:
+            self.free[k - 1][1] += self.free.pop(k)[1]
+
+    def _take(self, k: int, size: int) -> int:
+        """Allocates size bytes from the front of free gap k."""
+        off = self.free[k][0]
+        if self.free[k][1] == size:
+            del self.free[k]
+        else:
+            self.free[k][0] += size
+            self.free[k][1] -= size
+        return off
+
+    def _alloc(self, size: int) -> int:
+        """First fit in the free-list, else the end of the file."""
+        for k, (off, gap) in enumerate(self.free):
+            if gap >= size:
+                return self._take(k, size)
+        if self.free and sum(self.free[-1]) == self.end:
+            off = self.free.pop()[0]
+        else:
+            off = self.end
+        self.end = off + size
+        return off
+
+    def _grow_in_place(self, off: int, size: int, want: int) -> bool:
+        """Claims the free gap right behind a record if that makes it fit."""
+        for k, (o, gap) in enumerate(self.free):
+            if o == off + size:
+                if size + gap >= want:
+                    self._take(k, want - size)
+                    return True
+                if o + gap == self.end:
+                    del self.free[k]
+                    self.end = off + want
+                    return True
+                return False
+        if off + size == self.end:
+            self.end = off + want
+            return True
+        return False
+
+    # ---------- writes ----------
+
+    def _write(self, off: int, data):
+        self._file.seek(off)
+        self._file.write(data)
+        if self.mirror is not None:
+            n = memoryview(data).nbytes
+            if off + n > len(self.mirror):
+                self.mirror.extend(bytes(off + n - len(self.mirror)))
+            self.mirror[off:off + n] = data
+
+    def _set_entry(self, index: int, off: int, size: int):
+        # data first, then the table entry that makes it live (this only
+        # protects a moved record; in-place data is already overwritten)
+        self._file.flush()
+        self._write(self.index.table_offset + 8 * index, struct.pack("<II", off if size else 0, size))
+        self.index.table[2 * index] = off if size else 0
+        self.index.table[2 * index + 1] = size
+        if self.end > self.size_field:
+            self.size_field = self.end
+            self._write(FLX_SIZE_OFFSET, struct.pack("<I", self.end))
+        self._file.flush()
+
+    def replace(self, index: int, data) -> int:
+        """
+        Replaces a whole record.
+
+        Args:
+            index (int): The record index.
+            data: The new record contents (bytes-like).
+
+        Returns:
+            int: The record's new file offset (0 for an empty record).
+        Raises:
+            IndexError: If the index is invalid.
+        """
+        off, size = self.index[index]
+        want = memoryview(data).nbytes
+        if not want:
+            self._set_entry(index, 0, 0)
+            self._release(index, off, size)
+            return 0
+        in_place = size and not self._shared(index, off, max(size, want))
+        if in_place and (want <= size or self._grow_in_place(off, size, want)):
+            self._write(off, data)
+            self._set_entry(index, off, want)
+            self._release(index, off + want, size - want)
+            return off
+        new_off = self._alloc(want)
+        self._write(new_off, data)
+        self._set_entry(index, new_off, want)
+        self._release(index, off, size)
+        return new_off
+
+    def write_into(self, index: int, pos: int, data):
+        """
+        Overwrites bytes inside a record, which keeps its size. It keeps its
+        place too, unless another record shares its bytes; then the patched
+        record is moved (replace) and the shared bytes are left alone.
+
+        Args:
+            index (int): The record index.
+            pos (int): Offset within the record.
+            data: The bytes to write.
+
+        Raises:
+            IndexError: If the index is invalid.
+            ValueError: If the write would run past the end of the record.
+        """
+        off, size = self.index[index]
+        if pos < 0 or pos + memoryview(data).nbytes > size:
+            raise ValueError(f"Write of {memoryview(data).nbytes} bytes at {pos} does not fit record {index} ({size} bytes)")
+        if self._shared(index, off, size):
+            self._file.seek(off)
+            record = bytearray(self._file.read(size))
+            record[pos:pos + memoryview(data).nbytes] = data
+            self.replace(index, record)
+            return
+        self._write(off + pos, data)
+        self._file.flush()
+
+
 class FlxFile:
     """
     A class for reading and writing Ultima VIII FLX archive files.
     """
-    def __init__(self, filename):
+    def __init__(self, filename, use_mmap: bool = False):
         """
         Initializes a FlxFile object by loading data from the given file.
 
         Args:
             filename (str): The path to the FLX file.
+            use_mmap (bool): Map the file read-only instead of reading it into
+                memory. Only the header is parsed up front; record data is
+                paged in by the OS as it is touched, and get_record_data
+                returns zero-copy memoryview slices.
 
         Raises:
              FileNotFoundError: If the file is not found.
         """
         self.filename = filename
+        self.use_mmap = use_mmap
+        self._file = None
+        self._mmap = None
+        self._view = None
         try:
-            with open(filename, 'rb') as f:
-                 self.file_data = bytearray(f.read())
+            if use_mmap:
+                self._open_mmap(filename)
+            else:
+                with open(filename, 'rb') as f:
+                     self.file_data = bytearray(f.read())
         except FileNotFoundError:
              raise FileNotFoundError(f"Error: FLX file not found: {filename}")
 
         self.num_types = 0
+        self.index = None
         self.type_positions = []
         self.type_sizes = []
 
         if self.is_flex_file():
             self._parse_header()
 
+    def _open_mmap(self, filename):
+        """Maps the file read-only and exposes it as self.file_data."""
+        self._file = open(filename, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            # mmap refuses empty files; there is nothing to share anyway.
+            self._file.close()
+            self._file = None
+            self.file_data = bytearray()
+            return
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._mmap, "madvise") and hasattr(mmap, "MADV_RANDOM"):
+            # Records are fetched by index, so read-ahead only wastes RSS.
+            self._mmap.madvise(mmap.MADV_RANDOM)
+        self._view = memoryview(self._mmap)
+        self.file_data = self._mmap
+
+    def close(self):
+        """
+        Releases the file mapping (if any).
+
+        Memoryviews previously returned by get_record_data keep the mapping
+        alive; in that case it is unmapped once the last of them is released.
+        """
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
     def is_flex_file(self) -> bool:
         """
         Validates that the provided file is a valid FLX archive.
@@ -78,40 +733,23 @@ class FlxFile:
         Returns:
              bool: True if the file is a valid FLX archive, otherwise False.
         """
-        if len(self.file_data) < 88:
-           return False
-
-        if self.file_data[84] == 0x00 and self.file_data[85] == 0x08: # Basic FLX check
-          return True
-        return False
+        return FlxIndex.is_flex(self.file_data)
 
     def _parse_header(self):
-        """Parses the FLX file header."""
+        """Parses the FLX file header into a packed FlxIndex."""
         print(f"Parsing header, file length is {len(self.file_data)}")
 
-        num_types_offset = 84
-        if num_types_offset + 2 > len(self.file_data):
-          print(f"Error: offset 84 + 2 is greater than the file length")
-          return
-
-        self.num_types = struct.unpack("<H", self.file_data[num_types_offset:num_types_offset+2])[0]
-
-        print(f"Header value for number of types from offset {num_types_offset}: {self.num_types}")
-
-        self.type_positions = []
-        self.type_sizes = []
+        try:
+            self.index = FlxIndex.from_buffer(self.file_data)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
 
-        for i in range(self.num_types):
-            offset = 128 + i * 8
-            if offset + 8 > len(self.file_data):
-                print(f"Warning: End of file reached before reading all type information.")
-                break
-            type_pos = struct.unpack("<I", self.file_data[offset:offset+4])[0]
-            type_size = struct.unpack("<I", self.file_data[offset+4:offset+8])[0]
+        self.num_types = self.index.count
+        print(f"Header value for number of types from offset {FLX_COUNT_OFFSET}: {self.num_types}")
 
-            self.type_positions.append(type_pos)
-            self.type_sizes.append(type_size)
-            print(f"Type {i} - Offset: {type_pos}, Size: {type_size}")
+        self.type_positions = self.index.offsets
+        self.type_sizes = self.index.sizes
 
     def get_num_types(self) -> int:
         """
@@ -163,7 +801,9 @@ class FlxFile:
            index (int): The index of the record.
 
        Returns:
-            bytes: The record data.
+            bytes: The record data. When the file was opened with
+            use_mmap=True this is a read-only memoryview into the mapping
+            instead of a copy.
        Raises:
             IndexError: If the index is invalid.
        """
@@ -171,6 +811,8 @@ class FlxFile:
           raise IndexError("Invalid record index")
        offset = self.type_positions[index]
        size = self.type_sizes[index]
+       if self._view is not None:
+          return self._view[offset:offset+size]
        return bytes(self.file_data[offset:offset+size])
 
     def calculate_frame_offset(self, shape_num: int, frame_num: int) -> int:
@@ -216,9 +858,12 @@ class FlxFile:
              data (bytes): The data to be written.
         Raises:
              IndexError: if the index is invalid.
+             ValueError: if the file was opened read-only with use_mmap=True.
         """
         if index < 0 or index >= self.num_types:
            raise IndexError("Invalid record index")
+        if self.use_mmap:
+           raise ValueError("FLX file was opened with use_mmap=True and is read-only")
 
         offset = self.type_positions[index]
         size = self.type_sizes[index]
@@ -230,58 +875,109 @@ class FlxFile:
         self.file_data[offset:offset+len(data)] = data
 
     def _write_header(self, ds, objects):
-        """Writes the FLX header using the Pentagram method."""
-        i = 0
+        """Writes the FLX header using the Pentagram method (see flx_header)."""
+        head = flx_header(len(obj) if obj else 0 for obj in objects)
         ds.seek(0)
-        for i in range(0x50 // 4):
-            ds.write4(0x1A1A1A1A)
-        ds.write4(0x00001A1A)
-        ds.write4(len(objects))
-        # FIXME! This is what many flexes have next, but not all. Find out why.
-        ds.write4(0x00000001)
-        # FIXME! Figure out what to write until 0x80.
-        for i in range(ds.getPos(), 0x80, 4):
-            ds.write4(0)
-
-        ds.seek(0x80)
-        current_offset = 0x80 + (len(objects) * 8)
-        for obj in objects:
-            if not obj or len(obj) == 0:
-                ds.write4(0)
-            else:
-                ds.write4(current_offset)
-            ds.write4(len(obj))
-            current_offset += len(obj)
-
-        # complete file size
-        ds.seek(0x5c)
-        ds.write4(current_offset)
-
-        ds.seek(current_offset)
+        ds.write(head, len(head))
+        # leave the position at the end of the record data, as before
+        ds.seek(struct.unpack_from("<I", head, FLX_SIZE_OFFSET)[0])
 
     def write_all(self, outputfile:str):
          """
-         Writes the modified data to disk
+         Writes the archive to disk, streaming each record straight from
+         file_data (or the file mapping) through write_flx.
 
          Args:
             outputfile (str): The location to write the modified data to.
+               May be this archive's own file.
          Raises:
               FileNotFoundError: If the file path is invalid.
          """
-         try:
-            objects = []
+         # slice the live mapping, else a temporary view of file_data (released
+         # afterwards: a bytearray with a view on it cannot be resized)
+         view = None if self._view is not None else memoryview(self.file_data)
+         data = self._view if view is None else view
 
-            for i in range(self.num_types):
-              try:
-                  objects.append(self.get_record_data(i))
-              except IndexError:
-                   objects.append(b"") # Add an empty array to the data list if we can't get the data
-
-            with open(outputfile,'wb') as f:
-                ods = OAutoBufferDataSource()
-                self._write_header(ods, objects)
-                # Data is written by _write_header now, adjusting seek.
-                f.write(ods.getBuf())
+         def records():
+             for i in range(self.num_types):
+                 offset = self.type_positions[i]
+                 yield data[offset:offset + self.type_sizes[i]]
 
+         try:
+            tmp, _ = stage_flx(outputfile, records(), self.num_types)
          except FileNotFoundError:
-             raise FileNotFoundError(f"Error: Could not write to {outputfile}")
\ No newline at end of file
+             raise FileNotFoundError(f"Error: Could not write to {outputfile}")
+         finally:
+            if view is not None:
+               view.release()
+         own_file = self.use_mmap and os.path.exists(outputfile) and os.path.samefile(outputfile, self.filename)
+         if own_file:
+            # the mapping has to go before the rename (Windows keeps mapped files locked)
+            self.close()
+         try:
+            commit_flx(tmp, outputfile)
+         finally:
+            if own_file:
+               # the rewritten file is compacted: every record offset changed
+               self._open_mmap(self.filename)
+               self._parse_header()
+
+
+# ---------- Self check ----------
+
+def _gapped_flx(path, records, gap: int = 16):
+    """Writes records with gap unused bytes in front of each (a non-compact archive)."""
+    head = flx_header(len(r) for r in records)
+    body = bytearray()
+    for i, record in enumerate(records):
+        body += bytes(gap)
+        struct.pack_into("<I", head, FLX_TABLE_OFFSET + 8 * i, len(head) + len(body) if record else 0)
+        body += record
+    struct.pack_into("<I", head, FLX_SIZE_OFFSET, len(head) + len(body))
+    with open(path, "wb") as f:
+        f.write(head + body)
+
+
+def _self_check() -> int:
+    """Round-trips archives through the writers; returns the number of failures."""
+    import tempfile
+    records = [b"first record", b"", b"third"]
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "a.flx")
+        for use_mmap in (False, True):
+            _gapped_flx(path, records)
+            flx = FlxFile(path, use_mmap=use_mmap)
+            try:
+                flx.write_all(path)         # onto its own file
+                got = [bytes(flx.get_record_data(i)) for i in range(flx.num_types)]
+            finally:
+                flx.close()
+            with FlxFile(path) as fresh:
+                reread = [bytes(fresh.get_record_data(i)) for i in range(fresh.num_types)]
+            for what, data in (("in place", got), ("reread", reread)):
+                if data != records:
+                    print(f"FAIL write_all onto itself (use_mmap={use_mmap}, {what}): {data}")
+                    failed += 1
+        # two table entries over the same bytes: patching one leaves the other
+        shared = b"SHAREDXX"
+        _gapped_flx(path, [shared, b"x"])
+        with open(path, "r+b") as f:
+            f.seek(FLX_TABLE_OFFSET)
+            off = struct.unpack("<I", f.read(4))[0]
+            f.seek(FLX_TABLE_OFFSET + 8)
+            f.write(struct.pack("<II", off, len(shared)))
+        with FlxPatcher(path) as patcher:
+            patcher.write_into(1, 0, b"ALT")
+            patcher.replace(0, b"NEW")
+        with FlxFile(path) as fresh:
+            got = [bytes(fresh.get_record_data(i)) for i in range(fresh.num_types)]
+        if got != [b"NEW", b"ALTREDXX"]:
+            print(f"FAIL FlxPatcher on shared record data: {got}")
+            failed += 1
+    print("flx_lib self check: " + (f"{failed} failure(s)" if failed else "ok"))
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if _self_check() else 0)
@@ -48,43 +48,7 @@ def load_bin_data(filename):
 def _rewrite_flx(flx_file_path, objects):
     """Rewrites the FLX file with potentially modified objects."""
     try:
-        with open(flx_file_path, 'wb') as f:
-            ods = flx_lib.OAutoBufferDataSource()
-            # Mimic the header structure from the C++ code
-            i = 0
-            ods.seek(0)
-            for i in range(0x50 // 4):
-                ods.write4(0x1A1A1A1A)
-            ods.write4(0x00001A1A)
-            ods.write4(len(objects))
-            ods.write4(0x00000001)  # Assuming this is constant, needs verification
-            for i in range(ods.getPos(), 0x80, 4):
-                ods.write4(0)
-
-            data_start_offset = 0x80 + (len(objects) * 8)
-            current_data_offset = data_start_offset
-
-            ods.seek(0x80)
-            for obj_data in objects:
-                if not obj_data:
-                    ods.write4(0)
-                else:
-                    ods.write4(current_data_offset)
-                ods.write4(len(obj_data))
-                current_data_offset += len(obj_data)
-
-            # Complete file size
-            ods.seek(0x5c)
-            ods.write4(current_data_offset)
-
-            # Write the object data
-            ods.seek(data_start_offset)
-            for obj_data in objects:
-                if obj_data:
-                    ods.write(obj_data, len(obj_data))
-
-            f.write(ods.getBuf())
-
+        flx_lib.write_flx(flx_file_path, objects)
     except FileNotFoundError:
         raise FileNotFoundError(f"Error: Could not write to {flx_file_path}")
 
@@ -141,92 +105,95 @@ def main():
                              continue
 
                        try:
-                            flx = flx_lib.FlxFile(flx_file)
+                            flx = flx_lib.FlxFile(flx_file, use_mmap=True)
                        except FileNotFoundError as e:
                            print(e)
                            continue
 
-                       num_typ = flx.get_num_types()
-                       if shape_num < 0 or shape_num >= num_typ:
-                            print(f"Invalid shape number: {shape_num}, file has {num_typ} shapes")
-                            continue
+                       # the mapping and file handle go on every path out, continue included
+                       with flx:
+                           num_typ = flx.get_num_types()
+                           if shape_num < 0 or shape_num >= num_typ:
+                                print(f"Invalid shape number: {shape_num}, file has {num_typ} shapes")
+                                continue
 
-                       print(f"Importing shape {shape_num} and frame {frame_num}")
+                           print(f"Importing shape {shape_num} and frame {frame_num}")
 
-                       try:
-                            frame_offset = flx.calculate_frame_offset(shape_num, frame_num)
-                            print(f"Calculated Frame Header offset = {frame_offset}") # Updated print
+                           try:
+                                frame_offset = flx.calculate_frame_offset(shape_num, frame_num)
+                                print(f"Calculated Frame Header offset = {frame_offset}") # Updated print
  
-                            f_pos = frame_offset
-                            if f_pos + 18 > len(flx.file_data): # Check for enough data for the full header
-                                print("Error: Not enough data to read frame header.")
+                                f_pos = frame_offset
+                                if f_pos + 18 > len(flx.file_data): # Check for enough data for the full header
+                                    print("Error: Not enough data to read frame header.")
+                                    continue
+                                f_data = flx.file_data[f_pos:f_pos+18] # Read the full header
+
+                                original_compression = struct.unpack('<H',f_data[0:2])[0]
+                                original_xoff = struct.unpack('<h',f_data[14:16])[0] # Corrected offsets for full header
+                                original_yoff = struct.unpack('<h',f_data[16:18])[0] # Corrected offsets for full header
+
+                                print(f"Original compression: {original_compression}, xoff: {original_xoff}, yoff: {original_yoff}")
+
+                                # Generate new frame data
+                                new_frame_data = bytearray()
+                                new_frame_data.extend(struct.pack("<H", 0)) # typ_num - assuming 0
+                                new_frame_data.extend(struct.pack("<H", 0)) # frm_num - assuming 0
+                                new_frame_data.extend(struct.pack("<I", 0)) # unknown
+                                new_frame_data.extend(struct.pack("<H", compression))
+                                new_frame_data.extend(struct.pack("<H", x_len))
+                                new_frame_data.extend(struct.pack("<H", y_len))
+                                new_frame_data.extend(struct.pack("<h", original_xoff)) # Use original offsets
+                                new_frame_data.extend(struct.pack("<h", original_yoff)) # Use original offsets
+
+                                for offset in line_offsets:
+                                    new_frame_data.extend(struct.pack("<H", offset))
+
+                                new_frame_data.extend(rle_data)
+
+                                # Replace the record data
+                                record_data = flx.get_record_data(shape_num)
+
+                                # Calculate the start and end offset of the frame within the record
+                                record_offset = flx.get_record_offset(shape_num)
+                                frame_start_in_record = frame_offset - record_offset
+
+                                # Read the existing frame size
+                                existing_frame_size_bytes = flx.file_data[frame_offset - 3:frame_offset - 1]
+                                existing_frame_size = struct.unpack("<H", existing_frame_size_bytes)[0]
+                                print(f"Existing frame size: {existing_frame_size}")
+
+                                # Prepare to rewrite the entire FLX; untouched records stay
+                                # views into the mapping and are copied by the writer
+                                objects_to_write = []
+                                for i in range(flx.get_num_types()):
+                                    if i == shape_num:
+                                        # Replace the frame data within the shape's record data
+                                        new_record_data = bytearray(record_data)
+
+                                        # Calculate the position to insert the new frame size and data
+                                        insert_point = frame_start_in_record - 4 # Account for the size bytes
+
+                                        # Pack the new frame size
+                                        new_frame_size_packed = struct.pack("<H", len(new_frame_data))
+
+                                        # Replace the frame size and data
+                                        new_record_data[insert_point:insert_point + 2] = new_frame_size_packed
+                                        new_record_data[insert_point + 2: insert_point + 2 + existing_frame_size] = new_frame_data
+
+                                        objects_to_write.append(bytes(new_record_data))
+                                    else:
+                                        objects_to_write.append(flx.get_record_data(i))
+
+                                outfile = Path(flx_file)
+                                outfile = outfile.with_stem(f"{outfile.stem}_shape{shape_num}_frame{frame_num}")
+
+                                _rewrite_flx(str(outfile), objects_to_write)
+                                print(f"File written to {outfile}")
+
+                           except (IndexError, ValueError) as e:
+                                print(e)
                                 continue
-                            f_data = flx.file_data[f_pos:f_pos+18] # Read the full header
-
-                            original_compression = struct.unpack('<H',f_data[0:2])[0]
-                            original_xoff = struct.unpack('<h',f_data[14:16])[0] # Corrected offsets for full header
-                            original_yoff = struct.unpack('<h',f_data[16:18])[0] # Corrected offsets for full header
-
-                            print(f"Original compression: {original_compression}, xoff: {original_xoff}, yoff: {original_yoff}")
-
-                            # Generate new frame data
-                            new_frame_data = bytearray()
-                            new_frame_data.extend(struct.pack("<H", 0)) # typ_num - assuming 0
-                            new_frame_data.extend(struct.pack("<H", 0)) # frm_num - assuming 0
-                            new_frame_data.extend(struct.pack("<I", 0)) # unknown
-                            new_frame_data.extend(struct.pack("<H", compression))
-                            new_frame_data.extend(struct.pack("<H", x_len))
-                            new_frame_data.extend(struct.pack("<H", y_len))
-                            new_frame_data.extend(struct.pack("<h", original_xoff)) # Use original offsets
-                            new_frame_data.extend(struct.pack("<h", original_yoff)) # Use original offsets
-
-                            for offset in line_offsets:
-                                new_frame_data.extend(struct.pack("<H", offset))
-
-                            new_frame_data.extend(rle_data)
-
-                            # Replace the record data
-                            record_data = flx.get_record_data(shape_num)
-
-                            # Calculate the start and end offset of the frame within the record
-                            record_offset = flx.get_record_offset(shape_num)
-                            frame_start_in_record = frame_offset - record_offset
-
-                            # Read the existing frame size
-                            existing_frame_size_bytes = flx.file_data[frame_offset - 3:frame_offset - 1]
-                            existing_frame_size = struct.unpack("<H", existing_frame_size_bytes)[0]
-                            print(f"Existing frame size: {existing_frame_size}")
-
-                            # Prepare to rewrite the entire FLX, getting all record data
-                            objects_to_write = []
-                            for i in range(flx.get_num_types()):
-                                if i == shape_num:
-                                    # Replace the frame data within the shape's record data
-                                    new_record_data = bytearray(record_data)
-
-                                    # Calculate the position to insert the new frame size and data
-                                    insert_point = frame_start_in_record - 4 # Account for the size bytes
-
-                                    # Pack the new frame size
-                                    new_frame_size_packed = struct.pack("<H", len(new_frame_data))
-
-                                    # Replace the frame size and data
-                                    new_record_data[insert_point:insert_point + 2] = new_frame_size_packed
-                                    new_record_data[insert_point + 2: insert_point + 2 + existing_frame_size] = new_frame_data
-
-                                    objects_to_write.append(bytes(new_record_data))
-                                else:
-                                    objects_to_write.append(flx.get_record_data(i))
-
-                            outfile = Path(flx_file)
-                            outfile = outfile.with_stem(f"{outfile.stem}_shape{shape_num}_frame{frame_num}")
-
-                            _rewrite_flx(str(outfile), objects_to_write)
-                            print(f"File written to {outfile}")
-
-                       except (IndexError, ValueError) as e:
-                            print(e)
-                            continue
 
         screen.fill((0, 0, 0))
 
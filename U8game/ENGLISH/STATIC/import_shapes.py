@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# import_shapes.py
+# Batch shape import: replaces many shapes of U8SHAPES.FLX from sheets in a
+# single archive rewrite.
+# - A JSON manifest lists shape number -> sheet, with a layout and an offset
+#   policy per shape (format below).
+# - Sheets are sliced and encoded in a process pool (shapemod's helpers);
+#   each worker maps the archive once.
+# - The archive is then streamed once through flx_lib.stage_flx: untouched
+#   records are copied straight from the mapping, rebuilt ones slotted in.
+#   It is written to <out>.tmp and, once the mapping is closed, renamed over
+#   <out> (flx_lib.commit_flx), and only when every shape encoded, so a
+#   failed or interrupted run leaves the old file as is.
+#
+# Manifest:
+#   {
+#     "flx": "U8SHAPES.FLX",                 (optional, relative to manifest)
+#     "palette": "U8PAL.PAL",                (for RGB sheets; optional)
+#     "shapes": [
+#       {"shape": 523, "sheet": "NewShape523.bmp"},
+#       {"shape": 524, "sheet": "ghoul.png", "layout": "detect",
+#        "offsets": "bottom", "dither": "ordered"}
+#     ]
+#   }
+#   layout:  "pack"   vanilla packing, left->right, wrap at the sheet width
+#            "detect" frames found from the alpha mask (gutters, ragged rows)
+#   offsets: "keep" (vanilla per frame), "center", "bottom" (foot at the
+#            bottom centre) or [xoff, yoff] for every frame
+#   dither:  palette_lib.DITHER_MODES, for RGB sheets
+#
+# Usage:
+#   python import_shapes.py manifest.json
+#   python import_shapes.py manifest.json --out U8SHAPES.NEW --workers 4
+#   python import_shapes.py manifest.json --dry-run
+#
+# Requirements: numpy, Pillow
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from flx_lib import FlxIndex, commit_flx, stage_flx
+from palette_lib import DITHER_MODES, Palette
+from shape_lib import build_shape_record, sheet_frame_rects
+from shapemod import encode_sheet_frames, frame_attrs, load_sheet_indices, pack_rects
+
+LAYOUTS = ("pack", "detect")
+OFFSET_POLICIES = ("keep", "center", "bottom")
+
+
+@dataclass
+class ShapeJob:
+    shape: int
+    sheet: str
+    layout: str = "pack"
+    offsets: object = "keep"    # policy name or (xoff, yoff)
+    dither: Optional[str] = None
+
+
+@dataclass
+class ShapeImport:
+    shape: int
+    sheet: str
+    frames: int = 0             # frames in the shape
+    replaced: int = 0           # frames taken from the sheet
+    old_size: int = 0
+    new_size: int = 0
+    seconds: float = 0.0
+    warnings: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+# ---------- Manifest ----------
+
+def load_manifest(path: str):
+    """
+    Reads and checks a manifest.
+
+    Returns:
+        tuple: (flx path or None, palette path or None, list of ShapeJob),
+        with file names resolved against the manifest's directory.
+
+    Raises:
+        ValueError: On a malformed entry, an unknown option or a shape
+            listed twice.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(name):
+        return os.path.join(base, name) if name else None
+
+    jobs = []
+    seen = set()
+    for n, entry in enumerate(data.get("shapes", [])):
+        try:
+            job = ShapeJob(int(entry["shape"]), resolve(entry["sheet"]), entry.get("layout", "pack"),
+                           entry.get("offsets", "keep"), entry.get("dither"))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: shapes[{n}] needs a shape number and a sheet ({e})")
+        if job.layout not in LAYOUTS:
+            raise ValueError(f"{path}: shape {job.shape}: layout must be one of {LAYOUTS}")
+        if isinstance(job.offsets, list) and len(job.offsets) == 2:
+            job.offsets = (int(job.offsets[0]), int(job.offsets[1]))
+        elif job.offsets not in OFFSET_POLICIES:
+            raise ValueError(f"{path}: shape {job.shape}: offsets must be one of {OFFSET_POLICIES} or [x, y]")
+        if job.dither not in (None,) + DITHER_MODES:
+            raise ValueError(f"{path}: shape {job.shape}: dither must be one of {DITHER_MODES}")
+        if job.shape in seen:
+            raise ValueError(f"{path}: shape {job.shape} listed twice")
+        seen.add(job.shape)
+        jobs.append(job)
+    return resolve(data.get("flx")), resolve(data.get("palette")), jobs
+
+
+def frame_offsets(policy, attrs):
+    """(xoff, yoff) per frame for an offset policy; attrs are (w, h, xoff, yoff)."""
+    if policy == "keep":
+        return [(xo, yo) for _, _, xo, yo in attrs]
+    if policy == "center":
+        return [(w // 2, h // 2) for w, h, _, _ in attrs]
+    if policy == "bottom":
+        return [(w // 2, max(0, h - 1)) for w, h, _, _ in attrs]
+    return [tuple(policy)] * len(attrs)
+
+
+# ---------- Worker ----------
+
+class _Worker:
+    """Per-process archive mapping, record index and palette."""
+
+    def __init__(self, flx_path: str, pal_path: Optional[str]):
+        with open(flx_path, "rb") as f:
+            self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.recs = FlxIndex.from_buffer(self.blob)
+        self.pal = Palette.load(pal_path) if pal_path and os.path.exists(pal_path) else None
+
+    def build(self, job: ShapeJob):
+        """Returns (ShapeImport, rebuilt type record)."""
+        start = time.perf_counter()
+        rep = ShapeImport(job.shape, job.sheet, old_size=self.recs.size(job.shape))
+        attrs = frame_attrs(self.blob, self.recs, job.shape)
+        rep.frames = len(attrs)
+        sheet, sw, sh = load_sheet_indices(job.sheet, self.pal, job.dither)
+        dims = [a[:2] for a in attrs]
+        if job.layout == "pack":
+            rects, packed_h = pack_rects(dims, sw)
+            if packed_h != sh:
+                rep.warnings.append(f"packed height {packed_h} != sheet height {sh}")
+        else:
+            found = sheet_frame_rects(sheet != 255, [{"w": w, "h": h} for w, h in dims])
+            rects = [found.get(i) for i in range(len(dims))]
+            missing = sum(1 for r, (w, h) in zip(rects, dims) if r is None and w and h)
+            if missing:
+                rep.warnings.append(f"{missing} frame(s) not found on the sheet, kept")
+        frames = encode_sheet_frames(sheet, rects, frame_offsets(job.offsets, attrs), job.shape)
+        chunk = build_shape_record(self.blob, self.recs[job.shape], frames)
+        rep.replaced = len(frames)
+        rep.new_size = len(chunk)
+        rep.seconds = time.perf_counter() - start
+        return rep, chunk
+
+
+_worker: Optional[_Worker] = None
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _Worker(*args)
+
+
+def _build_shape(job: ShapeJob):
+    try:
+        return _worker.build(job)
+    except Exception as e:      # reported per shape; nothing is written then
+        return ShapeImport(job.shape, job.sheet, error=f"{type(e).__name__}: {e}"), None
+
+
+# ---------- Import ----------
+
+def import_shapes(flx_path: str, jobs: List[ShapeJob], pal_path: Optional[str] = None,
+                  out: Optional[str] = None, workers: Optional[int] = None,
+                  backup: bool = True, dry_run: bool = False) -> List[ShapeImport]:
+    """
+    Encodes every job, then writes the archive once if all of them succeeded.
+
+    Args:
+        flx_path: Source U8SHAPES.FLX.
+        jobs: Shapes to replace.
+        pal_path: U8PAL.PAL, needed for RGB sheets.
+        out: Output archive; defaults to flx_path (replaced atomically).
+        workers (int): Processes; defaults to os.cpu_count(). 1 runs here.
+        backup (bool): Copy flx_path to <flx_path>.bak first when writing
+            over it and no backup exists yet.
+        dry_run (bool): Encode and report, write nothing.
+
+    Returns:
+        list: One ShapeImport per job, in manifest order.
+
+    Raises:
+        IndexError: If a shape number is not in the archive.
+    """
+    index = FlxIndex.from_file(flx_path)
+    count = index.count
+    for job in jobs:
+        if not 0 <= job.shape < count:
+            raise IndexError(f"Shape {job.shape} out of range (archive has {count})")
+    workers = min(workers or os.cpu_count() or 1, max(1, len(jobs)))
+    init = (flx_path, pal_path)
+    if workers == 1:
+        _init_worker(*init)
+        try:
+            results = [_build_shape(job) for job in jobs]
+        finally:
+            _worker.blob.close()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init) as pool:
+            results = list(pool.map(_build_shape, jobs))
+
+    reports = [rep for rep, _ in results]
+    if dry_run or any(rep.error for rep in reports):
+        return reports
+
+    out = out or flx_path
+    if backup and os.path.abspath(out) == os.path.abspath(flx_path):
+        bak = flx_path + ".bak"
+        if not os.path.exists(bak):
+            shutil.copyfile(flx_path, bak)
+    chunks = {rep.shape: chunk for rep, chunk in results}
+    # stream into <out>.tmp from a mapping of the source, and unmap it before
+    # the rename: out may be the source, and Windows will not replace a
+    # mapped file
+    with open(flx_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as src:
+        view = memoryview(src)
+        try:
+            tmp, _ = stage_flx(out, (chunks[i] if i in chunks else view[off:off + size]
+                                     for i, (off, size) in enumerate(index)), count)
+        finally:
+            view.release()
+    commit_flx(tmp, out)
+    return reports
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Replace many U8 shapes from sheets in one FLX rewrite.")
+    ap.add_argument("manifest", help="JSON manifest (see the header of this file)")
+    ap.add_argument("--flx", help="source archive (default: manifest 'flx', else U8SHAPES.FLX here)")
+    ap.add_argument("--palette", help="U8PAL.PAL for RGB sheets (default: manifest 'palette', else next to the FLX)")
+    ap.add_argument("--out", help="output archive (default: replace the source)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--no-backup", action="store_true", help="do not keep <flx>.bak")
+    ap.add_argument("--dry-run", action="store_true", help="encode and report only")
+    args = ap.parse_args(argv)
+
+    try:
+        m_flx, m_pal, jobs = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    flx_path = args.flx or m_flx or "U8SHAPES.FLX"
+    pal_path = args.palette or m_pal or os.path.join(os.path.dirname(os.path.abspath(flx_path)), "U8PAL.PAL")
+
+    start = time.perf_counter()
+    try:
+        reports = import_shapes(flx_path, jobs, pal_path, args.out, args.workers,
+                                not args.no_backup, args.dry_run)
+    except (OSError, IndexError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    except BrokenProcessPool as e:
+        print(f"Error: an import worker failed to start ({e}); {flx_path} left unchanged.")
+        return 1
+    for rep in reports:
+        if rep.error:
+            print(f"shape {rep.shape:4d}: FAILED {rep.error}")
+            continue
+        print(f"shape {rep.shape:4d}: {rep.replaced}/{rep.frames} frames, "
+              f"{rep.old_size} -> {rep.new_size} bytes ({rep.seconds:.2f}s)")
+        for w in rep.warnings:
+            print(f"            warning: {w}")
+    failed = sum(1 for rep in reports if rep.error)
+    seconds = time.perf_counter() - start
+    if failed:
+        print(f"{failed} of {len(reports)} shape(s) failed; {flx_path} left unchanged.")
+        return 1
+    if args.dry_run:
+        print(f"{len(reports)} shape(s) encoded in {seconds:.2f}s (dry run, nothing written).")
+    else:
+        print(f"{len(reports)} shape(s) written to {args.out or flx_path} in {seconds:.2f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,496 @@
+# map_lib.py
+# U8 map object data (FIXED.DAT, NONFIXED.DAT) as NumPy record arrays.
+# - MAP_OBJECT_DTYPE: the 16-byte object record as a structured dtype.
+# - MapFile: mmap of a map FLX; each map is an np.frombuffer view of its
+#   record (no per-object Python objects, no copy).
+# - GlobTable: every glob of GLOB.FLX decoded once into columns; expands all
+#   glob eggs of a map in one vectorized step, cached per map.
+# - U8SaveFile / open_nonfixed(): NONFIXED.DAT straight from GAMEDAT or from
+#   inside a saved game (SAVEGAME/U8SAVE.000).
+# - ScreenIndex / SpatialGrid: projected screen boxes of a map's items (from
+#   the shape frame table, no decoding) in a uniform grid, in paint order
+#   (a quick key here, or sort_lib's ItemSorter port), so viewers only
+#   touch the items that intersect the viewport; changed_boxes() finds where
+#   two versions of a map differ (for dirty tiles).
+#
+# Requirements: numpy
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from flx_lib import FlxIndex
+
+# 16 bytes per object, little-endian, no padding:
+#   0 u16 x, 2 u16 y, 4 u8 z, 5 u16 shape, 7 u8 frame, 8 u16 flags,
+#  10 u16 quality (glob index when shape == GLOB_EGG_SHAPE), 12 u8 npc,
+#  13 u8 mapnum, 14 u16 next
+MAP_OBJECT_DTYPE = np.dtype([
+    ("x", "<u2"), ("y", "<u2"), ("z", "u1"),
+    ("shape", "<u2"), ("frame", "u1"),
+    ("flags", "<u2"), ("quality", "<u2"),
+    ("npc", "u1"), ("mapnum", "u1"), ("next", "<u2"),
+])
+assert MAP_OBJECT_DTYPE.itemsize == 16
+
+# Objects placed in the world (e.g. after glob expansion): signed coords,
+# plus the object flags the sorter needs (flipped, invisible).
+ITEM_DTYPE = np.dtype([
+    ("x", "<i4"), ("y", "<i4"), ("z", "<i4"),
+    ("shape", "<u2"), ("frame", "<u2"), ("flags", "<u2"),
+])
+
+GLOB_EGG_SHAPE = 2
+NUM_MAPS = 256
+
+EMPTY_OBJECTS = np.zeros(0, dtype=MAP_OBJECT_DTYPE)
+
+
+def objects_from_buffer(buf, offset: int = 0, size: int = None) -> np.ndarray:
+    """
+    Views size bytes of buf at offset as map objects (trailing partial
+    records are ignored). Read-only when buf is bytes or a read-only mmap.
+    """
+    if size is None:
+        size = len(buf) - offset
+    n = max(0, size) // MAP_OBJECT_DTYPE.itemsize
+    if n == 0:
+        return EMPTY_OBJECTS
+    return np.frombuffer(buf, dtype=MAP_OBJECT_DTYPE, count=n, offset=offset)
+
+
+def to_items(objs: np.ndarray) -> np.ndarray:
+    """Copies the placement columns of map objects into an ITEM_DTYPE array."""
+    items = np.empty(len(objs), dtype=ITEM_DTYPE)
+    for name in ITEM_DTYPE.names:
+        items[name] = objs[name]
+    return items
+
+
+def paint_order(items: np.ndarray) -> np.ndarray:
+    """Indices sorting items back to front by the viewers' (x+y, z, x) key."""
+    x = items["x"].astype(np.int64)
+    return np.lexsort((x, items["z"], x + items["y"]))
+
+
+class MapFile:
+    """
+    FIXED.DAT / NONFIXED.DAT: an FLX with one record of objects per map.
+    The file is mmapped read-only; objects() returns views into it.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._file = open(self.path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b""
+        self.records = FlxIndex.from_buffer(self.data)
+        self.count = self.records.count
+
+    @classmethod
+    def from_buffer(cls, buf, path: str = "<memory>") -> "MapFile":
+        """A MapFile over an in-memory FLX (e.g. an entry of a saved game)."""
+        self = cls.__new__(cls)
+        self.path = path
+        self._file = None
+        self.data = buf
+        self.records = FlxIndex.from_buffer(buf)
+        self.count = self.records.count
+        return self
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                pass  # object views still alive; the map is freed with them
+        self.data = b""
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def objects(self, idx: int) -> np.ndarray:
+        """
+        Objects of map idx as a MAP_OBJECT_DTYPE view.
+
+        Raises:
+            IndexError: If idx is not a record of the file.
+        """
+        off, size = self.records[idx]
+        if off == 0 or size == 0:
+            return EMPTY_OBJECTS
+        return objects_from_buffer(self.data, off, min(size, len(self.data) - off))
+
+    def all_objects(self) -> list:
+        """Object views of every map, indexed by map number."""
+        return [self.objects(i) for i in range(self.count)]
+
+
+# ---------- Saved games ----------
+
+class U8SaveFile:
+    """
+    Original U8 saved game (SAVEGAME/U8SAVE.000, filesys/U8SaveFile.cpp):
+    char[24] "Ultima 8 SaveGame File.", u16 count, then count entries of
+    u32 name_len, name (NUL-terminated), u32 size, data.
+    """
+
+    MAGIC = b"Ultima 8 SaveGame File."
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as f:
+            self.data = f.read()
+        if not self.is_save(self.data):
+            raise ValueError(f"{self.path}: not a U8 saved game")
+        self.entries = {}   # name -> (offset, size)
+        pos = 0x18
+        (count,) = struct.unpack_from("<H", self.data, pos)
+        pos += 2
+        for _ in range(count):
+            (name_len,) = struct.unpack_from("<I", self.data, pos)
+            name = self.data[pos + 4:pos + 4 + name_len].split(b"\0", 1)[0].decode("ascii", "replace")
+            pos += 4 + name_len
+            (size,) = struct.unpack_from("<I", self.data, pos)
+            pos += 4
+            if pos + size > len(self.data):
+                raise ValueError(f"{self.path}: entry {name!r} runs past the end of the file")
+            self.entries[name.upper()] = (pos, size)
+            pos += size
+
+    @classmethod
+    def is_save(cls, head: bytes) -> bool:
+        return head[:len(cls.MAGIC)] == cls.MAGIC
+
+    def names(self) -> list:
+        return list(self.entries)
+
+    def read(self, name: str) -> bytes:
+        """
+        Raises:
+            KeyError: If the save has no entry name.
+        """
+        off, size = self.entries[name.upper()]
+        return self.data[off:off + size]
+
+
+def open_nonfixed(path) -> MapFile:
+    """
+    NONFIXED.DAT as a MapFile, from a plain file (GAMEDAT/NONFIXED.DAT) or
+    from the NONFIXED.DAT entry of a saved game.
+
+    Raises:
+        KeyError: If a saved game has no NONFIXED.DAT.
+    """
+    with open(path, "rb") as f:
+        head = f.read(len(U8SaveFile.MAGIC))
+    if U8SaveFile.is_save(head):
+        save = U8SaveFile(path)
+        return MapFile.from_buffer(save.read("NONFIXED.DAT"), f"{os.fspath(path)}:NONFIXED.DAT")
+    return MapFile(path)
+
+
+def map_items(idx: int, fixed: MapFile, nonfixed: MapFile = None, globs: "GlobTable" = None,
+              y_bias: int = 0) -> np.ndarray:
+    """
+    Every drawable item of map idx: FIXED and NONFIXED objects with the glob
+    eggs replaced by their globs (or dropped without a GlobTable).
+    """
+    parts = [f.objects(idx) for f in (fixed, nonfixed) if f is not None and idx < len(f)]
+    objs = np.concatenate(parts) if parts else EMPTY_OBJECTS
+    eggs = objs["shape"] == GLOB_EGG_SHAPE
+    items = [to_items(objs[~eggs])]
+    if globs is not None:
+        items.append(globs.expand(objs[eggs], y_bias))
+    return np.concatenate(items)
+
+
+# ---------- Globs (GLOB.FLX) ----------
+
+# Glob record: u16 count, then count * 6 bytes:
+#   u8 dx, u8 dy, u8 dz, u16 shape, u8 frame   (dx/dy in 2-unit steps)
+GLOB_ITEM_DTYPE = np.dtype([
+    ("dx", "u1"), ("dy", "u1"), ("dz", "u1"),
+    ("shape", "<u2"), ("frame", "u1"),
+])
+assert GLOB_ITEM_DTYPE.itemsize == 6
+
+
+class GlobTable:
+    """
+    All globs as flat columns: the items of glob g are
+    items[first[g]:first[g+1]].
+    """
+
+    def __init__(self, first: np.ndarray, items: np.ndarray):
+        self.first = first
+        self.items = items
+        self.count = len(first) - 1
+        self._expanded = {}   # key -> (egg signature, ITEM_DTYPE array)
+
+    @classmethod
+    def from_buffer(cls, buf) -> "GlobTable":
+        records = FlxIndex.from_buffer(buf)
+        parts = []
+        first = np.zeros(records.count + 1, dtype=np.int64)
+        for g, (off, size) in enumerate(records):
+            n = 0
+            if off and size >= 2:
+                n = min(buf[off] | (buf[off + 1] << 8), (size - 2) // GLOB_ITEM_DTYPE.itemsize)
+                if n:
+                    parts.append(np.frombuffer(buf, dtype=GLOB_ITEM_DTYPE, count=n, offset=off + 2))
+            first[g + 1] = first[g] + n
+        items = np.concatenate(parts) if parts else np.zeros(0, dtype=GLOB_ITEM_DTYPE)
+        return cls(first, items)
+
+    @classmethod
+    def load(cls, path) -> "GlobTable":
+        with open(path, "rb") as f:
+            return cls.from_buffer(f.read())
+
+    def __len__(self) -> int:
+        return self.count
+
+    def glob(self, idx: int) -> np.ndarray:
+        """Items of one glob (GLOB_ITEM_DTYPE); empty for unknown indices."""
+        if not (0 <= idx < self.count):
+            return self.items[:0]
+        return self.items[self.first[idx]:self.first[idx + 1]]
+
+    def expand(self, eggs: np.ndarray, y_bias: int = 0) -> np.ndarray:
+        """
+        Places the items of every glob egg at once.
+
+        Each item lands at (egg.x + 2*dx, egg.y + 2*dy + y_bias, egg.z + dz);
+        eggs whose quality is not a glob index contribute nothing.
+
+        Args:
+            eggs: Map objects (MAP_OBJECT_DTYPE or ITEM_DTYPE plus quality)
+                that are glob eggs.
+            y_bias (int): Extra Y offset (maps.py uses the doc's -576).
+
+        Returns:
+            np.ndarray: ITEM_DTYPE array, grouped by egg in input order.
+        """
+        q = eggs["quality"].astype(np.int64)
+        valid = q < self.count
+        q = np.where(valid, q, 0)
+        counts = np.where(valid, self.first[q + 1] - self.first[q], 0)
+        total = int(counts.sum())
+        out = np.empty(total, dtype=ITEM_DTYPE)
+        if total == 0:
+            return out
+        egg = np.repeat(np.arange(len(eggs)), counts)
+        # position of each output row within its egg's glob
+        starts = np.cumsum(counts) - counts
+        member = self.first[q][egg] + (np.arange(total) - starts[egg])
+        g = self.items[member]
+        out["x"] = eggs["x"][egg].astype(np.int32) + 2 * g["dx"].astype(np.int32)
+        out["y"] = eggs["y"][egg].astype(np.int32) + 2 * g["dy"].astype(np.int32) + y_bias
+        out["z"] = eggs["z"][egg].astype(np.int32) + g["dz"]
+        out["shape"] = g["shape"]
+        out["frame"] = g["frame"]
+        out["flags"] = 0
+        return out
+
+    def expand_map(self, key, eggs: np.ndarray, y_bias: int = 0) -> np.ndarray:
+        """
+        expand() cached under key (e.g. the map number). The cached result is
+        reused while the eggs (position, quality) and y_bias are unchanged.
+        """
+        sig = (y_bias, np.ascontiguousarray(eggs[["x", "y", "z", "quality"]]).tobytes())
+        hit = self._expanded.get(key)
+        if hit is not None and hit[0] == sig:
+            return hit[1]
+        out = self.expand(eggs, y_bias)
+        out.flags.writeable = False
+        self._expanded[key] = (sig, out)
+        return out
+
+    def invalidate(self, key=None):
+        """Drops the cached expansion of key, or of every map."""
+        if key is None:
+            self._expanded.clear()
+        else:
+            self._expanded.pop(key, None)
+
+
+# ---------- Screen-space index ----------
+
+def project(items: np.ndarray):
+    """Screen (sx, sy) of items: sx = (x - y) // 4, sy = (x + y) // 8 - z."""
+    x = items["x"].astype(np.int32)
+    y = items["y"].astype(np.int32)
+    return (x - y) // 4, (x + y) // 8 - items["z"].astype(np.int32)
+
+
+def _column(col) -> np.ndarray:
+    """Zero-copy view of a ShapeIndex column (array.array)."""
+    return np.frombuffer(col, dtype=col.typecode) if len(col) else np.zeros(0, dtype=col.typecode)
+
+
+def screen_boxes(items: np.ndarray, shape_index, clamp_frames: bool = True):
+    """
+    Screen bounding boxes of items, taken from a shape_lib.ShapeIndex.
+
+    Args:
+        items: ITEM_DTYPE array.
+        shape_index: ShapeIndex of the archive the items are drawn from.
+        clamp_frames (bool): Draw out-of-range frames as the shape's last
+            frame (maps.py) instead of dropping them (mapviewer.py).
+
+    Returns:
+        tuple: (boxes, valid). boxes is (n, 4) int32 [left, top, right,
+        bottom) with the hotspot applied; valid marks items with a frame.
+    """
+    n = len(items)
+    boxes = np.zeros((n, 4), dtype=np.int32)
+    counts = _column(shape_index.frame_counts).astype(np.int64)
+    first = _column(shape_index.first).astype(np.int64)
+    shape = items["shape"].astype(np.int64)
+    frame = items["frame"].astype(np.int64)
+    valid = shape < len(counts)
+    shape = np.where(valid, shape, 0)
+    count = counts[shape] if len(counts) else np.zeros(n, dtype=np.int64)
+    valid &= count > 0
+    if clamp_frames:
+        frame = np.minimum(frame, count - 1)
+    else:
+        valid &= frame < count
+    slot = np.where(valid, first[shape] + np.maximum(frame, 0), 0)
+    if not valid.any():
+        return boxes, valid
+    cols = {name: _column(getattr(shape_index, name))[slot].astype(np.int32)
+            for name in ("width", "height", "xoff", "yoff")}
+    sx, sy = project(items)
+    boxes[:, 0] = sx - cols["xoff"]
+    boxes[:, 1] = sy - cols["yoff"]
+    boxes[:, 2] = boxes[:, 0] + cols["width"]
+    boxes[:, 3] = boxes[:, 1] + cols["height"]
+    return boxes, valid
+
+
+class SpatialGrid:
+    """
+    Uniform grid over [left, top, right, bottom) boxes. Each box is listed
+    in every cell it overlaps; cells are stored CSR-style (entries sorted by
+    cell, cell_start offsets), so a query only gathers a few slices.
+    """
+
+    def __init__(self, boxes: np.ndarray, cell: int = 256):
+        self.boxes = boxes
+        self.cell = cell
+        n = len(boxes)
+        if n == 0:
+            self.origin = (0, 0)
+            self.nx = self.ny = 0
+            self.entries = np.zeros(0, dtype=np.int64)
+            self.cell_start = np.zeros(1, dtype=np.int64)
+            return
+        ox, oy = int(boxes[:, 0].min()), int(boxes[:, 1].min())
+        self.origin = (ox, oy)
+        cx0 = (boxes[:, 0] - ox) // cell
+        cy0 = (boxes[:, 1] - oy) // cell
+        cx1 = np.maximum(cx0, (boxes[:, 2] - 1 - ox) // cell)
+        cy1 = np.maximum(cy0, (boxes[:, 3] - 1 - oy) // cell)
+        self.nx, self.ny = int(cx1.max()) + 1, int(cy1.max()) + 1
+        w = (cx1 - cx0 + 1).astype(np.int64)
+        spans = w * (cy1 - cy0 + 1)
+        owner = np.repeat(np.arange(n), spans)
+        k = np.arange(len(owner)) - np.repeat(np.cumsum(spans) - spans, spans)
+        cid = (cy0[owner] + k // w[owner]) * self.nx + cx0[owner] + k % w[owner]
+        order = np.argsort(cid, kind="stable")
+        self.entries = owner[order]
+        self.cell_start = np.searchsorted(cid[order], np.arange(self.nx * self.ny + 1))
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def query(self, left: int, top: int, right: int, bottom: int) -> np.ndarray:
+        """Sorted indices of the boxes intersecting [left, top, right, bottom)."""
+        if self.nx == 0 or right <= left or bottom <= top:
+            return self.entries[:0]
+        ox, oy = self.origin
+        cx0 = max(0, (left - ox) // self.cell)
+        cy0 = max(0, (top - oy) // self.cell)
+        cx1 = min(self.nx - 1, (right - 1 - ox) // self.cell)
+        cy1 = min(self.ny - 1, (bottom - 1 - oy) // self.cell)
+        if cx0 > cx1 or cy0 > cy1:
+            return self.entries[:0]
+        parts = [self.entries[self.cell_start[cy * self.nx + cx0]:self.cell_start[cy * self.nx + cx1 + 1]]
+                 for cy in range(cy0, cy1 + 1)]
+        hits = np.unique(np.concatenate(parts))
+        b = self.boxes[hits]
+        keep = (b[:, 0] < right) & (b[:, 2] > left) & (b[:, 1] < bottom) & (b[:, 3] > top)
+        return hits[keep]
+
+
+class ScreenIndex:
+    """
+    A map's drawable items in paint order with their screen boxes and a
+    SpatialGrid over them; build once per map (or filter change), then
+    visible() per redraw.
+    """
+
+    def __init__(self, items: np.ndarray, shape_index, clamp_frames: bool = True, cell: int = 256,
+                 order=paint_order):
+        """
+        Args:
+            items: ITEM_DTYPE array.
+            shape_index: ShapeIndex the items are drawn from.
+            clamp_frames (bool): See screen_boxes().
+            cell (int): SpatialGrid cell size.
+            order: order(items) -> indices in paint order (default: the
+                (x+y, z, x) key; sort_lib.sorted_order for ItemSorter's), or
+                None when items are already in paint order.
+        """
+        if order is not None:
+            items = items[order(items)]
+        boxes, valid = screen_boxes(items, shape_index, clamp_frames)
+        self.items = items[valid]
+        self.boxes = boxes[valid]
+        self.grid = SpatialGrid(self.boxes, cell)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def bounds(self):
+        """(left, top, right, bottom) around every item, or None when empty."""
+        if not len(self.boxes):
+            return None
+        lo = self.boxes[:, :2].min(axis=0)
+        hi = self.boxes[:, 2:].max(axis=0)
+        return int(lo[0]), int(lo[1]), int(hi[0]), int(hi[1])
+
+    def visible(self, left: int, top: int, right: int, bottom: int) -> np.ndarray:
+        """Indices (in paint order) of the items intersecting the screen rect."""
+        return self.grid.query(left, top, right, bottom)
+
+
+def changed_boxes(old: ScreenIndex, new: ScreenIndex) -> np.ndarray:
+    """
+    Screen boxes of the items that are in only one of two indexes of the
+    same map (compared as multisets), i.e. where the picture can differ.
+    Paint order of the shared items is unaffected, so other pixels stay valid.
+    """
+    size = ITEM_DTYPE.itemsize
+    rows = np.concatenate([old.items, new.items])
+    if not len(rows):
+        return np.zeros((0, 4), dtype=np.int32)
+    keys = np.ascontiguousarray(rows).view(np.dtype((np.void, size)))
+    _, inv = np.unique(keys, return_inverse=True)
+    tag = np.concatenate([np.ones(len(old.items)), -np.ones(len(new.items))])
+    changed = (np.bincount(inv.ravel(), weights=tag) != 0)[inv.ravel()]
+    return np.concatenate([old.boxes, new.boxes])[changed]
@@ -2,249 +2,130 @@
 # Ultima VIII Map Viewer with GLOB expansion, Z-slice, dynamic UI layout.
 # Place this next to U8PAL.PAL and U8SHAPES.FLX inside STATIC.
 
+import math
 import os
 import pygame
-from collections import namedtuple
+import numpy as np
+
+import cache_lib
+import map_lib
+import palette_lib
+import shape_lib
+import sort_lib
+import tile_lib
+import typeflag_lib
 
 # ---------- binary helpers ----------
-def ru8(f):  b=f.read(1);  if not b: raise EOFError; return b[0]
+def ru8(f):
+    b=f.read(1)
+    if not b: raise EOFError
+    return b[0]
 def ru16(f, signed=False):
-    b=f.read(2);  if len(b)!=2: raise EOFError; return int.from_bytes(b,"little",signed=signed)
+    b=f.read(2)
+    if len(b)!=2: raise EOFError
+    return int.from_bytes(b,"little",signed=signed)
 def ru24(f):
-    b=f.read(3);  if len(b)!=3: raise EOFError; return b[0]|(b[1]<<8)|(b[2]<<16)
+    b=f.read(3)
+    if len(b)!=3: raise EOFError
+    return b[0]|(b[1]<<8)|(b[2]<<16)
 def ru32(f):
-    b=f.read(4);  if len(b)!=4: raise EOFError; return int.from_bytes(b,"little")
+    b=f.read(4)
+    if len(b)!=4: raise EOFError
+    return int.from_bytes(b,"little")
 
 # ---------- palette ----------
 def load_palette(path):
-    with open(path,"rb") as f:
-        f.read(4)  # unknown
-        raw=f.read(256*3)
-    if len(raw)!=256*3: raise ValueError("U8PAL.PAL too short")
-    pal=[]
-    for i in range(256):
-        r=raw[i*3+0]*4; g=raw[i*3+1]*4; b=raw[i*3+2]*4
-        pal.append((min(r,255),min(g,255),min(b,255)))
-    return pal
+    # 256x4 RGBA lookup table; pal[i] still gives (r,g,b)
+    return palette_lib.Palette.load(path)
 
 # ---------- shapes (U8SHAPES.FLX) ----------
-class ShapeFrameInfo:
-    __slots__=("pos","size")
-    def __init__(self,pos,size): self.pos=pos; self.size=size
-
-class ShapeTypeInfo:
-    __slots__=("pos","size","frames")
-    def __init__(self,pos,size,frames): self.pos=pos; self.size=size; self.frames=frames
-
 class U8Shapes:
     def __init__(self, path):
-        self.f = open(path,"rb")
-        self.num_types = self._read_num_types()
-        self.type_index = [None]*self.num_types
-        self.frame_counts = self._read_frame_counts()
-
-    def close(self):
-        try: self.f.close()
-        except: pass
-
-    def _read_num_types(self):
-        self.f.seek(0x54);  # 84
-        return ru16(self.f)
-
-    def _type_record(self, idx):
-        self.f.seek(0x80 + idx*8)  # 128
-        pos = ru32(self.f); size = ru32(self.f)
-        return pos, size
-
-    def _read_type(self, idx):
-        if self.type_index[idx] is not None: return self.type_index[idx]
-        tpos, tsize = self._type_record(idx)
-        self.f.seek(tpos)
-        self.f.read(4)   # unknown
-        fcount = ru16(self.f)
-        frames=[]
-        for _ in range(fcount):
-            rel = ru24(self.f)
-            self.f.read(1)  # unknown
-            fsz = ru16(self.f)
-            frames.append(ShapeFrameInfo(tpos+rel, fsz))
-        info = ShapeTypeInfo(tpos, tsize, frames)
-        self.type_index[idx]=info
-        return info
-
-    def _read_frame_counts(self):
-        counts=[0]*self.num_types
-        for i in range(self.num_types):
-            tpos,_=self._type_record(i)
-            self.f.seek(tpos)
-            self.f.read(4)
-            counts[i]=ru16(self.f)
-        return counts
-
-    def frame_info(self, type_idx, frame_idx):
-        t=self._read_type(type_idx)
-        if not (0<=frame_idx<len(t.frames)): raise IndexError
-        return t.frames[frame_idx]
-
-def decode_frame_surface_vb_exact(f, finfo, palette):
-    # VB-accurate decode from u8gfxfmt.txt / u8view.bas
-    f.seek(finfo.pos)
-    f.read(2)  # typenum
-    f.read(2)  # framenum
-    f.read(4)  # unknown
-    compr = ru16(f)
-    xlen  = ru16(f)
-    ylen  = ru16(f)
-    xoff  = ru16(f, signed=True)
-    yoff  = ru16(f, signed=True)
-
-    line_pos=[]
-    for _ in range(ylen):
-        base=f.tell()
-        delta=ru16(f)
-        line_pos.append(base+delta)
-
-    surf = pygame.Surface((max(1,xlen), max(1,ylen)), pygame.SRCALPHA, 32)
-
-    xpos = xlen; y = -1
-    while True:
-        while xpos >= xlen:
-            y += 1
-            if y >= ylen: return surf, xoff, yoff
-            f.seek(line_pos[y])
-            xpos = ru8(f)
-
-        dlen = ru8(f)
-        if compr==1:
-            if (dlen & 1)==1:
-                run = dlen//2
-                color = ru8(f)
-                if run>0:
-                    clr = palette[color]
-                    for i in range(run):
-                        px = xpos+i
-                        if 0<=px<xlen: surf.set_at((px,y),(clr[0],clr[1],clr[2],255))
-            else:
-                run = dlen//2
-                for i in range(run):
-                    color = ru8(f)
-                    px = xpos+i
-                    if 0<=px<xlen:
-                        clr=palette[color]
-                        surf.set_at((px,y),(clr[0],clr[1],clr[2],255))
-        else:
-            run = dlen
-            for i in range(run):
-                color = ru8(f)
-                px = xpos+i
-                if 0<=px<xlen:
-                    clr=palette[color]
-                    surf.set_at((px,y),(clr[0],clr[1],clr[2],255))
-        xpos += run
-        if xpos < xlen:
-            gap = ru8(f)
-            xpos += gap
-
-# ---------- FLX archive reader for maps & globs ----------
-class FLX:
-    def __init__(self, path):
-        self.path = path
-        self.f = open(path,"rb")
-        self.count = self._read_count()
-        self.records = self._read_records()
+        self.file = shape_lib.ShapeFile(path)   # mmap + sidecar-cached frame table
+        self.index = self.file.index
+        self.num_types = self.index.num_shapes
+        self.frame_counts = self.index.frame_counts
 
     def close(self):
-        try: self.f.close()
+        try: self.file.close()
         except: pass
 
-    def _read_count(self):
-        self.f.seek(0x54)
-        return ru32(self.f)
-
-    def _read_records(self):
-        recs=[]
-        base=0x90
-        for i in range(self.count):
-            self.f.seek(base+i*8)
-            off=ru32(self.f); length=ru32(self.f)
-            recs.append((off,length))
-        return recs
-
-    def read(self, idx):
-        off, ln = self.records[idx]
-        if off==0 or ln==0: return b""
-        self.f.seek(off)
-        return self.f.read(ln)
+def decode_frame_surface(shapes, shape, frame, palette):
+    # Indices come from shape_lib.decode_frame (u8gfxfmt.txt / u8view.bas),
+    # colors from the palette LUT; TRANSPARENT_INDEX gets alpha 0.
+    pixels, xoff, yoff, _ = shapes.file.decode(shape, frame)
+    return palette.to_surface(pixels), xoff, yoff, pixels
 
 # ---------- map archives ----------
-MapObject = namedtuple("MapObject","x y z shape frame flags quality npc mapid nextid")
-
-class MapArchive(FLX):
+class MapArchive(map_lib.MapFile):
     def read_map(self, idx):
+        # MAP_OBJECT_DTYPE view straight onto the mmapped record (no copy),
+        # plus the record offset for the debug line
         off, ln = self.records[idx]
-        for try_off in (off, off+1):
-            try:
-                self.f.seek(try_off)
-                data=self.f.read(ln)
-                if len(data)!=ln or ln%16!=0: continue
-                objs=[]
-                p=0
-                for _ in range(ln//16):
-                    x=int.from_bytes(data[p+0:p+2],"little")
-                    y=int.from_bytes(data[p+2:p+4],"little")
-                    z=data[p+4]
-                    shape=int.from_bytes(data[p+5:p+7],"little")
-                    frame=data[p+7]
-                    flags=int.from_bytes(data[p+8:p+10],"little")
-                    quality=int.from_bytes(data[p+10:p+12],"little")
-                    npc=data[p+12]; mapid=data[p+13]
-                    nextid=int.from_bytes(data[p+14:p+16],"little")
-                    objs.append(MapObject(x,y,z,shape,frame,flags,quality,npc,mapid,nextid))
-                    p+=16
-                return objs, try_off
-            except Exception:
-                continue
-        return [], None
-
-# ---------- globs (GLOB.FLX) ----------
-GlobObj = namedtuple("GlobObj","dx dy dz shape frame")
-
-class GlobArchive(FLX):
-    def __init__(self, path):
-        super().__init__(path)
-        self.cache = {}
-
-    def get(self, idx):
-        if idx in self.cache: return self.cache[idx]
-        data = self.read(idx)
-        if not data: self.cache[idx]=[]; return []
-        n = int.from_bytes(data[0:2],"little")
-        g=[]
-        p=2
-        for _ in range(n):
-            dx=data[p]; dy=data[p+1]; dz=data[p+2]
-            shape=int.from_bytes(data[p+3:p+5],"little")
-            frame=data[p+5]
-            g.append(GlobObj(dx,dy,dz,shape,frame))
-            p+=6
-        self.cache[idx]=g
-        return g
+        return self.objects(idx), (off if off and ln else None)
 
 # ---------- rendering helpers ----------
+FRAME_CACHE_BYTES = 192*1024*1024   # decoded frame budget (surfaces + index arrays)
+TILE_BUDGET = 1/60.0                # seconds of tile rendering per displayed frame
+
 class ShapeCache:
-    def __init__(self, shapes, palette):
-        self.shapes=shapes; self.palette=palette; self.cache={}
-    def get(self, shape, frame):
+    # bounded LRU of (surface, xoff, yoff, index pixels); pixels allow re-coloring
+    def __init__(self, shapes, palette, max_bytes=FRAME_CACHE_BYTES):
+        self.shapes=shapes; self.palette=palette
+        self.cache=cache_lib.FrameCache(max_bytes)
+    def entry(self, shape, frame):
+        # full (surface, xoff, yoff, index pixels) tuple, decoded on a miss
         k=(shape,frame)
-        if k in self.cache: return self.cache[k]
+        hit=self.cache.get(k)
+        if hit is not None: return hit
         if not (0<=shape<self.shapes.num_types): raise IndexError
         fcount=self.shapes.frame_counts[shape]
         if fcount==0: raise IndexError
         frame = min(frame, fcount-1)
-        finfo=self.shapes.frame_info(shape, frame)
-        surf,xoff,yoff = decode_frame_surface_vb_exact(self.shapes.f, finfo, self.palette)
-        self.cache[k]=(surf,xoff,yoff)
-        return surf,xoff,yoff
+        entry = decode_frame_surface(self.shapes, shape, frame, self.palette)
+        self.cache.put(k, entry)
+        return entry
+    def prefetch(self, keys):
+        # decode the frames of keys not resident yet in one shape_lib batch
+        todo={}
+        for k in keys:
+            shape,frame=k
+            if k in self.cache or k in todo or not (0<=shape<self.shapes.num_types): continue
+            fcount=self.shapes.frame_counts[shape]
+            if fcount: todo[k]=(shape,min(frame,fcount-1))
+        if not todo: return
+        try: decoded=self.shapes.file.decode_many(todo.values())
+        except IndexError: return   # entry() decodes one by one then
+        for i,k in enumerate(todo):
+            try: pixels,xoff,yoff,_=decoded[i]
+            except ValueError: continue   # left to entry() to report
+            # own copy: the batch view would pin the whole batch array past
+            # eviction, while the cache charges only the view's bytes
+            pixels=pixels.copy()
+            self.cache.put(k,(self.palette.to_surface(pixels),xoff,yoff,pixels))
+    def get(self, shape, frame):
+        return self.entry(shape,frame)[:3]
+    def get_scaled(self, shape, frame, zoom):
+        # smoothscaled copy per zoom level, cached next to the 1:1 surface
+        if zoom==1.0: return self.get(shape,frame)
+        k=(shape,frame,zoom)
+        hit=self.cache.get(k)
+        if hit is not None: return hit[:3]
+        surf,xoff,yoff,pixels=self.entry(shape,frame)
+        entry=(scale_surface(surf,zoom),xoff,yoff,pixels)
+        self.cache.put(k, entry)
+        return entry[:3]
+    def set_palette(self, palette):
+        # re-color resident frames from their index arrays, no re-decode
+        self.palette=palette
+        def recolor(k,e):
+            surf=palette.to_surface(e[3])
+            return (scale_surface(surf,k[2]) if len(k)==3 else surf),e[1],e[2],e[3]
+        self.cache.replace_all(recolor)
+
+def scale_surface(surf, zoom):
+    w=max(1,int(surf.get_width()*zoom)); h=max(1,int(surf.get_height()*zoom))
+    return pygame.transform.smoothscale(surf,(w,h))
 
 def world_to_screen(x,y,z):
     # S=4 for regular objects (globs are expanded to regular coords)
@@ -302,6 +183,7 @@ def main():
     nonfixed_path = os.path.join(base_root,"GAMEDAT","NONFIXED.DAT")
     glob_path_candidates = [os.path.join(base_static,"GLOB.FLX"),
                             os.path.join(base_static,"glob.flx")]
+    typeflag_path = os.path.join(base_static,"TYPEFLAG.DAT")
 
     pygame.init()
     pygame.display.set_caption("Ultima VIII Map Viewer")
@@ -323,13 +205,24 @@ def main():
     for gp in glob_path_candidates:
         if os.path.exists(gp):
             try:
-                glob = GlobArchive(gp)
+                glob = map_lib.GlobTable.load(gp)
                 break
             except Exception:
                 pass
 
+    # paint order from Pentagram's ItemSorter (TYPEFLAG.DAT footprints);
+    # without TYPEFLAG.DAT fall back to the quick (x+y, z, x) key
+    typeflags = sorter = None
+    if os.path.exists(typeflag_path):
+        try:
+            typeflags = typeflag_lib.TypeFlags.load(typeflag_path)
+            sorter = sort_lib.ItemSorter(typeflags)
+        except Exception:
+            pass
+
     # state
     show_fixed=True; show_nonfixed=True; use_globs=True
+    show_editor=True  # eggs, markers etc. (TYPEFLAG EDITOR bit; hidden in-game)
     map_index=0
     zoom_levels=[0.25,0.5,1.0,2.0,3.0]
     zoom_idx=2  # 1.0x
@@ -340,7 +233,6 @@ def main():
     # Z filter
     z_filter_on=False
     z_ceil=64  # default “interior slice”
-    def z_ok(z): return (not z_filter_on) or (z<=z_ceil)
 
     # dynamic buttons (positions filled at draw time)
     buttons,_=layout_buttons(panel_w, 0)
@@ -358,7 +250,7 @@ def main():
     def load_map(idx):
         nonlocal used_offsets
         used_offsets={"fixed":None,"nonfixed":None}
-        fobjs=[]; nobjs=[]
+        fobjs=nobjs=map_lib.EMPTY_OBJECTS
         if show_fixed and fixed:
             fobjs, off = fixed.read_map(idx); used_offsets["fixed"]=off
         if show_nonfixed and nonfixed:
@@ -368,53 +260,70 @@ def main():
     fixed_objs, nonfixed_objs = load_map(map_index)
 
     def expand_globs(objs):
-        if not (use_globs and glob): return []
-        out=[]
-        for o in objs:
-            if o.shape==2 and o.quality>0:  # glob entry
-                g = glob.get(o.quality)
-                for go in g:
-                    # Convert per docs:
-                    mx = go.dx*2 + o.x
-                    my = go.dy*2 + o.y - 576
-                    mz = go.dz + o.z
-                    out.append(MapObject(mx,my,mz,go.shape,go.frame,0,0,0,0,0))
-        return out
+        # every glob entry of the map at once; cached per map until its eggs change
+        if not (use_globs and glob): return np.zeros(0, dtype=map_lib.ITEM_DTYPE)
+        eggs = objs[(objs["shape"]==map_lib.GLOB_EGG_SHAPE) & (objs["quality"]>0)]  # glob entries
+        # Convert per docs: (dx*2 + x, dy*2 + y - 576, dz + z)
+        return glob.expand_map(map_index, eggs, y_bias=-576)
 
     def current_objects():
+        # ITEM_DTYPE array of everything drawable (globs expanded, Z filtered)
         base=[]
-        if show_fixed:    base.extend(fixed_objs)
-        if show_nonfixed: base.extend(nonfixed_objs)
-        # expand globs into real drawables
-        base.extend(expand_globs(base))
-        # Z filter
-        return [o for o in base if z_ok(o.z)]
-
-    def sort_key(o): return (o.x + o.y, o.z, o.x)
-
-    def compute_bounds_at_zoom1():
-        objs=current_objects()
-        if not objs: return None
-        first=True
-        minx=miny=maxx=maxy=0
-        for o in objs:
+        if show_fixed:    base.append(fixed_objs)
+        if show_nonfixed: base.append(nonfixed_objs)
+        base = np.concatenate(base) if base else map_lib.EMPTY_OBJECTS
+        items = np.concatenate([map_lib.to_items(base), expand_globs(base)])
+        if z_filter_on: items = items[items["z"]<=z_ceil]
+        if typeflags is not None and not show_editor:
+            items = items[~typeflags.has(items["shape"], typeflag_lib.SI_EDITOR)]
+        return items
+
+    scene={"key":None,"index":None}
+    def screen_index():
+        # paint-ordered items + screen-space grid; rebuilt only when the
+        # object set changes (map, layer toggles, Z filter), not on pan/zoom
+        key=(map_index, show_fixed, show_nonfixed, use_globs, z_filter_on, z_ceil, show_editor)
+        if scene["key"]!=key:
+            old=scene["index"]
+            if sorter is None:
+                scene["index"]=map_lib.ScreenIndex(current_objects(), shapes.index)
+            else:
+                # the sorter keeps its dependency graph: a toggle only
+                # compares the objects that came or went
+                sorter.sync(current_objects())
+                scene["index"]=map_lib.ScreenIndex(sorter.ordered_items(), shapes.index, order=None)
+            if old is not None and scene["key"][0]==map_index:
+                # same map, different object set: only tiles under the
+                # objects that appeared or vanished need re-rendering
+                tiles.invalidate(map_lib.changed_boxes(old, scene["index"]))
+            else:
+                tiles.clear()
+            scene["key"]=key
+        return scene["index"]
+
+    def render_tile(zoom, tx, ty):
+        # one TILE_SIZE square of the zoomed map, objects in paint order
+        T=tiles.tile_size
+        tile=pygame.Surface((T,T)).convert()
+        tile.fill((0,0,0))
+        si=screen_index()
+        pad=2/zoom+1
+        vis=si.visible(math.floor(tx*T/zoom-pad), math.floor(ty*T/zoom-pad),
+                       math.ceil((tx+1)*T/zoom+pad), math.ceil((ty+1)*T/zoom+pad))
+        shapes_vis=si.items["shape"][vis].tolist(); frames_vis=si.items["frame"][vis].tolist()
+        cache.prefetch(zip(shapes_vis,frames_vis))
+        for (x0,y0,_,_),shape,frame in zip(si.boxes[vis].tolist(), shapes_vis, frames_vis):
             try:
-                surf,xoff,yoff = cache.get(o.shape,o.frame)
+                surf,_,_ = cache.get_scaled(shape,frame,zoom)
             except Exception:
                 continue
-            sx,sy = world_to_screen(o.x,o.y,o.z)
-            dx,dy = sx-xoff, sy-yoff
-            w,h = surf.get_width(), surf.get_height()
-            if first:
-                minx, miny, maxx, maxy = dx, dy, dx+w, dy+h
-                first=False
-            else:
-                if dx<minx: minx=dx
-                if dy<miny: miny=dy
-                if dx+w>maxx: maxx=dx+w
-                if dy+h>maxy: maxy=dy+h
-        if first: return None
-        return (minx,miny,maxx,maxy)
+            tile.blit(surf,(math.floor(x0*zoom)-tx*T, math.floor(y0*zoom)-ty*T))
+        return tile
+
+    tiles = tile_lib.TileCache(render_tile)
+
+    def compute_bounds_at_zoom1():
+        return screen_index().bounds()
 
     def fit_to_map():
         nonlocal cam_x,cam_y,zoom_idx,status_msg
@@ -441,20 +350,27 @@ def main():
         cam_x=cam_y=0; zoom_idx=2; status_msg="View reset."
 
     # drawing ------------------------------------------------
-    def redraw():
+    def redraw(budget=TILE_BUDGET):
+        # returns the number of visible tiles still to render
         nonlocal status_msg
         win.fill((0,0,0))
         z = get_zoom()
+        # cached tiles of the view; missing ones rendered centre-first
+        # within the budget, the rest on the following frames
+        left = -cam_x - view_w//2; top = -cam_y - view_h//2
+        ready, pending = tiles.update(z, left, top, view_w, view_h, budget)
         # dynamic layout: compute info text then position buttons below it
         info = [
             "Ultima VIII Map Viewer",
             f"Map: {map_index}  (0..255)",
             f"Objects: fixed={len(fixed_objs) if show_fixed else 0}"
             f"  nonfixed={len(nonfixed_objs) if show_nonfixed else 0}",
-            f"Shapes decoded (cached): {len(cache.cache)}",
+            f"Tiles: {tiles.summary()}" + (f", {pending} pending" if pending else ""),
+            f"Frame cache: {cache.cache.summary()}",
             f"Zoom: {z:.2f}x    Camera: ({cam_x},{cam_y})",
             f"Globs: {'ON' if use_globs and glob else 'OFF'}   "
             f"Z filter: {'All' if not z_filter_on else '≤ '+str(z_ceil)}",
+            f"Editor items (E): {'n/a' if typeflags is None else 'ON' if show_editor else 'OFF'}",
             "Offsets (debug): "
             f"  FIXED: " + (str(used_offsets['fixed']) if used_offsets['fixed'] else "-") + 
             "   NONFIXED: " + (str(used_offsets['nonfixed']) if used_offsets['nonfixed'] else "-"),
@@ -484,30 +400,18 @@ def main():
         btn_z_toggle.label= "Z Filter: All" if not z_filter_on else f"Z Filter: ≤ {z_ceil}"
 
         # draw world
-        view_rect = pygame.Rect(0,0,view_w,view_h)
-        objs = sorted(current_objects(), key=sort_key)
-        for o in objs:
-            try:
-                surf,xoff,yoff = cache.get(o.shape,o.frame)
-            except Exception:
-                continue
-            sx,sy = world_to_screen(o.x,o.y,o.z)
-            dx = (sx - xoff)*z + cam_x + view_w*0.5
-            dy = (sy - yoff)*z + cam_y + view_h*0.5
-            if z!=1.0:
-                w=max(1,int(surf.get_width()*z)); h=max(1,int(surf.get_height()*z))
-                scaled = pygame.transform.smoothscale(surf,(w,h))
-                srect = scaled.get_rect(topleft=(int(dx),int(dy)))
-                if srect.colliderect(view_rect): win.blit(scaled,srect.topleft)
-            else:
-                srect = surf.get_rect(topleft=(int(dx),int(dy)))
-                if srect.colliderect(view_rect): win.blit(surf,srect.topleft)
+        win.set_clip(pygame.Rect(0,0,view_w,view_h))
+        T = tiles.tile_size
+        for tx,ty,tile in ready:
+            win.blit(tile,(tx*T-left, ty*T-top))
+        win.set_clip(None)
 
         # draw panel
         panel = pygame.Surface((panel_w, view_h))
         draw_panel(panel, font, info, buttons)
         win.blit(panel, (view_w,0))
         pygame.display.flip()
+        return pending
 
     # util
     def step_zoom(d):
@@ -515,33 +419,34 @@ def main():
         zoom_idx = max(0, min(len(zoom_levels)-1, zoom_idx + d))
 
     # initial draw
-    redraw()
+    pending = redraw()
 
     # loop
     dragging=False; drag_start=(0,0); cam_start=(0,0)
-    clock=pygame.time.Clock(); running=True
+    clock=pygame.time.Clock(); running=True; need_redraw=False
     while running:
         for ev in pygame.event.get():
             if ev.type==pygame.QUIT: running=False
             elif ev.type==pygame.KEYDOWN:
                 if ev.key==pygame.K_ESCAPE: running=False
                 elif ev.key==pygame.K_a:
-                    map_index=max(0,map_index-1); fixed_objs,nonfixed_objs=load_map(map_index); redraw()
+                    map_index=max(0,map_index-1); fixed_objs,nonfixed_objs=load_map(map_index); need_redraw=True
                 elif ev.key==pygame.K_d:
-                    map_index=min(255,map_index+1); fixed_objs,nonfixed_objs=load_map(map_index); redraw()
-                elif ev.key in (pygame.K_EQUALS, pygame.K_PLUS): step_zoom(+1); redraw()
-                elif ev.key==pygame.K_MINUS: step_zoom(-1); redraw()
-                elif ev.key==pygame.K_f: fit_to_map(); redraw()
-                elif ev.key==pygame.K_r: reset_view(); redraw()
-                elif ev.key==pygame.K_LEFT: cam_x+=32; redraw()
-                elif ev.key==pygame.K_RIGHT: cam_x-=32; redraw()
-                elif ev.key==pygame.K_UP: cam_y+=32; redraw()
-                elif ev.key==pygame.K_DOWN: cam_y-=32; redraw()
-                elif ev.key==pygame.K_LEFTBRACKET: z_ceil=max(0,z_ceil-4); redraw()
-                elif ev.key==pygame.K_RIGHTBRACKET: z_ceil=min(255,z_ceil+4); redraw()
+                    map_index=min(255,map_index+1); fixed_objs,nonfixed_objs=load_map(map_index); need_redraw=True
+                elif ev.key in (pygame.K_EQUALS, pygame.K_PLUS): step_zoom(+1); need_redraw=True
+                elif ev.key==pygame.K_MINUS: step_zoom(-1); need_redraw=True
+                elif ev.key==pygame.K_f: fit_to_map(); need_redraw=True
+                elif ev.key==pygame.K_r: reset_view(); need_redraw=True
+                elif ev.key==pygame.K_LEFT: cam_x+=32; need_redraw=True
+                elif ev.key==pygame.K_RIGHT: cam_x-=32; need_redraw=True
+                elif ev.key==pygame.K_UP: cam_y+=32; need_redraw=True
+                elif ev.key==pygame.K_DOWN: cam_y-=32; need_redraw=True
+                elif ev.key==pygame.K_LEFTBRACKET: z_ceil=max(0,z_ceil-4); need_redraw=True
+                elif ev.key==pygame.K_RIGHTBRACKET: z_ceil=min(255,z_ceil+4); need_redraw=True
                 elif ev.key==pygame.K_BACKSLASH:
                     nonlocal_z = locals()  # silence linter
-                    z_filter_on = not z_filter_on; redraw()
+                    z_filter_on = not z_filter_on; need_redraw=True
+                elif ev.key==pygame.K_e: show_editor = not show_editor; need_redraw=True
             elif ev.type==pygame.MOUSEBUTTONDOWN:
                 mx,my=ev.pos
                 if ev.button==1:
@@ -573,24 +478,27 @@ def main():
                             z_filter_on = not z_filter_on
                         # reload because expanded set / filter may change
                         fixed_objs,nonfixed_objs = load_map(map_index)
-                        redraw()
+                        need_redraw=True
                 elif ev.button==3:
                     dragging=True; drag_start=(mx,my); cam_start=(cam_x,cam_y)
-                elif ev.button==4: step_zoom(+1); redraw()
-                elif ev.button==5: step_zoom(-1); redraw()
+                elif ev.button==4: step_zoom(+1); need_redraw=True
+                elif ev.button==5: step_zoom(-1); need_redraw=True
             elif ev.type==pygame.MOUSEBUTTONUP and ev.button==3:
                 dragging=False
             elif ev.type==pygame.MOUSEMOTION and dragging:
                 mx,my=ev.pos
                 cam_x = cam_start[0] + (mx - drag_start[0])
                 cam_y = cam_start[1] + (my - drag_start[1])
-                redraw()
+                need_redraw=True
+        # one redraw per frame however many events arrived (drags send
+        # many); keep going while visible tiles are still pending
+        if need_redraw or pending:
+            pending = redraw(); need_redraw=False
         clock.tick(60)
 
     # cleanup
     if fixed: fixed.close()
     if nonfixed: nonfixed.close()
-    if glob: glob.close()
     shapes.close()
     pygame.quit()
 
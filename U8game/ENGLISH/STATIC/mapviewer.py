@@ -1,22 +1,38 @@
 # u8_map_viewer.py  —  Single-file Ultima VIII map viewer (Tkinter + PIL)
 # - Correct U8 shape decoding per Pentagram (row-offset 'unfudge')
 # - Correct GLOB expansion and dimetric projection
+# - Paint order from Pentagram's ItemSorter (sort_lib) when TYPEFLAG.DAT is there
 # - Mouse zoom/pan, arrow-key pan, PNG export
 #
-# Requirements: Pillow (PIL)
-#   pip install pillow
+# Requirements: Pillow (PIL), numpy
+#   pip install pillow numpy
 
-import io
+import math
 import os
+import queue
 import struct
+import threading
+import time
 from pathlib import Path
 from dataclasses import dataclass
-from typing import List, Tuple, Optional
+from typing import Tuple, Optional
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
 
+import numpy as np
+
+from cache_lib import FrameCache
+from flx_lib import FlxIndex, get_flx_index
+from map_lib import (EMPTY_OBJECTS, GLOB_EGG_SHAPE, GlobTable, ScreenIndex,
+                     objects_from_buffer, to_items)
+from palette_lib import Palette
+from shape_lib import ShapeFile
+from sort_lib import ItemSorter
+from tile_lib import TileCache
+from typeflag_lib import SI_EDITOR, TypeFlags
+
 
 # ---------- Low-level helpers ----------
 
@@ -49,23 +65,15 @@ def rd_u32(f) -> int:
 
 class FlexArchive:
     """
-    Minimal FLX reader:
+    Minimal FLX reader on top of the shared flx_lib.FlxIndex:
       - Count at offset 0x54 (84)
-      - Record table starts at 0x90 (144)
+      - Record table at 0x80 (128), layout detected by FlxIndex
       - Each record: <u32 offset><u32 length>; zero=empty
     """
     def __init__(self, path: Path):
         self.path = Path(path)
-        self.count = 0
-        self.records: List[Tuple[int, int]] = []
-        with open(self.path, 'rb') as f:
-            f.seek(0x54)
-            self.count = rd_u32(f)
-            f.seek(0x90)
-            for _ in range(self.count):
-                off = rd_u32(f)
-                ln = rd_u32(f)
-                self.records.append((off, ln))
+        self.records: FlxIndex = get_flx_index(self.path)
+        self.count = self.records.count
         self.size = self.path.stat().st_size
 
     def get_record(self, idx: int) -> Optional[bytes]:
@@ -81,27 +89,19 @@ class FlexArchive:
 
 # ---------- Palette ----------
 
-def load_palette(pal_path: Path) -> List[Tuple[int, int, int, int]]:
+def load_palette(pal_path: Path) -> Palette:
     """
     U8 palette: first 4 bytes often junk/unused, then 256*3 bytes (0..63) per channel.
-    We expand to 0..255. Index 255 is transparent.
+    Expanded to 0..255 into an RGBA lookup table. Index 255 is transparent.
     """
-    raw = Path(pal_path).read_bytes()
-    if len(raw) < 4 + 256*3:
-        raise ValueError("Palette file too small")
-    raw_rgb = raw[4:4+256*3]
-    pal: List[Tuple[int,int,int,int]] = []
-    for i in range(256):
-        r = raw_rgb[i*3 + 0] * 4
-        g = raw_rgb[i*3 + 1] * 4
-        b = raw_rgb[i*3 + 2] * 4
-        a = 0 if i == 255 else 255
-        pal.append((r, g, b, a))
-    return pal
+    return Palette.load(pal_path)
 
 
 # ---------- Shapes ----------
 
+FRAME_CACHE_BYTES = 256 * 1024 * 1024  # decoded frames kept across renders
+PREFETCH_CHUNK = 2048   # frames per shape_lib batch; cancel/deadline are checked between them
+
 @dataclass
 class U8Frame:
     width: int
@@ -109,6 +109,7 @@ class U8Frame:
     xoff: int
     yoff: int
     rgba: Image.Image  # premade RGBA image
+    pixels: Optional[np.ndarray] = None  # palette indices, kept for re-coloring
 
 class ShapeArchive:
     """
@@ -129,161 +130,75 @@ class ShapeArchive:
        18: height * u16 line offsets (each entry must be "unfudged" like Pentagram)
         ... RLE row data
     """
-    def __init__(self, flx_path: Path, palette: List[Tuple[int,int,int,int]]):
-        self.flx = FlexArchive(flx_path)
+    def __init__(self, flx_path: Path, palette: Palette):
+        self.file = ShapeFile(flx_path)   # mmap + sidecar-cached ShapeIndex
+        self.index = self.file.index
+        self.palette = palette
+        # (shape, frame) -> U8Frame, LRU-bounded by bytes of RGBA image + index pixels
+        self.cache = FrameCache(FRAME_CACHE_BYTES)
+
+    def _decode_frame(self, shape_index: int, frame_index: int) -> U8Frame:
+        # Row decoding is shared with the other tools (shape_lib.decode_frame);
+        # the palette LUT turns the index array into RGBA (index 255 -> alpha 0).
+        pixels, xoff, yoff, _ = self.file.decode(shape_index, frame_index)
+        height, width = pixels.shape
+        return U8Frame(width, height, xoff, yoff, self.palette.to_image(pixels), pixels)
+
+    def set_palette(self, palette: Palette):
+        """Swap palettes (e.g. an XFORMPAL remap); cached frames are re-colored, not re-decoded."""
         self.palette = palette
-        self.cache: dict[Tuple[int, int], U8Frame] = {}  # (shape, frame) -> U8Frame
-
-    def _decode_frame(self, shape_blob: bytes, frame_offset: int, frame_size: int) -> U8Frame:
-        f = io.BytesIO(shape_blob)
-        f.seek(frame_offset)
-
-        # Frame header
-        _shape_index = rd_u16(f)
-        _frame_index = rd_u16(f)
-        _unk4 = rd_u32(f)
-        compression = rd_u16(f)
-        width = rd_u16(f)
-        height = rd_u16(f)
-        xoff = struct.unpack('<h', f.read(2))[0]  # signed
-        yoff = struct.unpack('<h', f.read(2))[0]
-
-        # Row offsets table starts here
-        row_table_start = f.tell()
-        # Pentagram "unfudge": stored offsets are relative, and we subtract (height - i) * 2
-        # Then row data actual start = row_table_start + 2*height + unfudged
-        row_offsets_unf = []
-        for i in range(height):
-            rel = rd_u16(f)
-            unf = rel - (height - i) * 2
-            if unf < 0:
-                # fallback to non-unfudged if this looks wrong
-                unf = rel
-            row_offsets_unf.append(unf)
-
-        row_data_base = row_table_start + 2 * height
-
-        # Build RGBA image
-        img = Image.new('RGBA', (max(1, width), max(1, height)))
-        px = img.load()
-
-        # Decode rows
-        for y in range(height):
-            row_pos = row_data_base + row_offsets_unf[y]
-            if row_pos < 0 or row_pos >= len(shape_blob):
-                continue
-            f.seek(row_pos)
-            xpos = 0
-            # Loop until row filled
-            while xpos < width:
-                skip = rd_u8(f)
-                xpos += skip
-                if xpos >= width:
-                    break
-                dlen = rd_u8(f)
-                if compression == 1:
-                    rtype = dlen & 1
-                    dcount = dlen >> 1
-                    if rtype == 0:
-                        # literal run
-                        for _ in range(dcount):
-                            if xpos >= width:
-                                break
-                            col = rd_u8(f)
-                            rgba = self.palette[col]
-                            px[xpos, y] = rgba
-                            xpos += 1
-                    else:
-                        # repeat run
-                        col = rd_u8(f)
-                        rgba = self.palette[col]
-                        for _ in range(dcount):
-                            if xpos >= width:
-                                break
-                            px[xpos, y] = rgba
-                            xpos += 1
-                else:
-                    # uncompressed: dlen literal bytes
-                    for _ in range(dlen):
-                        if xpos >= width:
-                            break
-                        col = rd_u8(f)
-                        rgba = self.palette[col]
-                        px[xpos, y] = rgba
-                        xpos += 1
-
-        return U8Frame(width, height, xoff, yoff, img)
+
+        def recolor(_key, fr: U8Frame) -> U8Frame:
+            fr.rgba = palette.to_image(fr.pixels)
+            return fr
+        self.cache.replace_all(recolor)
+
+    def prefetch(self, keys, cancel: Optional[threading.Event] = None, deadline: Optional[float] = None):
+        """
+        Decode the valid frames of keys not cached yet, PREFETCH_CHUNK at a
+        time in shape_lib batches (first seen first). Stops between batches
+        once cancel is set or time.perf_counter() passes deadline.
+        """
+        counts = self.index.frame_counts
+        todo = list(dict.fromkeys(
+            k for k in keys
+            if k not in self.cache and 0 <= k[0] < self.index.num_shapes and 0 <= k[1] < counts[k[0]]))
+        for at in range(0, len(todo), PREFETCH_CHUNK):
+            if cancel is not None and cancel.is_set():
+                return
+            if deadline is not None and time.perf_counter() > deadline:
+                return
+            chunk = todo[at:at + PREFETCH_CHUNK]
+            decoded = self.file.decode_many(chunk)
+            for i, key in enumerate(chunk):
+                try:
+                    pixels, xoff, yoff, _ = decoded[i]
+                except ValueError:
+                    continue    # left to get_frame to report
+                # a copy, not a view pinning the whole batch: the cache budget
+                # counts only the frame's own bytes
+                pixels = pixels.copy()
+                height, width = pixels.shape
+                self.cache.put(key, U8Frame(width, height, xoff, yoff, self.palette.to_image(pixels), pixels))
 
     def get_frame(self, shape_index: int, frame_index: int) -> Optional[U8Frame]:
         key = (shape_index, frame_index)
-        if key in self.cache:
-            return self.cache[key]
+        fr = self.cache.get(key)
+        if fr is not None:
+            return fr
 
-        blob = self.flx.get_record(shape_index)
-        if not blob:
-            return None
-        f = io.BytesIO(blob)
-        if len(blob) < 6:
+        if not (0 <= shape_index < self.index.num_shapes):
             return None
-
-        # Shape header: 0..1?, 2..3?, 4..5=frame count
-        f.seek(4)
-        frame_count = rd_u16(f)
-        if frame_index < 0 or frame_index >= frame_count:
+        if frame_index < 0 or frame_index >= self.index.frame_counts[shape_index]:
             return None
-
-        # Read frame headers
-        frames: List[Tuple[int, int]] = []  # (offset, size)
-        f.seek(6)
-        for _ in range(frame_count):
-            off = rd_u24(f)
-            _unknown = rd_u8(f)
-            size = rd_u16(f)
-            frames.append((off, size))
-
-        off, size = frames[frame_index]
-        fr = self._decode_frame(blob, off, size)
-        self.cache[key] = fr
-        return fr
+        return self.cache.put(key, self._decode_frame(shape_index, frame_index))
 
 
 # ---------- Map and glob ----------
 
-@dataclass
-class MapObj:
-    x: int
-    y: int
-    z: int
-    shape: int
-    frame: int
-
-class GlobArchive:
-    def __init__(self, path: Path):
-        self.flx = FlexArchive(path)
-
-    def expand(self, baseX: int, baseY: int, baseZ: int, glob_idx: int) -> List[MapObj]:
-        blob = self.flx.get_record(glob_idx)
-        if not blob:
-            return []
-        f = io.BytesIO(blob)
-        count = rd_u16(f)
-        out: List[MapObj] = []
-        for _ in range(count):
-            gx = rd_u8(f)
-            gy = rd_u8(f)
-            gz = rd_u8(f)
-            shape = rd_u16(f)
-            frame = rd_u8(f)
-            wx = baseX + 2 * gx
-            wy = baseY + 2 * gy
-            wz = baseZ + gz
-            out.append(MapObj(wx, wy, wz, shape, frame))
-        return out
-
-
-def read_map_record(blob: bytes) -> List[MapObj]:
+def read_map_record(blob: bytes) -> np.ndarray:
     """
-    16 bytes per object:
+    16 bytes per object, viewed as map_lib.MAP_OBJECT_DTYPE (no copy):
       0 u16 X
       2 u16 Y
       4 u8  Z
@@ -295,25 +210,7 @@ def read_map_record(blob: bytes) -> List[MapObj]:
      13 u8  MapIndex
      14 u16 NextId
     """
-    objs: List[MapObj] = []
-    n = len(blob) // 16
-    f = io.BytesIO(blob)
-    for _ in range(n):
-        x = rd_u16(f)
-        y = rd_u16(f)
-        z = rd_u8(f)
-        shape = rd_u16(f)
-        frame = rd_u8(f)
-        _flags = rd_u16(f)
-        quality = rd_u16(f)
-        _npc = rd_u8(f)
-        _map = rd_u8(f)
-        _next = rd_u16(f)
-        objs.append(MapObj(x, y, z, shape, frame))
-        # We keep quality available by returning separate list if needed
-        # For glob we will handle in renderer, because we must mix-glob with normal objs
-        objs[-1].quality = quality  # type: ignore
-    return objs
+    return objects_from_buffer(blob)
 
 
 # ---------- Renderer ----------
@@ -323,94 +220,131 @@ def project_to_screen(x: int, y: int, z: int) -> Tuple[int, int]:
     sy = (x + y) // 8 - z
     return sx, sy
 
+class RenderCancelled(Exception):
+    """Raised by render_map_to_image when its cancel event is set."""
+
+
+# Check the cancel event every this many objects
+CANCEL_CHECK_EVERY = 256
+
 def render_map_to_image(
     fixed_flex: FlexArchive,
     nonfixed_flex: Optional[FlexArchive],
     map_idx: int,
     shapes: ShapeArchive,
-    globs: GlobArchive,
+    globs: GlobTable,
     glob_y_bias_minus_576: bool,
     cull_margin: Optional[Tuple[int,int,int,int]] = None,
+    reduce: int = 1,
+    cancel: Optional[threading.Event] = None,
+    sorter: Optional[ItemSorter] = None,
+    hide_editor: Optional[TypeFlags] = None,
+    decode_budget: Optional[float] = None,
 ) -> Image.Image:
+    """
+    Composites a map. reduce > 1 renders at 1/reduce size (a quick preview;
+    frames are shrunk with Image.reduce). Safe to call from a worker thread;
+    raises RenderCancelled soon after cancel is set.
+
+    With a sorter (TYPEFLAG.DAT loaded) objects are painted in Pentagram's
+    ItemSorter order; the sorter is synced to the map's objects, so passing
+    the same one again only re-sorts what changed. Otherwise the quick
+    (X+Y, Z, X) key is used. hide_editor drops the shapes its TYPEFLAG
+    table marks EDITOR (eggs, markers), as the game does.
+
+    decode_budget caps the seconds spent decoding frames; objects whose
+    frame is not cached by then are left out (for the preview). cancel is
+    checked between the stages (objects, sort, decode, compositing), inside
+    the decode between batches and every CANCEL_CHECK_EVERY objects after.
+    """
+    def check_cancel():
+        if cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+
     # collect objects from fixed and (optionally) nonfixed
-    objs: List[MapObj] = []
+    parts = []
     blob = fixed_flex.get_record(map_idx)
     if blob:
-        objs.extend(read_map_record(blob))
+        parts.append(read_map_record(blob))
     if nonfixed_flex:
         nb = nonfixed_flex.get_record(map_idx)
         if nb:
-            objs.extend(read_map_record(nb))
-
-    # Expand globs (shape==2, quality is glob index)
-    expanded: List[MapObj] = []
-    for o in objs:
-        if o.shape == 2:
-            gidx = getattr(o, 'quality', 0)  # type: ignore
-            if glob_y_bias_minus_576:
-                # This toggle mimics the old doc fudge; we bias Y before expanding.
-                expanded.extend(
-                    [MapObj(x=oo.x, y=oo.y - 576, z=oo.z, shape=oo.shape, frame=oo.frame)
-                     for oo in globs.expand(o.x, o.y, o.z, gidx)]
-                )
-            else:
-                expanded.extend(globs.expand(o.x, o.y, o.z, gidx))
-        else:
-            expanded.append(o)
+            parts.append(read_map_record(nb))
+    objs = np.concatenate(parts) if parts else EMPTY_OBJECTS
+
+    # Expand globs (shape==2, quality is glob index) in one step; the result
+    # is cached per map and reused until the map's eggs change.
+    # The -576 toggle mimics the old doc fudge; Y is biased after expanding.
+    eggs = objs["shape"] == GLOB_EGG_SHAPE
+    globbed = globs.expand_map((map_idx, nonfixed_flex is not None), objs[eggs],
+                               y_bias=-576 if glob_y_bias_minus_576 else 0)
+    items = np.concatenate([to_items(objs[~eggs]), globbed])
+    if hide_editor is not None:
+        items = items[~hide_editor.has(items["shape"], SI_EDITOR)]
+    check_cancel()
+    # paint order and screen boxes straight from the frame table;
+    # the spatial grid culls before anything is decoded
+    if sorter is not None:
+        sorter.sync(items)
+        check_cancel()
+        scene = ScreenIndex(sorter.ordered_items(), shapes.index, clamp_frames=False, order=None)
+    else:
+        scene = ScreenIndex(items, shapes.index, clamp_frames=False)
+    bounds = scene.bounds()
+    if bounds is None:
+        return Image.new('RGBA', (1, 1), (0, 0, 0, 0))
+    minx, miny, maxx, maxy = bounds
+    if cull_margin is not None:
+        left, top, right, bottom = cull_margin
+        # inclusive edges, as before
+        vis = scene.visible(left - 1, top - 1, right + 1, bottom + 1)
+    else:
+        vis = np.arange(len(scene))
 
-    # Determine bounds and build draw list with screen coords
-    draw_list = []
-    minx = miny =  10**9
-    maxx = maxy = -10**9
-
-    for o in expanded:
-        fr = shapes.get_frame(o.shape, o.frame)
-        if not fr:
-            continue
-        sx, sy = project_to_screen(o.x, o.y, o.z)
-        # Anchor: subtract hotspot offsets
-        sx -= fr.xoff
-        sy -= fr.yoff
-
-        # bounds
-        minx = min(minx, sx)
-        miny = min(miny, sy)
-        maxx = max(maxx, sx + fr.width)
-        maxy = max(maxy, sy + fr.height)
-
-        draw_list.append((o.x + o.y, o.z, o.x, sx, sy, fr))
+    check_cancel()
 
+    draw_list = []
+    vis_shapes = scene.items["shape"][vis].tolist()
+    vis_frames = scene.items["frame"][vis].tolist()
+    deadline = None if decode_budget is None else time.perf_counter() + decode_budget
+    shapes.prefetch(zip(vis_shapes, vis_frames), cancel, deadline)
+    check_cancel()
+    for i, ((x0, y0, _, _), shape, frame) in enumerate(zip(scene.boxes[vis].tolist(), vis_shapes, vis_frames)):
+        if cancel is not None and i % CANCEL_CHECK_EVERY == 0 and cancel.is_set():
+            raise RenderCancelled()
+        # past the budget only frames already decoded are drawn
+        fr = shapes.get_frame(shape, frame) if deadline is None else shapes.cache.get((shape, frame))
+        if fr:
+            draw_list.append((x0, y0, fr))
     if not draw_list:
         return Image.new('RGBA', (1, 1), (0, 0, 0, 0))
 
-    # Optional culling by screen bbox (before allocating big image)
-    if cull_margin is not None:
-        left, top, right, bottom = cull_margin
-        draw_list = [d for d in draw_list if not (
-            d[3] > right or d[4] > bottom or
-            d[3] + d[5].width < left or d[4] + d[5].height < top
-        )]
-        if not draw_list:
-            return Image.new('RGBA', (1, 1), (0, 0, 0, 0))
-
     # normalize
     ox = -minx
     oy = -miny
     W = max(1, maxx - minx)
     H = max(1, maxy - miny)
+    if reduce > 1:
+        W, H = -(-W // reduce), -(-H // reduce)
     out = Image.new('RGBA', (W, H), (0,0,0,0))
 
-    # z-order: (X+Y, Z, X)
-    draw_list.sort(key=lambda t: (t[0], t[1], t[2]))
-
-    for _, _, _, sx, sy, fr in draw_list:
-        out.alpha_composite(fr.rgba, dest=(sx + ox, sy + oy))
+    for i, (sx, sy, fr) in enumerate(draw_list):
+        if cancel is not None and i % CANCEL_CHECK_EVERY == 0 and cancel.is_set():
+            raise RenderCancelled()
+        if reduce > 1:
+            out.alpha_composite(fr.rgba.reduce(reduce), dest=((sx + ox) // reduce, (sy + oy) // reduce))
+        else:
+            out.alpha_composite(fr.rgba, dest=(sx + ox, sy + oy))
 
     return out
 
 
 # ---------- Tk app ----------
 
+PREVIEW_REDUCE = 4      # the first, quick pass renders at 1/4 size
+PREVIEW_DECODE_SECONDS = 0.25   # frame decoding the preview may spend; the rest waits for the full pass
+RENDER_POLL_MS = 30
+
 class MapViewerApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -421,21 +355,34 @@ class MapViewerApp(tk.Tk):
         self.game_dir: Optional[Path] = None
         self.fixed: Optional[FlexArchive] = None
         self.nonfixed: Optional[FlexArchive] = None
-        self.glob: Optional[GlobArchive] = None
+        self.glob: Optional[GlobTable] = None
         self.shapes: Optional[ShapeArchive] = None
-        self.palette: Optional[List[Tuple[int,int,int,int]]] = None
+        self.palette: Optional[Palette] = None
+        self.typeflags: Optional[TypeFlags] = None
 
         self.map_idx = 0
         self.use_nonfixed = tk.BooleanVar(value=True)
         self.glob_y_bias_toggle = tk.BooleanVar(value=False)
         self.cull_toggle = tk.BooleanVar(value=True)
+        self.editor_toggle = tk.BooleanVar(value=True)
 
         # Canvas + controls
         self._build_ui()
 
         # View transform
         self.base_image: Optional[Image.Image] = None
-        self.display_image: Optional[ImageTk.PhotoImage] = None
+        # zoomed tiles of base_image (PhotoImages hold ~4 bytes per pixel)
+        self.tiles = TileCache(self._render_tile, sizer=lambda p: p.width() * p.height() * 4)
+        self.base_reduce = 1    # base_image is a 1/base_reduce preview while > 1
+
+        # Background rendering: one worker thread per request; results come
+        # back through the queue tagged with the request's generation, and
+        # only the newest generation is shown.
+        self._render_gen = 0
+        self._render_cancel: Optional[threading.Event] = None
+        self._render_thread: Optional[threading.Thread] = None
+        self._render_results: "queue.Queue" = queue.Queue()
+        self._render_poll: Optional[str] = None    # pending after() id; one poll chain at a time
         self.zoom = 1.0
         self.pan_x = 0
         self.pan_y = 0
@@ -471,6 +418,7 @@ class MapViewerApp(tk.Tk):
         ttk.Checkbutton(toolbar, text="Use NONFIXED.DAT", variable=self.use_nonfixed, command=self.render_map).pack(side=tk.LEFT, padx=8)
         ttk.Checkbutton(toolbar, text="Apply -576 glob Y-bias (old docs hack)", variable=self.glob_y_bias_toggle, command=self.render_map).pack(side=tk.LEFT, padx=8)
         ttk.Checkbutton(toolbar, text="Cull offscreen before render", variable=self.cull_toggle, command=self.render_map).pack(side=tk.LEFT, padx=8)
+        ttk.Checkbutton(toolbar, text="Editor items", variable=self.editor_toggle, command=self.render_map).pack(side=tk.LEFT, padx=8)
 
         ttk.Button(toolbar, text="Render", command=self.render_map).pack(side=tk.LEFT, padx=10)
         ttk.Button(toolbar, text="Reset View (R)", command=self.reset_view).pack(side=tk.LEFT)
@@ -502,7 +450,12 @@ class MapViewerApp(tk.Tk):
             self.palette = pal
             self.shapes = ShapeArchive(static / "U8SHAPES.FLX", pal)
             self.fixed = FlexArchive(static / "FIXED.DAT")
-            self.glob = GlobArchive(static / "GLOB.FLX")
+            self.glob = GlobTable.load(static / "GLOB.FLX")
+            # optional: footprints for the ItemSorter paint order
+            if (static / "TYPEFLAG.DAT").exists():
+                self.typeflags = TypeFlags.load(static / "TYPEFLAG.DAT")
+            else:
+                self.typeflags = None
             if (gamedat / "NONFIXED.DAT").exists():
                 self.nonfixed = FlexArchive(gamedat / "NONFIXED.DAT")
             else:
@@ -536,41 +489,116 @@ class MapViewerApp(tk.Tk):
             bottom = int((h - self.pan_y) / self.zoom) + 128
             cull_box = (left, top, right, bottom)
 
+        # Tk variables are read here; the worker only gets plain values
+        args = dict(
+            fixed_flex=self.fixed,
+            nonfixed_flex=self.nonfixed if use_nonfixed else None,
+            map_idx=self.map_idx,
+            shapes=self.shapes,
+            globs=self.glob,
+            glob_y_bias_minus_576=self.glob_y_bias_toggle.get(),
+            cull_margin=cull_box,
+            # one sorter per request (workers never share one); only the
+            # full pass sorts, the preview uses the quick key
+            sorter=ItemSorter(self.typeflags) if self.typeflags is not None else None,
+            hide_editor=None if self.editor_toggle.get() else self.typeflags,
+        )
+        if self._render_cancel is not None:
+            self._render_cancel.set()       # the old worker stops at its next check
+        self._render_gen += 1
+        self._render_cancel = threading.Event()
+        self._render_thread = threading.Thread(
+            target=self._render_worker, args=(self._render_gen, self._render_cancel, args), daemon=True)
+        self._render_thread.start()
+        self.status.config(text=f"Rendering map {self.map_idx}…")
+        if self._render_poll is None:
+            self._render_poll = self.after(RENDER_POLL_MS, self._poll_renders)
+
+    def _render_worker(self, gen: int, cancel: threading.Event, args: dict):
+        # Worker thread: a quick reduced preview (no ItemSorter graph,
+        # frame decoding capped at PREVIEW_DECODE_SECONDS), then full
+        # detail. Never touches Tk; everything goes through the results queue.
+        preview = dict(args, sorter=None, decode_budget=PREVIEW_DECODE_SECONDS)
         try:
-            img = render_map_to_image(
-                fixed_flex=self.fixed,
-                nonfixed_flex=self.nonfixed if use_nonfixed else None,
-                map_idx=self.map_idx,
-                shapes=self.shapes,
-                globs=self.glob,
-                glob_y_bias_minus_576=self.glob_y_bias_toggle.get(),
-                cull_margin=cull_box,
-            )
+            for reduce, pass_args in ((PREVIEW_REDUCE, preview), (1, args)):
+                img = render_map_to_image(reduce=reduce, cancel=cancel, **pass_args)
+                self._render_results.put((gen, reduce, img, None))
+        except RenderCancelled:
+            pass
         except Exception as e:
-            messagebox.showerror("Render error", f"{e}")
-            return
+            self._render_results.put((gen, None, None, e))
+
+    def _poll_renders(self):
+        # UI thread: show finished images of the newest request only.
+        # Liveness is sampled first so a result queued just before the
+        # worker exits is still drained below.
+        self._render_poll = None
+        alive = self._render_thread is not None and self._render_thread.is_alive()
+        while True:
+            try:
+                gen, reduce, img, err = self._render_results.get_nowait()
+            except queue.Empty:
+                break
+            if gen != self._render_gen:
+                continue
+            if err is not None:
+                messagebox.showerror("Render error", f"{err}")
+            else:
+                self._show_render(img, reduce)
+        if alive and self._render_poll is None:     # render_map may have restarted it meanwhile
+            self._render_poll = self.after(RENDER_POLL_MS, self._poll_renders)
 
+    def _show_render(self, img: Image.Image, reduce: int):
+        new_map = reduce > 1 or self.base_reduce == 1
         self.base_image = img
-        self.zoom = 1.0
-        self.pan_x = self.pan_y = 0
+        self.base_reduce = reduce
+        self.tiles.clear()
+        if new_map:
+            # a new map starts at 1:1; the full pass keeps the user's view
+            self.zoom = 1.0
+            self.pan_x = self.pan_y = 0
         self.update_canvas_image()
-        self.status.config(text=f"Rendered map {self.map_idx} — {img.width}×{img.height}px")
+        if reduce > 1:
+            self.status.config(text=f"Map {self.map_idx} preview (1/{reduce}) — rendering full detail…")
+        else:
+            self.status.config(text=f"Rendered map {self.map_idx} — {img.width}×{img.height}px — "
+                                    f"frame cache: {self.shapes.cache.summary()}")
+
+    def _zoomed_size(self) -> Tuple[int, int]:
+        z = self.zoom * self.base_reduce
+        return (max(1, int(self.base_image.width * z)),
+                max(1, int(self.base_image.height * z)))
+
+    def _render_tile(self, zoom: float, tx: int, ty: int) -> ImageTk.PhotoImage:
+        # one tile of the base image scaled to zoom; the box maps it onto the
+        # same source pixels as resizing the whole image would
+        img = self.base_image
+        w, h = self._zoomed_size()
+        t = self.tiles.tile_size
+        x0, y0 = tx * t, ty * t
+        x1, y1 = min(x0 + t, w), min(y0 + t, h)
+        if (w, h) == img.size:
+            tile = img.crop((x0, y0, x1, y1))
+        else:
+            sx, sy = w / img.width, h / img.height
+            tile = img.resize((x1 - x0, y1 - y0), resample=Image.NEAREST,
+                              box=(x0 / sx, y0 / sy, x1 / sx, y1 / sy))
+        return ImageTk.PhotoImage(tile)
 
     def update_canvas_image(self):
         if not self.base_image:
             return
-        # scale via PIL
-        if self.zoom != 1.0:
-            w = max(1, int(self.base_image.width * self.zoom))
-            h = max(1, int(self.base_image.height * self.zoom))
-            disp = self.base_image.resize((w, h), resample=Image.NEAREST)
-        else:
-            disp = self.base_image
-
-        self.display_image = ImageTk.PhotoImage(disp)
+        # only the tiles under the canvas, each scaled once per zoom level
+        w, h = self._zoomed_size()
+        cw = max(1, self.canvas.winfo_width())
+        ch = max(1, self.canvas.winfo_height())
+        px, py = math.floor(self.pan_x), math.floor(self.pan_y)
+        ready, _ = self.tiles.update(self.zoom, -px, -py, cw, ch, extent=(0, 0, w, h))
         self.canvas.delete("all")
+        t = self.tiles.tile_size
         # draw anchored at (pan_x, pan_y)
-        self.canvas.create_image(self.pan_x, self.pan_y, anchor='nw', image=self.display_image)
+        for tx, ty, photo in ready:
+            self.canvas.create_image(px + tx * t, py + ty * t, anchor='nw', image=photo)
 
     # -------- Controls --------
 
@@ -647,6 +675,9 @@ class MapViewerApp(tk.Tk):
         if not self.base_image:
             messagebox.showinfo("Export", "Render a map first.")
             return
+        if self.base_reduce > 1:
+            messagebox.showinfo("Export", "Still rendering full detail; try again in a moment.")
+            return
         fn = filedialog.asksaveasfilename(
             defaultextension=".png",
             filetypes=[("PNG", "*.png")],
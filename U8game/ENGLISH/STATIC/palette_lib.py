@@ -0,0 +1,262 @@
+# palette_lib.py
+# U8 palettes as lookup tables.
+# - Palette: U8PAL.PAL as a 256x4 uint8 RGBA LUT. Index arrays (shape_lib
+#   decode output) become RGBA arrays, pygame Surfaces or PIL Images with
+#   one fancy-index, so cached index frames can be re-colored by swapping
+#   the Palette instead of decoding again.
+# - Palette.quantize: RGB(A) images back to indices through a cached
+#   nearest-color cube (64^3 by default), with optional ordered or
+#   Floyd-Steinberg dithering.
+# - load_xform_tables: the index remap tables in XFORMPAL.DAT.
+#
+# Requirements: numpy (pygame for to_surface, Pillow for to_image)
+
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from flx_lib import FlxIndex
+from shape_lib import TRANSPARENT_INDEX
+
+DITHER_MODES = ("none", "ordered", "floyd-steinberg")
+LUT_BITS = 6                # bits per channel of the nearest-color cube
+ORDERED_SPREAD = 32.0       # peak-to-peak RGB offset of the ordered dither
+
+
+# ---------- Palette ----------
+
+class Palette:
+    """
+    256 colors plus an RGBA lookup table.
+
+    lut[i] is (r, g, b, 255), except lut[transparent] which has alpha 0.
+    Indexing (pal[i]) returns an (r, g, b) tuple so a Palette can stand in
+    for the tools' older list-of-tuples palettes.
+    """
+
+    def __init__(self, rgb, transparent=TRANSPARENT_INDEX):
+        """
+        Args:
+            rgb: 256 (r, g, b) entries, 0..255 (anything np.asarray takes).
+            transparent: Index rendered with alpha 0, or None for none.
+        """
+        self.rgb = np.array(rgb, dtype=np.uint8).reshape(256, 3)
+        self.transparent = transparent
+        self.lut = np.empty((256, 4), dtype=np.uint8)
+        self.lut[:, :3] = self.rgb
+        self.lut[:, 3] = 255
+        if transparent is not None:
+            self.lut[transparent, 3] = 0
+        self._colors = [tuple(c) for c in self.rgb.tolist()]
+
+    @classmethod
+    def load(cls, path, transparent=TRANSPARENT_INDEX) -> "Palette":
+        """
+        Reads a U8 .PAL file: 4 unknown bytes, then 256 VGA (0..63) triplets.
+
+        Raises:
+            ValueError: If the file is too short.
+        """
+        with open(path, "rb") as f:
+            raw = f.read(4 + 256 * 3)
+        if len(raw) < 4 + 256 * 3:
+            raise ValueError(f"{os.path.basename(os.fspath(path))} too small or wrong file.")
+        vga = np.frombuffer(raw, dtype=np.uint8, offset=4).astype(np.uint16)
+        return cls(np.minimum(vga * 4, 255), transparent)
+
+    # -- list-of-tuples compatibility --
+
+    def __len__(self) -> int:
+        return 256
+
+    def __getitem__(self, index: int):
+        return self._colors[index]
+
+    def __iter__(self):
+        return iter(self._colors)
+
+    def colors(self):
+        """The 256 colors as (r, g, b) tuples (e.g. for Surface.set_palette)."""
+        return list(self._colors)
+
+    # -- swapping --
+
+    def remapped(self, table) -> "Palette":
+        """
+        A palette where index i shows the color of table[i] (XFORMPAL-style
+        remap). The transparent index stays transparent.
+        """
+        table = np.asarray(table, dtype=np.uint8).reshape(256)
+        return Palette(self.rgb[table], self.transparent)
+
+    # -- rendering --
+
+    def to_rgba(self, indices) -> np.ndarray:
+        """(h, w) uint8 indices -> (h, w, 4) uint8 RGBA."""
+        return self.lut[np.asarray(indices, dtype=np.uint8)]
+
+    def to_surface(self, indices, scale: float = 1.0):
+        """(h, w) indices -> 32-bit SRCALPHA pygame Surface, optionally scaled."""
+        import pygame
+        rgba = self.to_rgba(indices)
+        h, w = rgba.shape[:2]
+        if not (w and h):
+            return pygame.Surface((max(1, w), max(1, h)), pygame.SRCALPHA, 32)
+        surf = pygame.image.frombuffer(rgba.tobytes(), (w, h), "RGBA")
+        if scale != 1.0:
+            surf = pygame.transform.scale(surf, (max(1, int(w * scale)), max(1, int(h * scale))))
+        return surf
+
+    def to_image(self, indices):
+        """(h, w) indices -> PIL RGBA Image."""
+        from PIL import Image
+        rgba = self.to_rgba(indices)
+        h, w = rgba.shape[:2]
+        if not (w and h):
+            return Image.new("RGBA", (max(1, w), max(1, h)))
+        return Image.fromarray(rgba)
+
+    # -- quantizing --
+
+    def nearest_lut(self, bits: int = LUT_BITS) -> np.ndarray:
+        """
+        (2^bits)^3 uint8 cube of nearest palette indices, looked up with
+        rgb >> (8 - bits). Built once per palette and cached.
+        """
+        return _nearest_lut(self.rgb.tobytes(), self.transparent, bits)
+
+    def quantize(self, rgba, dither=None, alpha_threshold: int = 128, bits: int = LUT_BITS) -> np.ndarray:
+        """
+        Maps an image to palette indices in one lookup.
+
+        Args:
+            rgba: (h, w, 4) or (h, w, 3) uint8 array (e.g. np.asarray of a
+                PIL RGBA image).
+            dither: None / "none", "ordered" (8x8 Bayer) or "floyd-steinberg".
+            alpha_threshold (int): Pixels with alpha below this become the
+                transparent index. Opaque pixels never map to it.
+            bits (int): Bits per channel of the lookup cube (5..8).
+
+        Returns:
+            np.ndarray: (h, w) uint8 indices.
+
+        Raises:
+            ValueError: On a bad array shape or an unknown dither mode.
+        """
+        a = np.asarray(rgba)
+        if a.ndim != 3 or a.shape[2] not in (3, 4):
+            raise ValueError(f"Expected an (h, w, 3|4) image, got shape {a.shape}")
+        dither = dither or "none"
+        if dither not in DITHER_MODES:
+            raise ValueError(f"Unknown dither {dither!r}; expected one of {DITHER_MODES}")
+        lut = self.nearest_lut(bits)
+        shift = 8 - bits
+        rgb = a[..., :3]
+        clear = None
+        if a.shape[2] == 4 and self.transparent is not None:
+            clear = a[..., 3] < alpha_threshold
+        if dither == "ordered":
+            h, w = rgb.shape[:2]
+            offset = np.tile(_BAYER8, (-(-h // 8), -(-w // 8)))[:h, :w, None] * ORDERED_SPREAD
+            rgb = np.clip(rgb + offset, 0, 255).astype(np.uint8)
+        if dither == "floyd-steinberg":
+            out = _floyd_steinberg(rgb, lut, shift, self.rgb, clear)
+        else:
+            rgb = rgb.astype(np.uint8, copy=False) >> shift
+            out = lut[rgb[..., 0], rgb[..., 1], rgb[..., 2]]
+        if clear is not None:
+            out[clear] = self.transparent
+        return out
+
+
+# ---------- Quantizing ----------
+
+# 8x8 Bayer matrix as offsets in (-0.5, 0.5)
+_BAYER8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42], [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38], [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41], [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37], [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32) / 64 - 0.5 + 1 / 128
+
+
+@lru_cache(maxsize=8)
+def _nearest_lut(rgb: bytes, transparent, bits: int) -> np.ndarray:
+    """Nearest index (squared RGB distance, lowest index on ties) for each cube cell center."""
+    if not 5 <= bits <= 8:
+        raise ValueError("bits must be 5..8")
+    colors = np.frombuffer(rgb, dtype=np.uint8).reshape(256, 3).astype(np.float64)
+    candidates = np.array([i for i in range(256) if i != transparent])
+    pal = colors[candidates]
+    # |c - p|^2 = |c|^2 - 2 c.p + |p|^2; |c|^2 does not change the argmin
+    pal_t = -2.0 * pal.T
+    pal_sq = (pal * pal).sum(axis=1)
+    n = 1 << bits
+    step = 1 << (8 - bits)
+    centers = np.arange(n) * step + (step - 1) / 2
+    gb = np.stack(np.meshgrid(centers, centers, indexing="ij"), axis=-1).reshape(-1, 2)
+    cells = np.empty((n * n, 3))
+    cells[:, 1:] = gb
+    lut = np.empty((n, n * n), dtype=np.uint8)
+    for r in range(n):      # one red slab at a time keeps the distance matrix small
+        cells[:, 0] = centers[r]
+        lut[r] = candidates[np.argmin(cells @ pal_t + pal_sq, axis=1)]
+    return lut.reshape(n, n, n)
+
+
+def _floyd_steinberg(rgb: np.ndarray, lut: np.ndarray, shift: int, colors: np.ndarray,
+                     clear=None) -> np.ndarray:
+    """
+    Floyd-Steinberg error diffusion over anti-diagonal wavefronts: pixel
+    (y, x) only depends on pixels with a smaller x + 2y, so every pixel of
+    one wavefront is quantized in a single array step. Pixels set in the
+    clear mask pass no error on.
+    """
+    h, w = rgb.shape[:2]
+    out = np.empty((h, w), dtype=np.uint8)
+    if not (h and w):
+        return out
+    buf = np.zeros((h + 1, w + 2, 3), dtype=np.float32)     # 1px border right, left, below
+    buf[:h, 1:w + 1] = rgb
+    pal = colors.astype(np.float32)
+    for t in range(w + 2 * (h - 1)):
+        ys = np.arange(max(0, -(-(t - w + 1) // 2)), min(h - 1, t // 2) + 1)
+        xs = t - 2 * ys
+        bx = xs + 1
+        v = np.clip(buf[ys, bx], 0, 255)
+        q = v.astype(np.uint8) >> shift
+        idx = lut[q[:, 0], q[:, 1], q[:, 2]]
+        out[ys, xs] = idx
+        e = v - pal[idx]
+        if clear is not None:
+            e[clear[ys, xs]] = 0
+        buf[ys, bx + 1] += e * (7 / 16)
+        buf[ys + 1, bx - 1] += e * (3 / 16)
+        buf[ys + 1, bx] += e * (5 / 16)
+        buf[ys + 1, bx + 1] += e * (1 / 16)
+    return out
+
+
+# ---------- XFORMPAL.DAT ----------
+
+def load_xform_tables(path) -> np.ndarray:
+    """
+    Reads the index remap tables from XFORMPAL.DAT (record 0 of the FLX,
+    256 bytes per table).
+
+    Returns:
+        np.ndarray: (n, 256) uint8; feed a row to Palette.remapped.
+
+    Raises:
+        ValueError: If record 0 is missing or not a multiple of 256 bytes.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    index = FlxIndex.from_buffer(data)
+    if index.count < 1:
+        raise ValueError("XFORMPAL.DAT has no records")
+    off, size = index[0]
+    if size == 0 or size % 256:
+        raise ValueError(f"Unexpected XFORMPAL record size {size}")
+    return np.frombuffer(data, dtype=np.uint8, count=size, offset=off).reshape(-1, 256).copy()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# render_maps.py
+# Headless batch renderer: U8 maps to one image each, no Tk or pygame.
+# - Objects come from FIXED.DAT plus NONFIXED.DAT, read from GAMEDAT or from
+#   a saved game (SAVEGAME/U8SAVE.000), with globs expanded.
+# - Paint order is sort_lib's ItemSorter port when TYPEFLAG.DAT is present,
+#   otherwise the viewers' quick (x+y, z, x) key.
+# - Maps are spread over a process pool; each worker opens the archives and
+#   loads the shape index (shape_lib sidecar) once, then renders its maps.
+#   The frames a map needs are decoded in one batch (ShapeFile.decode_many)
+#   into a bounded cache shared by the worker's maps.
+# - Per-map object counts, image size and timings go to a JSON report.
+#
+# Usage:
+#   python render_maps.py --out renders                         (all maps)
+#   python render_maps.py --out renders --maps 3 5 --save ../SAVEGAME/U8SAVE.000
+#   python render_maps.py --out renders --no-nonfixed --reduce 2 --workers 4
+#
+# Requirements: numpy, Pillow
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from cache_lib import FrameCache
+from map_lib import NUM_MAPS, GlobTable, MapFile, ScreenIndex, map_items, open_nonfixed
+from palette_lib import Palette
+from shape_lib import ShapeFile
+from sort_lib import sorted_order
+from typeflag_lib import SI_EDITOR, TypeFlags
+
+FORMATS = ("png", "webp")
+REQUIRED_FILES = ("U8SHAPES.FLX", "U8PAL.PAL", "FIXED.DAT")
+REPORT_NAME = "report.json"
+FRAME_CACHE_BYTES = 64 * 1024 * 1024
+
+
+@dataclass
+class MapRender:
+    map: int
+    path: Optional[str] = None
+    fixed: int = 0            # objects in FIXED.DAT
+    nonfixed: int = 0         # objects in NONFIXED.DAT
+    items: int = 0            # after glob expansion (and editor filtering)
+    drawn: int = 0            # items with a frame to draw
+    width: int = 0
+    height: int = 0
+    order: str = ""           # "itemsorter" or "quick"
+    timings: dict = field(default_factory=dict)   # seconds per stage
+    error: Optional[str] = None
+
+
+# ---------- Worker ----------
+
+class _Worker:
+    """Per-process archives, shape index, palette and frame cache."""
+
+    def __init__(self, static: str, nonfixed: Optional[str], glob_bias: bool,
+                 sort: bool, hide_editor: bool):
+        self.shapes = ShapeFile(os.path.join(static, "U8SHAPES.FLX"))
+        self.palette = Palette.load(os.path.join(static, "U8PAL.PAL"))
+        self.fixed = MapFile(os.path.join(static, "FIXED.DAT"))
+        self.nonfixed = open_nonfixed(nonfixed) if nonfixed else None
+        glob_path = os.path.join(static, "GLOB.FLX")
+        self.globs = GlobTable.load(glob_path) if os.path.exists(glob_path) else None
+        self.y_bias = -576 if glob_bias else 0
+        tf_path = os.path.join(static, "TYPEFLAG.DAT")
+        self.typeflags = TypeFlags.load(tf_path) if os.path.exists(tf_path) else None
+        self.sort = sort and self.typeflags is not None
+        self.hide_editor = hide_editor and self.typeflags is not None
+        self.frames = FrameCache(FRAME_CACHE_BYTES)
+
+    def close(self):
+        self.shapes.close()
+        self.fixed.close()
+        if self.nonfixed:
+            self.nonfixed.close()
+
+    def _image(self, pixels: np.ndarray, reduce: int) -> Optional[Image.Image]:
+        if not pixels.size:
+            return None
+        img = self.palette.to_image(pixels)
+        return img.reduce(reduce) if reduce > 1 else img
+
+    def frame_image(self, shape: int, frame: int, reduce: int) -> Optional[Image.Image]:
+        def load():
+            try:
+                pixels = self.shapes.decode(shape, frame).pixels
+            except (IndexError, ValueError):
+                return None
+            return self._image(pixels, reduce)
+        return self.frames.get_or_load((shape, frame, reduce), load)
+
+    def prefetch(self, shapes, frames, reduce: int):
+        """Decodes the valid frames not cached yet in one batch (ShapeFile.decode_many)."""
+        counts = self.shapes.index.frame_counts
+        keys = sorted({(s, f) for s, f in zip(shapes, frames)
+                       if 0 <= s < len(counts) and 0 <= f < counts[s] and (s, f, reduce) not in self.frames})
+        if not keys:
+            return
+        decoded = self.shapes.decode_many(keys)
+        for k, (s, f) in enumerate(keys):
+            try:
+                img = self._image(decoded[k].pixels, reduce)
+            except ValueError:
+                img = None
+            self.frames.put((s, f, reduce), img)
+
+    def render(self, idx: int, out: str, fmt: str, reduce: int) -> MapRender:
+        rep = MapRender(idx, order="itemsorter" if self.sort else "quick")
+        t = rep.timings
+        start = time.perf_counter()
+        for name, f in (("fixed", self.fixed), ("nonfixed", self.nonfixed)):
+            if f is not None and idx < len(f):
+                setattr(rep, name, len(f.objects(idx)))
+        items = map_items(idx, self.fixed, self.nonfixed, self.globs, self.y_bias)
+        if self.hide_editor:
+            items = items[~self.typeflags.has(items["shape"], SI_EDITOR)]
+        rep.items = len(items)
+        t["load"] = time.perf_counter() - start
+
+        mark = time.perf_counter()
+        if self.sort:
+            scene = ScreenIndex(items, self.shapes.index, clamp_frames=False,
+                                order=lambda it: sorted_order(it, self.typeflags))
+        else:
+            scene = ScreenIndex(items, self.shapes.index, clamp_frames=False)
+        t["sort"] = time.perf_counter() - mark
+        rep.drawn = len(scene)
+        bounds = scene.bounds()
+        if bounds is None:
+            t["total"] = time.perf_counter() - start
+            return rep
+
+        mark = time.perf_counter()
+        minx, miny, maxx, maxy = bounds
+        w, h = -(-(maxx - minx) // reduce), -(-(maxy - miny) // reduce)
+        img = Image.new("RGBA", (max(1, w), max(1, h)))
+        shapes, frames = scene.items["shape"].tolist(), scene.items["frame"].tolist()
+        self.prefetch(shapes, frames, reduce)
+        for (x0, y0, _, _), shape, frame in zip(scene.boxes.tolist(), shapes, frames):
+            fr = self.frame_image(shape, frame, reduce)
+            if fr is not None:
+                img.alpha_composite(fr, dest=((x0 - minx) // reduce, (y0 - miny) // reduce))
+        rep.width, rep.height = img.size
+        t["render"] = time.perf_counter() - mark
+
+        mark = time.perf_counter()
+        rep.path = os.path.join(out, f"map_{idx:03d}.{fmt}")
+        tmp = rep.path + ".tmp"
+        img.save(tmp, format=fmt.upper())
+        os.replace(tmp, rep.path)
+        t["save"] = time.perf_counter() - mark
+        t["total"] = time.perf_counter() - start
+        return rep
+
+
+def check_inputs(static: str, nonfixed: Optional[str] = None):
+    """Raises FileNotFoundError here rather than in every pool worker's initializer."""
+    for path in [os.path.join(static, name) for name in REQUIRED_FILES] + ([nonfixed] if nonfixed else []):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} not found")
+
+
+_worker: Optional[_Worker] = None
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _Worker(*args)
+
+
+def _render_map(idx: int, out: str, fmt: str, reduce: int) -> MapRender:
+    try:
+        return _worker.render(idx, out, fmt, reduce)
+    except Exception as e:      # one bad map must not sink the batch
+        return MapRender(idx, error=f"{type(e).__name__}: {e}")
+
+
+def render_maps(static, out, maps=None, fmt: str = "png", nonfixed=None, glob_bias: bool = False,
+                sort: bool = True, hide_editor: bool = False, reduce: int = 1,
+                workers: Optional[int] = None) -> List[MapRender]:
+    """
+    Renders maps to <out>/map_NNN.<fmt>.
+
+    Args:
+        static: STATIC directory (U8SHAPES.FLX, U8PAL.PAL, FIXED.DAT, ...).
+        out: Output directory (created).
+        maps: Map numbers; None renders every map with objects.
+        fmt (str): "png" or "webp".
+        nonfixed: NONFIXED.DAT or saved game to overlay, or None.
+        glob_bias (bool): Apply the old -576 glob Y bias.
+        sort (bool): Use the ItemSorter order when TYPEFLAG.DAT is present.
+        hide_editor (bool): Drop EDITOR shapes (eggs, markers).
+        reduce (int): Render at 1/reduce size.
+        workers (int): Processes; defaults to os.cpu_count(). 1 runs here.
+
+    Returns:
+        list: One MapRender per map, in map order.
+
+    Raises:
+        ValueError: On an unknown format or a bad reduce factor.
+        FileNotFoundError: If an input archive is missing.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}")
+    if reduce < 1:
+        raise ValueError("reduce must be >= 1")
+    static = os.fspath(static)
+    nonfixed = os.fspath(nonfixed) if nonfixed else None
+    check_inputs(static, nonfixed)
+    if maps is None:
+        sources = [MapFile(os.path.join(static, "FIXED.DAT"))]
+        if nonfixed:
+            sources.append(open_nonfixed(nonfixed))
+        try:
+            maps = [i for i in range(NUM_MAPS)
+                    if any(i < len(f) and len(f.objects(i)) for f in sources)]
+        finally:
+            for f in sources:
+                f.close()
+    os.makedirs(out, exist_ok=True)
+    workers = min(workers or os.cpu_count() or 1, max(1, len(maps)))
+    init = (static, nonfixed, glob_bias, sort, hide_editor)
+    n = len(maps)
+    if workers == 1:
+        _init_worker(*init)
+        try:
+            return [_render_map(m, out, fmt, reduce) for m in maps]
+        finally:
+            _worker.close()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init) as pool:
+        return list(pool.map(_render_map, maps, [out] * n, [fmt] * n, [reduce] * n))
+
+
+def write_report(path: str, renders: List[MapRender], settings: dict, seconds: float):
+    """JSON report: settings, per-map entries and totals (written atomically)."""
+    report = {
+        "settings": settings,
+        "seconds": round(seconds, 3),
+        "totals": {
+            "maps": len(renders),
+            "failed": sum(1 for r in renders if r.error),
+            "items": sum(r.items for r in renders),
+            "drawn": sum(r.drawn for r in renders),
+        },
+        "maps": [asdict(r) for r in renders],
+    }
+    for r in report["maps"]:
+        r["timings"] = {k: round(v, 4) for k, v in r["timings"].items()}
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp, path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Render U8 maps to images without a window.")
+    ap.add_argument("--static", default=".", help="STATIC directory (default: current)")
+    ap.add_argument("--out", required=True, help="output directory")
+    ap.add_argument("--maps", type=int, nargs="*", help="map numbers (default: all non-empty)")
+    ap.add_argument("--format", choices=FORMATS, default="png")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--nonfixed", help="NONFIXED.DAT to overlay (default: ../GAMEDAT/NONFIXED.DAT if present)")
+    src.add_argument("--save", help="saved game (e.g. SAVEGAME/U8SAVE.000) whose NONFIXED.DAT to overlay")
+    src.add_argument("--no-nonfixed", action="store_true")
+    ap.add_argument("--glob-bias", action="store_true", help="apply the old -576 glob Y bias")
+    ap.add_argument("--quick-order", action="store_true", help="paint in (x+y, z, x) order, skip ItemSorter")
+    ap.add_argument("--hide-editor", action="store_true", help="leave out editor shapes (eggs, markers)")
+    ap.add_argument("--reduce", type=int, default=1, help="render at 1/N size")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--report", help=f"JSON report path (default: <out>/{REPORT_NAME})")
+    a = ap.parse_args()
+
+    nonfixed = a.save or a.nonfixed
+    if nonfixed is None and not a.no_nonfixed:
+        guess = os.path.join(os.path.dirname(os.path.abspath(a.static)), "GAMEDAT", "NONFIXED.DAT")
+        nonfixed = guess if os.path.exists(guess) else None
+
+    start = time.perf_counter()
+    try:
+        renders = render_maps(a.static, a.out, a.maps, a.format, nonfixed, a.glob_bias,
+                              not a.quick_order, a.hide_editor, a.reduce, a.workers)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    except BrokenProcessPool as e:
+        print(f"Error: a render worker failed to start ({e})")
+        sys.exit(1)
+    seconds = time.perf_counter() - start
+    settings = {"static": os.path.abspath(a.static), "nonfixed": nonfixed, "format": a.format,
+                "glob_bias": a.glob_bias, "quick_order": a.quick_order,
+                "hide_editor": a.hide_editor, "reduce": a.reduce}
+    report = a.report or os.path.join(a.out, REPORT_NAME)
+    write_report(report, renders, settings, seconds)
+    for r in renders:
+        if r.error:
+            print(f"map {r.map:3d}: FAILED {r.error}")
+        else:
+            print(f"map {r.map:3d}: {r.items} items, {r.drawn} drawn, {r.width}x{r.height} "
+                  f"({r.timings.get('total', 0):.2f}s)")
+    failed = sum(1 for r in renders if r.error)
+    print(f"{len(renders)} maps in {seconds:.2f}s ({failed} failed); report: {report}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,976 @@
+# shape_lib.py
+# Shared helpers for U8 shape archives (U8SHAPES.FLX, U8GUMPS.FLX, ...).
+# - ShapeIndex: every frame's offset/size/dims/hotspot/compression in packed
+#   columns, persisted in a binary sidecar next to the archive so viewers
+#   do not walk all 2048 shapes on every start.
+# - decode_frames / decode_frame: the RLE frame decoder, producing uint8
+#   (h, w) arrays of palette indices. All lines of a batch of frames are
+#   walked in lockstep with NumPy; bulk users (atlas, archive export, map
+#   renderers, a shape's frames in the editors) decode in batches, while
+#   decode_frame copies runs as slices, the fast path for a single frame.
+# - encode_frame / encode_lines: the matching compression 1 encoder, with
+#   vectorized run detection and a per-row dynamic program picking the
+#   smallest mix of skips, repeats and literals.
+# - sheet_frame_rects: frame rectangles on an import sheet, found from the
+#   alpha mask projections (shared by shapelab and import_shapes).
+# - ShapeFile: read-only mmap of an archive + its ShapeIndex.
+# - build_shape_record / patch_type_in_file: rebuild one shape record with
+#   replaced frames and save it through flx_lib.FlxPatcher (shared by
+#   shapelab and shapemod).
+#
+# Usage (encoder benchmark against the shipped frames):
+#   python shape_lib.py [--flx U8SHAPES.FLX] [--shapes 0 100] [--limit 2000]
+#
+# Requirements: numpy
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import deque, namedtuple
+from hashlib import blake2b
+
+import numpy as np
+
+from flx_lib import FlxIndex, FlxPatcher
+
+
+# ---------- Frame index ----------
+
+FrameInfo = namedtuple("FrameInfo", "offset size width height xoff yoff compression unknown")
+
+# Column name -> array typecode, in sidecar order (one entry per frame).
+_COLUMNS = (
+    ("offset", "I"),        # absolute file offset of the frame header
+    ("size", "I"),          # size from the shape's frame table
+    ("width", "H"),
+    ("height", "H"),
+    ("xoff", "h"),
+    ("yoff", "h"),
+    ("compression", "H"),
+    ("unknown", "B"),       # byte after the u24 offset in the frame table
+)
+
+_FRAME_ENTRY = struct.Struct("<HBBH")   # u24 rel offset (lo16, hi8), unknown, u16 size
+_FRAME_HEADER = struct.Struct("<HHHhh")  # at +8: compression, width, height, xoff, yoff
+
+SIDECAR_SUFFIX = ".frameidx"
+SIDECAR_MAGIC = b"U8FI"
+SIDECAR_VERSION = 1
+# magic, version, reserved, flx size, flx mtime_ns, blake2b-128 of the flx,
+# number of shapes, number of frames
+_SIDECAR_HEADER = struct.Struct("<4sHHQq16sII")
+
+
+class ShapeIndex:
+    """
+    Frame table for every shape of a U8 shape archive.
+
+    Frames are stored flat; the frames of shape s are the entries
+    first[s]:first[s+1] of each column in _COLUMNS.
+    """
+
+    def __init__(self, first: array, columns: dict):
+        self.first = first
+        self.num_shapes = len(first) - 1
+        self.num_frames = first[-1] if len(first) else 0
+        for name, _ in _COLUMNS:
+            setattr(self, name, columns[name])
+        self.frame_counts = array("I", (first[i + 1] - first[i] for i in range(self.num_shapes)))
+
+    # -- queries --
+
+    def frame_count(self, shape: int) -> int:
+        if not (0 <= shape < self.num_shapes):
+            raise IndexError("Invalid shape index")
+        return self.frame_counts[shape]
+
+    def frame_slot(self, shape: int, frame: int) -> int:
+        """Position of (shape, frame) in the flat columns."""
+        if not (0 <= frame < self.frame_count(shape)):
+            raise IndexError("Invalid frame index")
+        return self.first[shape] + frame
+
+    def frame(self, shape: int, frame: int) -> FrameInfo:
+        i = self.frame_slot(shape, frame)
+        return FrameInfo(self.offset[i], self.size[i], self.width[i], self.height[i],
+                         self.xoff[i], self.yoff[i], self.compression[i], self.unknown[i])
+
+    def frames(self, shape: int):
+        return [self.frame(shape, f) for f in range(self.frame_count(shape))]
+
+    # -- building --
+
+    @classmethod
+    def build(cls, buf, records: FlxIndex = None) -> "ShapeIndex":
+        """
+        Walks every shape record of an archive and collects its frames.
+
+        Args:
+            buf: The whole archive (bytes, bytearray or mmap).
+            records: Its FlxIndex; parsed from buf when omitted.
+
+        Returns:
+            ShapeIndex: The index.
+        """
+        if records is None:
+            records = FlxIndex.from_buffer(buf)
+        columns = {name: array(code) for name, code in _COLUMNS}
+        c_off, c_size, c_w, c_h = columns["offset"], columns["size"], columns["width"], columns["height"]
+        c_xo, c_yo, c_comp, c_unk = columns["xoff"], columns["yoff"], columns["compression"], columns["unknown"]
+        first = array("I", [0])
+        end = len(buf)
+        for rec_off, rec_size in records:
+            if rec_off and rec_size >= 6:
+                nframes = struct.unpack_from("<H", buf, rec_off + 4)[0]
+                nframes = min(nframes, (rec_size - 6) // 6)
+                for (lo, hi, unk, fsize) in _FRAME_ENTRY.iter_unpack(buf[rec_off + 6:rec_off + 6 + nframes * 6]):
+                    pos = rec_off + (lo | (hi << 16))
+                    if pos + 18 <= end:
+                        comp, w, h, xo, yo = _FRAME_HEADER.unpack_from(buf, pos + 8)
+                    else:
+                        comp = w = h = xo = yo = 0
+                    c_off.append(pos); c_size.append(fsize)
+                    c_w.append(w); c_h.append(h)
+                    c_xo.append(xo); c_yo.append(yo)
+                    c_comp.append(comp); c_unk.append(unk)
+            first.append(len(c_off))
+        return cls(first, columns)
+
+    # -- sidecar --
+
+    def to_bytes(self, flx_size: int, flx_mtime_ns: int, digest: bytes) -> bytes:
+        head = _SIDECAR_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, 0, flx_size, flx_mtime_ns,
+                                    digest, self.num_shapes, self.num_frames)
+        parts = [head]
+        for name, _ in [("first", "I")] + list(_COLUMNS):
+            col = getattr(self, name)
+            if sys.byteorder != "little" and col.itemsize > 1:
+                col = array(col.typecode, col)
+                col.byteswap()
+            parts.append(col.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        Parses a sidecar.
+
+        Returns:
+            tuple: (ShapeIndex, flx_size, flx_mtime_ns, digest), or None if the
+            data is not a sidecar of the current version.
+        """
+        if len(data) < _SIDECAR_HEADER.size:
+            return None
+        magic, version, _, size, mtime_ns, digest, nshapes, nframes = _SIDECAR_HEADER.unpack_from(data)
+        if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION:
+            return None
+        pos = _SIDECAR_HEADER.size
+        cols = {}
+        for name, code in [("first", "I")] + list(_COLUMNS):
+            col = array(code)
+            n = nshapes + 1 if name == "first" else nframes
+            nbytes = n * col.itemsize
+            if pos + nbytes > len(data):
+                return None
+            col.frombytes(data[pos:pos + nbytes])
+            if sys.byteorder != "little" and col.itemsize > 1:
+                col.byteswap()
+            cols[name] = col
+            pos += nbytes
+        first = cols.pop("first")
+        return cls(first, cols), size, mtime_ns, digest
+
+    @classmethod
+    def load(cls, flx_path, sidecar_path=None, use_sidecar: bool = True) -> "ShapeIndex":
+        """
+        Returns the frame index of an archive, using the sidecar when valid.
+
+        The sidecar is trusted when the archive's size and mtime match. If only
+        the mtime changed, the archive is hashed and the sidecar is reused
+        (and re-stamped) when the contents are identical. Otherwise the index
+        is rebuilt and the sidecar rewritten. Write failures (e.g. read-only
+        game folders) are ignored.
+
+        Args:
+            flx_path: The shape archive.
+            sidecar_path: Where to keep the cache; defaults to
+                flx_path + SIDECAR_SUFFIX.
+            use_sidecar (bool): False forces a rebuild and skips the cache.
+
+        Returns:
+            ShapeIndex: The index.
+        """
+        flx_path = os.fspath(flx_path)
+        if sidecar_path is None:
+            sidecar_path = flx_path + SIDECAR_SUFFIX
+        st = os.stat(flx_path)
+
+        cached = None
+        if use_sidecar:
+            try:
+                with open(sidecar_path, "rb") as f:
+                    cached = cls.from_bytes(f.read())
+            except OSError:
+                cached = None
+            if cached and cached[1] == st.st_size and cached[2] == st.st_mtime_ns:
+                return cached[0]
+
+        with open(flx_path, "rb") as f:
+            data = f.read()
+        digest = blake2b(data, digest_size=16).digest()
+        if cached and cached[1] == st.st_size and cached[3] == digest:
+            index = cached[0]
+        else:
+            index = cls.build(data)
+        if use_sidecar:
+            index.save(sidecar_path, st.st_size, st.st_mtime_ns, digest)
+        return index
+
+    def save(self, sidecar_path, flx_size: int, flx_mtime_ns: int, digest: bytes) -> bool:
+        """Writes the sidecar atomically; returns False if it could not be written."""
+        tmp = f"{sidecar_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(self.to_bytes(flx_size, flx_mtime_ns, digest))
+            os.replace(tmp, sidecar_path)
+            return True
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+
+
+# ---------- Frame decoding ----------
+
+TRANSPARENT_INDEX = 255   # pixels not covered by any run
+BATCH_MIN_FRAMES = 16     # fewer frames decode faster one by one (decode_frame)
+
+DecodedFrame = namedtuple("DecodedFrame", "pixels xoff yoff compression")
+
+_SINGLE = [bytes((i,)) for i in range(256)]
+
+
+class DecodedFrames:
+    """
+    Frames decoded together by decode_frames.
+
+    The indices of every frame sit back to back in one flat uint8 array:
+    frame k is pixels[start[k]:start[k] + width[k] * height[k]], row-major.
+    The other attributes are per-frame int64 columns; error marks frames
+    whose data ran past the end of the buffer. frames[k] is the k-th
+    DecodedFrame, its pixels a (height, width) view into the flat array.
+    """
+
+    def __init__(self, offset, pixels, start, width, height, xoff, yoff, compression, error):
+        self.offset = offset
+        self.pixels = pixels
+        self.start = start
+        self.width = width
+        self.height = height
+        self.xoff = xoff
+        self.yoff = yoff
+        self.compression = compression
+        self.error = error
+        self._rows = None
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def __getitem__(self, k: int) -> DecodedFrame:
+        """Raises ValueError if frame k is truncated."""
+        if self._rows is None:
+            self._rows = [col.tolist() for col in (self.start, self.width, self.height, self.xoff,
+                                                   self.yoff, self.compression, self.error)]
+        start, width, height, xoff, yoff, comp, error = self._rows
+        if error[k]:
+            raise ValueError(f"Truncated frame at offset {self.offset[k]}")
+        a, w, h = start[k], width[k], height[k]
+        return DecodedFrame(self.pixels[a:a + w * h].reshape(h, w), xoff[k], yoff[k], comp[k])
+
+
+def _spans(first: np.ndarray, length: np.ndarray, total: int) -> np.ndarray:
+    """first[i], first[i] + 1, ... (length[i] values) for every i, back to back; lengths > 0."""
+    at = np.cumsum(length) - length
+    step = np.ones(total, dtype=np.int64)
+    step[at[1:]] = first[1:] - first[:-1] - length[:-1] + 1
+    step[0] = first[0]
+    return np.cumsum(step, out=step)
+
+
+def decode_frames(buf, positions, fill: int = TRANSPARENT_INDEX) -> DecodedFrames:
+    """
+    Decodes many RLE frames at once into palette indices.
+
+    Each line starts at (position of its line word + the word's value) and is
+    a sequence of: skip byte, run (dlen byte + data), [skip byte, run ...]
+    until the line is full. With compression 1 an odd dlen repeats one color
+    dlen>>1 times and an even dlen copies dlen>>1 literal bytes; with
+    compression 0 dlen literal bytes follow.
+
+    The lines of all frames are walked in lockstep, one skip + run per pass
+    over NumPy arrays (passes = most runs on any line, not the number of
+    runs), collecting every run's destination, length and source. Repeats
+    are then filled with np.repeat and literals copied with one fancy-index
+    assignment.
+
+    Args:
+        buf: Buffer holding the frames (whole archive, mmap, record or frame bytes).
+        positions: Offsets of the frame headers in buf.
+        fill (int): Index for pixels the frames do not cover.
+
+    Returns:
+        DecodedFrames: The frames, in the order of positions.
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    size = len(data)
+    offset = np.asarray(positions, dtype=np.int64).reshape(-1)
+    error = (offset < 0) | (offset + 18 > size)
+    head = np.zeros((len(offset), 10), dtype=np.uint8)
+    ok = ~error
+    head[ok] = data[offset[ok, None] + np.arange(8, 18)]
+    head = head.view("<u2").astype(np.int64)
+    comp, w, h = head[:, 0], head[:, 1], head[:, 2]
+    xoff = head[:, 3] - ((head[:, 3] & 0x8000) << 1)
+    yoff = head[:, 4] - ((head[:, 4] & 0x8000) << 1)
+    area = w * h
+    start = np.cumsum(area) - area
+    pixels = np.full(int(area.sum()), fill, dtype=np.uint8)
+
+    # one entry per line: its frame, RLE data position and pixel range
+    frame = np.repeat(np.arange(len(offset)), h)
+    first = np.cumsum(h) - h
+    y = np.arange(len(frame)) - np.repeat(first, h)
+    word = np.repeat(offset + 18, h) + 2 * y
+    at = np.minimum(word, max(size - 2, 0))
+    p = word + data[at] + (data[at + 1].astype(np.int64) << 8)
+    p[word + 2 > size] = size
+    width = np.repeat(w, h)
+    o = np.repeat(start, h) + y * width
+    # rows: frame, RLE position, next pixel, end of line, compression != 0
+    lines = np.stack((frame, p, o, o + width, np.repeat(comp != 0, h)))
+
+    dest, count, src, repeat = [], [], [], []
+    while lines.shape[1]:
+        frame, p, o, end, rle = lines
+        # skip byte; lines that hit the end of buf are dropped and their frame flagged
+        if p.max() >= size:
+            bad = p >= size
+            error[frame[bad]] = True
+            p[bad] = 0
+            end[bad] = o[bad]
+        o += data[p]
+        p += 1
+        live = (o < end).nonzero()[0]
+        if len(live) < len(o):
+            lines = lines[:, live]
+            frame, p, o, end, rle = lines
+            if not len(live):
+                break
+        # run: compression 1 halves dlen, its low bit picking repeat or literal
+        if p.max() >= size:
+            bad = p >= size
+            error[frame[bad]] = True
+            p[bad] = 0
+            end[bad] = o[bad]
+        dlen = data[p]
+        n = dlen >> rle
+        rep = rle & dlen & 1
+        p += 1
+        dest.append(o.copy())
+        count.append(np.minimum(n, end - o))
+        src.append(p.copy())
+        repeat.append(rep)
+        p += np.where(rep, 1, n)
+        o += n
+        live = (o < end).nonzero()[0]
+        if len(live) < len(o):
+            lines = lines[:, live]
+
+    if dest:
+        dest, count = np.concatenate(dest), np.concatenate(count)
+        src, repeat = np.concatenate(src), np.concatenate(repeat).astype(bool)
+        # a repeat's color byte or a literal's bytes past the end of buf
+        over = np.where(repeat, src >= size, src + count > size) & (count > 0)
+        if over.any():
+            error[np.searchsorted(start, dest[over], "right") - 1] = True
+            count[over] = 0
+        runs = repeat & (count > 0)
+        c = count[runs]
+        if len(c):
+            pixels[_spans(dest[runs], c, int(c.sum()))] = np.repeat(data[src[runs]], c)
+        runs = ~repeat & (count > 0)
+        c = count[runs]
+        if len(c):
+            total = int(c.sum())
+            pixels[_spans(dest[runs], c, total)] = data[_spans(src[runs], c, total)]
+    return DecodedFrames(offset, pixels, start, w, h, xoff, yoff, comp, error)
+
+
+def decode_frame(buf, pos: int, fill: int = TRANSPARENT_INDEX) -> DecodedFrame:
+    """
+    Decodes one RLE frame into palette indices.
+
+    Same format and result as decode_frames, but walked line by line with
+    runs copied as slices: for a single frame that beats setting up the
+    NumPy passes of a batch. Use decode_frames for more than a handful.
+
+    Args:
+        buf: Buffer holding the frame (whole archive, mmap, record or frame bytes).
+        pos (int): Offset of the frame header in buf.
+        fill (int): Index for pixels the frame does not cover.
+
+    Returns:
+        DecodedFrame: pixels is a uint8 ndarray of shape (height, width).
+
+    Raises:
+        ValueError: If the frame data runs past the end of buf.
+    """
+    single = _SINGLE
+    try:
+        if pos < 0:
+            raise IndexError(pos)
+        comp, w, h, xoff, yoff = _FRAME_HEADER.unpack_from(buf, pos + 8)
+        out = bytearray(single[fill]) * (w * h)
+        table = pos + 18
+        word = table
+        row = 0
+        for delta in struct.unpack_from("<%dH" % h, buf, table):
+            # o/end are positions in out; p walks the line's RLE data
+            p = word + delta
+            word += 2
+            end = row + w
+            o = row + buf[p]; p += 1
+            while o < end:
+                dlen = buf[p]; p += 1
+                n = dlen >> 1 if comp else dlen
+                m = n if o + n <= end else end - o
+                if comp and dlen & 1:
+                    out[o:o + m] = single[buf[p]] * m
+                    p += 1
+                else:
+                    run = buf[p:p + m]
+                    if len(run) != m:
+                        raise IndexError(p)
+                    out[o:o + m] = run
+                    p += n
+                o += n
+                if o < end:
+                    o += buf[p]; p += 1
+            row = end
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"Truncated frame at offset {pos}") from e
+    pixels = np.frombuffer(out, dtype=np.uint8).reshape(h, w)
+    return DecodedFrame(pixels, xoff, yoff, comp)
+
+
+# ---------- Frame encoding ----------
+
+MAX_RUN = 127       # compression 1: the dlen byte holds n << 1 | repeat
+MAX_SKIP = 255
+
+
+_FRAME_PREFIX = struct.Struct("<HHIHHHhh")  # shape, frame, unknown, then _FRAME_HEADER
+
+
+def _cuts(length: int, transparent: bool) -> list:
+    """
+    Cut points inside an over-long run: every stride measured from either
+    end, so the leftover piece can sit on whichever side a neighbouring
+    literal wants it. Transparent runs use both orders of a full skip plus
+    a full repeat.
+    """
+    patterns = ((MAX_SKIP, MAX_RUN), (MAX_RUN, MAX_SKIP)) if transparent else ((MAX_RUN,),)
+    cuts = set()
+    for pattern in patterns:
+        at, i = 0, 0
+        while True:
+            at += pattern[i % len(pattern)]
+            i += 1
+            if at >= length:
+                break
+            cuts.add(at)
+            cuts.add(length - at)
+    return sorted(cuts)
+
+
+def _segments(pixels: np.ndarray):
+    """
+    Cuts every row into maximal runs of one index (vectorized) for the row
+    encoder.
+
+    Consecutive single opaque pixels are merged into one block with value
+    -1: a one-pixel repeat costs what a one-pixel literal does, and literal
+    chains may be split anywhere (see _encode_row), so dithered art shrinks
+    to a few segments per row without losing a smaller encoding. Runs longer
+    than one skip or repeat can cover are cut into pieces (see _cuts).
+
+    Returns:
+        tuple: (row, start, length, value) arrays, sorted by row and start.
+    """
+    h, w = pixels.shape
+    flat = pixels.ravel()
+    change = np.zeros(h * w, dtype=bool)
+    change[0::w] = True
+    change[1:] |= flat[1:] != flat[:-1]
+    starts = np.flatnonzero(change)
+    lengths = np.diff(np.append(starts, h * w))
+    values = flat[starts].astype(np.int16)
+
+    single = (lengths == 1) & (values != TRANSPARENT_INDEX)
+    joined = np.zeros_like(single)
+    joined[1:] = single[1:] & single[:-1] & (starts[1:] % w != 0)
+    if joined.any():
+        keep = ~joined
+        block = np.cumsum(keep) - 1
+        merged = np.bincount(block) > 1
+        lengths = np.bincount(block, weights=lengths).astype(np.int64)
+        starts = starts[keep]
+        values = values[keep]
+        values[merged] = -1
+
+    limit = np.where(values == TRANSPARENT_INDEX, MAX_SKIP, np.where(values < 0, w, MAX_RUN))
+    long_runs = np.flatnonzero(lengths > limit)
+    if len(long_runs):
+        cut_starts, cut_runs = [], []
+        for r in long_runs.tolist():
+            cuts = _cuts(int(lengths[r]), values[r] == TRANSPARENT_INDEX)
+            cut_starts.extend(int(starts[r]) + c for c in cuts)
+            cut_runs.extend([r] * len(cuts))
+        order = np.argsort(np.concatenate([starts, cut_starts]), kind="stable")
+        starts = np.concatenate([starts, cut_starts])[order]
+        values = np.concatenate([values, values[cut_runs]])[order]
+        lengths = np.diff(np.append(starts, h * w))
+    return starts // w, starts % w, lengths, values
+
+
+def _encode_row(row: bytes, starts: list, values: list) -> bytes:
+    """
+    Smallest compression 1 line for one row over its run boundaries.
+
+    Boundaries carry two states: S (a skip byte comes next, as at the start
+    of the line and after every run) and R (a run comes next, after a skip).
+    S -> R is a skip over transparent pixels (1 byte, 0..255 pixels).
+    R -> S is a repeat within one uniform run (2 bytes) or a literal chain
+    over any pixels: n pixels take ceil(n / 127) literals joined by zero
+    skips, n + 2 * ceil(n / 127) - 1 bytes wherever the joins fall. For each
+    chain length band the cheapest start is kept in a monotonic deque, so
+    the pass is linear in the number of segments.
+    """
+    m = len(starts)
+    w = len(row)
+    pos = starts + [w]
+    inf = 1 << 30
+    cost_s = [0] * (m + 1)
+    cost_r = [0] * (m + 1)
+    key = [0] * (m + 1)          # cost_r[a] - pos[a], the literal window key
+    from_s = [0] * (m + 1)       # 2 * run start boundary, +1 for a repeat
+    from_r = [0] * (m + 1)       # boundary the skip started at
+    # band j holds starts a with (j - 1) * 127 < pos[k] - pos[a] <= j * 127
+    nbands = max(1, -(-w // MAX_RUN))
+    bands = [deque() for _ in range(nbands)]
+    near = bands[0]
+    entered = [0] * nbands
+    for k in range(m + 1):
+        p = pos[k]
+        if k:
+            j = k - 1
+            # a repeat over the pieces of one run just behind k
+            c, b = inf, 0
+            v = values[j]
+            a = j
+            while a >= 0 and values[a] == v and v >= 0 and p - pos[a] <= MAX_RUN:
+                if cost_r[a] + 2 < c:
+                    c, b = cost_r[a] + 2, 2 * a + 1
+                a -= 1
+            # band 0: a single literal, started at most 127 pixels back
+            while near and key[near[-1]] >= key[j]:
+                near.pop()
+            near.append(j)
+            while near and pos[near[0]] < p - MAX_RUN:
+                near.popleft()
+            if near:
+                a = near[0]
+                if key[a] + p + 1 < c:
+                    c, b = key[a] + p + 1, 2 * a
+            # longer chains, only once the row is that long
+            for band in range(1, min(nbands, (p - 1) // MAX_RUN + 1)):
+                window = bands[band]
+                hi = p - MAX_RUN * band
+                a = entered[band]
+                while pos[a] < hi:
+                    while window and key[window[-1]] >= key[a]:
+                        window.pop()
+                    window.append(a)
+                    a += 1
+                entered[band] = a
+                while window and pos[window[0]] < hi - MAX_RUN:
+                    window.popleft()
+                if window:
+                    a = window[0]
+                    if key[a] + p + 2 * band + 1 < c:
+                        c, b = key[a] + p + 2 * band + 1, 2 * a
+            cost_s[k] = c
+            from_s[k] = b
+        else:
+            c = 0
+        # skip 0, or a skip over the transparent segments just behind k
+        r, ra = c + 1, k
+        a = k - 1
+        while a >= 0 and values[a] == TRANSPARENT_INDEX and p - pos[a] <= MAX_SKIP:
+            if cost_s[a] + 1 < r:
+                r, ra = cost_s[a] + 1, a
+            a -= 1
+        cost_r[k] = r
+        from_r[k] = ra
+        key[k] = r - p
+
+    # walk back from the cheaper end state
+    parts = []
+    k, skip = m, cost_r[m] < cost_s[m]
+    while k > 0 or skip:
+        if skip:
+            a = from_r[k]
+            parts.append(_SINGLE[pos[k] - pos[a]])
+        else:
+            a, rep = divmod(from_s[k], 2)
+            if rep:
+                parts.append(bytes(((pos[k] - pos[a]) << 1 | 1, values[a])))
+            else:
+                # the chain back to front: its last literal takes the remainder
+                end = pos[k]
+                while end > pos[a]:
+                    n = (end - pos[a]) % MAX_RUN or MAX_RUN
+                    parts.append(row[end - n:end])
+                    parts.append(_SINGLE[n << 1])
+                    end -= n
+                    if end > pos[a]:
+                        parts.append(b"\x00")
+        k, skip = a, not skip
+    if not parts:
+        parts.append(b"\x00")   # the decoder always reads the first skip byte
+    return b"".join(reversed(parts))
+
+
+def encode_lines(pixels) -> list:
+    """
+    Encodes palette indices as compression 1 lines of minimal size.
+
+    Run boundaries come from one vectorized diff over the whole frame; each
+    row is then a small dynamic program over its runs (see _encode_row).
+    Rows identical to an earlier row reuse its encoding.
+    Index 255 (TRANSPARENT_INDEX) is transparent.
+
+    Args:
+        pixels: (height, width) uint8 array (or nested lists) of indices.
+
+    Returns:
+        list: One bytes object per row.
+    """
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    h, w = pixels.shape
+    if w == 0:
+        return [b"\x00"] * h
+    rows, starts, _, values = _segments(pixels)
+    bounds = np.searchsorted(rows, np.arange(h + 1))
+    starts, values = starts.tolist(), values.tolist()
+    lines, seen = [], {}
+    for y in range(h):
+        row = pixels[y].tobytes()
+        line = seen.get(row)
+        if line is None:
+            a, b = bounds[y], bounds[y + 1]
+            line = seen[row] = _encode_row(row, starts[a:b], values[a:b])
+        lines.append(line)
+    return lines
+
+
+def encode_frame(pixels, xoff: int = 0, yoff: int = 0, shape: int = 0, frame: int = 0,
+                 unknown: int = 0) -> bytes:
+    """
+    Encodes a whole compression 1 frame: header, line table and lines.
+
+    Args:
+        pixels: (height, width) palette indices, 255 transparent.
+        xoff, yoff (int): Hotspot.
+        shape, frame, unknown (int): The header fields before compression.
+
+    Returns:
+        bytes: The frame, as stored in a shape record (decode_frame reads it back).
+    Raises:
+        ValueError: If the line data outgrows the 16-bit line offsets.
+    """
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    h, w = pixels.shape
+    # identical lines are stored once and shared, as in the shipped
+    # archives; line words are relative to their own position
+    where, parts, words, sofar = {}, [], [], 0
+    for i, line in enumerate(encode_lines(pixels)):
+        at = where.get(line)
+        if at is None:
+            at = where[line] = sofar
+            parts.append(line)
+            sofar += len(line)
+        words.append((h - i) * 2 + at)
+    if words and max(words) > 0xFFFF:
+        raise ValueError(f"Frame too large for 16-bit line offsets ({sofar} bytes)")
+    head = _FRAME_PREFIX.pack(shape, frame, unknown, 1, w, h, xoff, yoff)
+    return head + struct.pack(f"<{h}H", *words) + b"".join(parts)
+
+
+# ---------- Sheet slicing ----------
+
+def sheet_frame_rects(opaque: np.ndarray, frames_meta) -> dict:
+    """
+    Frame rectangles (x, y, w, h) on a sheet from its alpha mask projections.
+
+    Frames are read left to right in bands: a band starts at the first opaque
+    row below the previous one, each frame at the next opaque column of its
+    rows. A band ends when no opaque column is left in it, so gutters and
+    short (ragged) rows need no padding. Frames with no size, or that run
+    out of sheet, get no rectangle.
+    """
+    sh, sw = opaque.shape
+    rows = np.flatnonzero(opaque.any(axis=1))
+    rects = {}
+    y = 0; x = 0; band_h = 0
+    for i, fr in enumerate(frames_meta):
+        w, h = fr["w"], fr["h"]
+        if w <= 0 or h <= 0:
+            continue
+        while True:
+            if x == 0:
+                # new band: first opaque row at or below y
+                k = np.searchsorted(rows, y)
+                if k == len(rows):
+                    return rects
+                y = int(rows[k])
+            cols = np.flatnonzero(opaque[y:y+h, x:].any(axis=0))
+            if len(cols):       # always hit at x == 0: row y is opaque
+                x += int(cols[0])
+                break
+            y += band_h; x = 0; band_h = 0
+        rects[i] = (x, y, w, h)
+        x += w
+        band_h = max(band_h, h)
+    return rects
+
+
+# ---------- Archive access ----------
+
+class ShapeFile:
+    """
+    Read-only view of a shape archive: an mmap of the file plus its
+    (sidecar-cached) ShapeIndex. One per process; mmaps are not shared.
+    """
+
+    def __init__(self, path, index: ShapeIndex = None):
+        self.path = os.fspath(path)
+        self._file = open(self.path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b""
+        self.index = index if index is not None else ShapeIndex.load(self.path)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def num_shapes(self) -> int:
+        return self.index.num_shapes
+
+    def frame_count(self, shape: int) -> int:
+        return self.index.frame_count(shape)
+
+    def frame_info(self, shape: int, frame: int) -> FrameInfo:
+        return self.index.frame(shape, frame)
+
+    def decode(self, shape: int, frame: int, fill: int = TRANSPARENT_INDEX) -> DecodedFrame:
+        """Decodes (shape, frame); raises IndexError for a missing frame."""
+        return decode_frame(self.data, self.index.offset[self.index.frame_slot(shape, frame)], fill)
+
+    def decode_many(self, keys=None, fill: int = TRANSPARENT_INDEX) -> DecodedFrames:
+        """
+        Decodes many frames in one decode_frames batch, far faster than
+        decode() per frame once there are more than a handful.
+
+        Args:
+            keys: (shape, frame) pairs; defaults to every frame of the archive.
+            fill (int): Index for uncovered pixels.
+
+        Returns:
+            DecodedFrames: In the order of keys.
+
+        Raises:
+            IndexError: For a missing frame.
+        """
+        offsets = self.index.offset
+        if keys is not None:
+            slot = self.index.frame_slot
+            offsets = [offsets[slot(shape, frame)] for shape, frame in keys]
+        return decode_frames(self.data, offsets, fill)
+
+
+# ---------- Record patching ----------
+
+def shape_record_frames(buf, rec) -> list:
+    """(rel offset, unknown, size) per entry of a shape record's frame table; rec is (offset, size)."""
+    rec_off, rec_size = rec
+    if not rec_off or rec_size < 6:
+        return []
+    nframes = min(struct.unpack_from("<H", buf, rec_off + 4)[0], (rec_size - 6) // 6)
+    return [(lo | (hi << 16), unk, fsize)
+            for lo, hi, unk, fsize in _FRAME_ENTRY.iter_unpack(buf[rec_off + 6:rec_off + 6 + nframes * 6])]
+
+
+def build_shape_record(buf, rec, frame_replacements: dict) -> bytes:
+    """
+    A shape record with some frames swapped and its frame table redone.
+
+    Args:
+        buf: The archive.
+        rec: (offset, size) of the shape record in buf.
+        frame_replacements (dict): Frame number -> new frame bytes.
+
+    Returns:
+        bytes: The record; frames are laid out in order behind the table.
+    """
+    rec_off = rec[0]
+    frames = shape_record_frames(buf, rec)
+    table = bytearray(bytes(buf[rec_off:rec_off + 4]) + struct.pack("<H", len(frames)))
+    data = []
+    rel = 6 + 6 * len(frames)
+    for i, (frel, unk, fsize) in enumerate(frames):
+        chunk = frame_replacements.get(i)
+        if chunk is None:
+            chunk = buf[rec_off + frel:rec_off + frel + fsize]
+        table += _FRAME_ENTRY.pack(rel & 0xFFFF, rel >> 16, unk, len(chunk))
+        data.append(bytes(chunk))
+        rel += len(chunk)
+    return bytes(table) + b"".join(data)
+
+
+def patch_type_in_file(flx_path, blob: bytearray, recs, type_index: int, frame_replacements: dict) -> str:
+    """
+    Saves replaced frames of one shape straight into the FLX on disk and
+    mirrors every write into blob. Frames that fit their slots are
+    overwritten in place, unless another record shares the shape's bytes;
+    otherwise the rebuilt record goes wherever
+    flx_lib.FlxPatcher finds room and only its table entry changes.
+    In-place writes are not crash safe, so callers back the file up first.
+
+    Args:
+        flx_path: The archive on disk.
+        blob (bytearray): The loaded archive, kept in step with the file.
+        recs: The archive's FlxIndex.
+        type_index (int): The shape.
+        frame_replacements (dict): Frame number -> new frame bytes.
+
+    Returns:
+        str: A short description of what was done.
+    """
+    rec_off = recs[type_index][0]
+    frames = shape_record_frames(blob, recs[type_index])
+    with FlxPatcher(flx_path, mirror=blob) as flx:
+        fits = all(len(data) <= frames[i][2] for i, data in frame_replacements.items())
+        if fits and not flx.is_shared(type_index):
+            for i, data in frame_replacements.items():
+                flx.write_into(type_index, frames[i][0], bytes(data).ljust(frames[i][2], b"\x00"))
+            return "frames overwritten in place"
+        new_off = flx.replace(type_index, build_shape_record(blob, recs[type_index], frame_replacements))
+    return "record rewritten in place" if new_off == rec_off else f"record moved to 0x{new_off:X}"
+
+
+# ---------- Encoder benchmark ----------
+
+def _frame_span(buf, pos: int) -> int:
+    """
+    Bytes a compression 1 frame really occupies (header to the end of its
+    last line). The size in the shape's frame table leaves out the 8-byte
+    shape/frame/unknown prefix, so it is not used for comparisons.
+    """
+    _, w, h, _, _ = _FRAME_HEADER.unpack_from(buf, pos + 8)
+    end = pos + 18 + 2 * h
+    for i, delta in enumerate(struct.unpack_from("<%dH" % h, buf, pos + 18)):
+        p = pos + 18 + 2 * i + delta
+        o = buf[p]; p += 1
+        while o < w:
+            dlen = buf[p]; p += 1
+            p += 1 if dlen & 1 else dlen >> 1
+            o += dlen >> 1
+            if o < w:
+                o += buf[p]; p += 1
+        end = max(end, p)
+    return end - pos
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Re-encode shipped frames and compare size and speed.")
+    ap.add_argument("--flx", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "U8SHAPES.FLX"))
+    ap.add_argument("--shapes", type=int, nargs=2, metavar=("FIRST", "END"), help="shape range [FIRST, END)")
+    ap.add_argument("--limit", type=int, default=0, help="stop after this many frames")
+    args = ap.parse_args(argv)
+
+    with ShapeFile(args.flx) as sf:
+        first, end = args.shapes or (0, sf.num_shapes)
+        frames = shipped = encoded = smaller = larger = bad = 0
+        pixels_total = 0
+        t_decode = t_encode = 0.0
+        for shape in range(first, min(end, sf.num_shapes)):
+            for f in range(sf.frame_count(shape)):
+                info = sf.frame_info(shape, f)
+                if info.compression != 1 or not info.width or not info.height:
+                    continue
+                t0 = time.perf_counter()
+                try:
+                    dec = sf.decode(shape, f)
+                except ValueError:
+                    continue
+                t1 = time.perf_counter()
+                data = encode_frame(dec.pixels, dec.xoff, dec.yoff, shape, f, info.unknown)
+                t2 = time.perf_counter()
+                t_decode += t1 - t0
+                t_encode += t2 - t1
+                if not np.array_equal(decode_frame(data, 0).pixels, dec.pixels):
+                    bad += 1
+                size = _frame_span(sf.data, info.offset)
+                frames += 1
+                pixels_total += dec.pixels.size
+                shipped += size
+                encoded += len(data)
+                smaller += len(data) < size
+                larger += len(data) > size
+                if args.limit and frames >= args.limit:
+                    break
+            if args.limit and frames >= args.limit:
+                break
+
+    if not frames:
+        print("No compression 1 frames found.")
+        return 1
+    print(f"{frames} frames, {pixels_total} pixels")
+    print(f"shipped {shipped} bytes, encoded {encoded} bytes ({100.0 * encoded / shipped:.1f}%)")
+    print(f"smaller than shipped: {smaller}, same size: {frames - smaller - larger}, larger: {larger}")
+    print(f"encode {t_encode:.2f}s ({1e6 * t_encode / frames:.0f} us/frame, "
+          f"{pixels_total / max(t_encode, 1e-9) / 1e6:.2f} Mpx/s); decode {t_decode:.2f}s")
+    print(f"round-trip mismatches: {bad}")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
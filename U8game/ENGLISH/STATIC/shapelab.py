@@ -8,6 +8,14 @@ from typing import List, Tuple, Dict, Optional
 import pygame
 from pygame import Surface, Rect
 
+import numpy as np
+
+from cache_lib import FrameCache
+from flx_lib import FlxIndex
+from palette_lib import Palette
+from shape_lib import (BATCH_MIN_FRAMES, build_shape_record, decode_frame, decode_frames, encode_frame,
+                       patch_type_in_file, sheet_frame_rects)
+
 # ----- optional file dialog (no visible window) -----
 try:
     import tkinter as tk
@@ -27,6 +35,8 @@ W, H = 1280, 860
 UI_W = 460
 PADDING = 14
 FPS = 60
+IDLE_WAIT_MS = 500          # event wait while idle (also the cursor blink period)
+SURFACE_CACHE_BYTES = 64 * 1024 * 1024
 
 CANVAS_BG = (18, 18, 18)
 PANEL_BG  = (28, 28, 28)
@@ -46,27 +56,13 @@ def i16(b, o=0): return struct.unpack_from("<h", b, o)[0]
 def put_u16(v):  return struct.pack("<H", v)
 def put_u24(v):  return bytes((v & 0xFF, (v>>8)&0xFF, (v>>16)&0xFF))
 
-def mm_to_rgb(v):  # VGA 0..63 -> 0..255
-    x = int(v) * 4
-    return 255 if x > 255 else x
-
 # ---------------------------------------------------------------------
 # Palette
 # ---------------------------------------------------------------------
 
-def load_palette(path: str) -> List[Tuple[int,int,int]]:
-    with open(path, "rb") as f:
-        raw = f.read()
-    if len(raw) < 4 + 768:
-        raise ValueError("U8PAL.PAL too small or wrong file.")
-    base = 4
-    out = []
-    for i in range(256):
-        r = mm_to_rgb(raw[base + 3*i + 0])
-        g = mm_to_rgb(raw[base + 3*i + 1])
-        b = mm_to_rgb(raw[base + 3*i + 2])
-        out.append((r,g,b))
-    return out
+def load_palette(path: str) -> Palette:
+    """U8PAL.PAL as a palette_lib.Palette (pal[i] -> (r,g,b); index 255 transparent)."""
+    return Palette.load(path)
 
 # ---------------------------------------------------------------------
 # FLX parsing
@@ -75,17 +71,11 @@ def load_palette(path: str) -> List[Tuple[int,int,int]]:
 def load_flx_table(blob: bytearray):
     if len(blob) < 136:
         raise ValueError("U8SHAPES.FLX too small.")
-    count = u16(blob, 84)
-    recs = []
-    table_off = 128
-    for i in range(count):
-        off  = int.from_bytes(blob[table_off + i*8 + 0: table_off + i*8 + 4], "little")
-        size = int.from_bytes(blob[table_off + i*8 + 4: table_off + i*8 + 8], "little")
-        recs.append({"off": off, "size": size})
-    return count, recs
+    recs = FlxIndex.from_buffer(blob)
+    return recs.count, recs
 
 def read_type_chunk(blob: bytearray, rec):
-    off = rec["off"]; size = rec["size"]
+    off, size = rec
     chunk = blob[off: off+size]
     head04 = chunk[0:4]
     num_frames = u16(chunk, 4)
@@ -103,112 +93,35 @@ def read_type_chunk(blob: bytearray, rec):
 # U8 frame decode / encode (matches U8VIEW.BAS logic)
 # ---------------------------------------------------------------------
 
-def decode_frame_to_indices(blob: bytearray, abs_off: int):
-    comp = u16(blob, abs_off + 8)
-    xlen = u16(blob, abs_off + 10)
-    ylen = u16(blob, abs_off + 12)
-    xoff = i16(blob, abs_off + 14)
-    yoff = i16(blob, abs_off + 16)
-
-    if xlen == 0 or ylen == 0:
-        return [[255]*max(1,xlen) for _ in range(max(1,ylen))], xlen, ylen, xoff, yoff, comp
-
-    grid = [[255]*xlen for _ in range(ylen)]
-    offsets_start = abs_off + 18
-
-    for y in range(ylen):
-        word_pos = offsets_start + 2*y
-        rel = u16(blob, word_pos)
-        p = word_pos + rel
-
-        xpos = blob[p]; p += 1
-        while True:
-            if xpos == xlen:
-                break
-            dlen = blob[p]; p += 1
-            if comp == 0:
-                for i in range(dlen):
-                    if 0 <= xpos+i < xlen:
-                        grid[y][xpos+i] = blob[p+i]
-                p += dlen
-            else:
-                if (dlen & 1) == 1:
-                    run = dlen >> 1
-                    color = blob[p]; p += 1
-                    for i in range(run):
-                        if 0 <= xpos+i < xlen:
-                            grid[y][xpos+i] = color
-                    dlen = run
-                else:
-                    run = dlen >> 1
-                    for i in range(run):
-                        if 0 <= xpos+i < xlen:
-                            grid[y][xpos+i] = blob[p+i]
-                    p += run
-                    dlen = run
-            xpos += dlen
-            if xpos < xlen:
-                skip = blob[p]; p += 1
-                xpos += skip
-    return grid, xlen, ylen, xoff, yoff, comp
-
-def encode_frame_u8(index_grid: List[List[int]], xlen: int, ylen: int, xoff: int, yoff: int) -> bytes:
-    """Compression=1 stream, with simple literal vs repeated runs."""
-    lines: List[bytes] = []
-    for y in range(ylen):
-        row = index_grid[y]
-        rle = bytearray()
-        xpos = 0
-        while xpos < xlen:
-            # gap of transparent (255)
-            start = xpos
-            while start < xlen and row[start] == 255:
-                start += 1
-            rle.append((start - xpos) & 0xFF)
-            xpos = start
-            if xpos >= xlen:
-                break
-            # run of opaque
-            end = xpos
-            while end < xlen and row[end] != 255:
-                end += 1
-            p = xpos
-            while p < end:
-                chunk = min(127, end - p)  # 7-bit length
-                c0 = row[p]
-                repeated = True
-                for k in range(1, chunk):
-                    if row[p+k] != c0:
-                        repeated = False
-                        break
-                if repeated:
-                    rle.append((chunk << 1) | 1)
-                    rle.append(c0 & 0xFF)
-                else:
-                    rle.append((chunk << 1) | 0)
-                    rle.extend((row[p+i] & 0xFF) for i in range(chunk))
-                p += chunk
-            xpos = end
-        lines.append(bytes(rle))
-
-    # line-offsets (relative) are written as: (remaining_lines*2) + bytes_before_this_line
-    offsets = []
-    sofar = 0
-    for i, line in enumerate(lines):
-        offsets.append((len(lines) - i) * 2 + sofar)
-        sofar += len(line)
-
-    header = struct.pack("<HHIHHHHH",
-                         0, 0, 0,      # type, frame, unknown (not used)
-                         1,            # compression
-                         xlen, ylen,
-                         xoff, yoff)
-
-    off_table = bytearray()
-    for v in offsets:
-        off_table += put_u16(v & 0xFFFF)
-
-    return header + off_table + b"".join(lines)
+def decode_frames_to_indices(blob: bytearray, abs_offs):
+    """
+    Index grids (uint8 ndarray [y][x], 255 = transparent) of a shape's
+    frames: one shape_lib.decode_frames batch, or decode_frame per frame
+    below BATCH_MIN_FRAMES. One (grid, xlen, ylen, xoff, yoff, comp) tuple
+    per offset.
+    """
+    if len(abs_offs) < BATCH_MIN_FRAMES:
+        decoded = [decode_frame(blob, off) for off in abs_offs]
+    else:
+        batch = decode_frames(blob, abs_offs)
+        decoded = (batch[k] for k in range(len(batch)))
+    out = []
+    for pixels, xoff, yoff, comp in decoded:
+        ylen, xlen = pixels.shape
+        if xlen == 0 or ylen == 0:
+            pixels = np.full((max(1,ylen), max(1,xlen)), 255, dtype=np.uint8)
+        out.append((pixels, xlen, ylen, xoff, yoff, comp))
+    return out
+
+def encode_frame_u8(index_grid, xlen: int, ylen: int, xoff: int, yoff: int) -> bytes:
+    """Compression=1 frame via shape_lib.encode_frame (smallest runs per row)."""
+    grid = np.asarray(index_grid, dtype=np.uint8)
+    if grid.shape != (ylen, xlen):
+        out = np.full((ylen, xlen), 255, dtype=np.uint8)
+        h, w = min(ylen, grid.shape[0]), min(xlen, grid.shape[1] if grid.ndim == 2 else 0)
+        out[:h, :w] = grid[:h, :w]
+        grid = out
+    return encode_frame(grid, xoff, yoff)
 
 def patch_type_frame(frame_bytes: bytes, type_index: int, frame_index: int) -> bytes:
     b = bytearray(frame_bytes)
@@ -220,128 +133,40 @@ def patch_type_frame(frame_bytes: bytes, type_index: int, frame_index: int) -> b
 # Palette mapping / image loading
 # ---------------------------------------------------------------------
 
-def nearest_index(rgb: Tuple[int,int,int], pal: List[Tuple[int,int,int]]) -> int:
-    r,g,b = rgb
-    best = 0
-    bd = 1e12
-    for i,(pr,pg,pb) in enumerate(pal):
-        dr = r - pr; dg = g - pg; db = b - pb
-        d = dr*dr + dg*dg + db*db
-        if d < bd:
-            bd = d; best = i
-    return best
-
-def pil_load_indices(path: str, pal: List[Tuple[int,int,int]]) -> Tuple[List[List[int]], int, int]:
+def pil_load_indices(path: str, pal: Palette, dither=None) -> Tuple[np.ndarray, int, int]:
+    """Image file -> (h, w) index array via Palette.quantize (alpha < 128 -> 255)."""
     from PIL import Image
-    im = Image.open(path).convert("RGBA")
-    w, h = im.size
-    px = im.load()
-    grid = []
-    for y in range(h):
-        row = []
-        for x in range(w):
-            r,g,b,a = px[x,y]
-            if a < 128:
-                row.append(255)
-            else:
-                row.append(nearest_index((r,g,b), pal))
-        grid.append(row)
+    with Image.open(path) as im:
+        grid = pal.quantize(np.asarray(im.convert("RGBA")), dither)
+    h, w = grid.shape
     return grid, w, h
 
 # ---------------------------------------------------------------------
 # Sheet slicing (transparency-aligned)
 # ---------------------------------------------------------------------
 
-def slice_sheet_to_grids(path: str, pal: List[Tuple[int,int,int]], frames_meta: List[Dict]) -> Dict[int, List[List[int]]]:
-    """Cut a multi-frame sheet into exact frame sizes, starting each frame
-       at the first opaque column of the row band (tolerates transparent gutters)."""
+def slice_sheet_to_grids(path: str, pal: Palette, frames_meta: List[Dict], dither=None) -> Dict[int, np.ndarray]:
+    """Cut a multi-frame sheet into exact frame sizes (see sheet_frame_rects);
+       parts of a frame past the sheet edge stay transparent."""
     from PIL import Image
-    im = Image.open(path).convert("RGBA")
-    sw, sh = im.size
-    px = im.load()
-
-    def col_has_opaque(x, y0, y1):
-        y1 = min(y1, sh)
-        for yy in range(y0, y1):
-            if x >= sw: return False
-            if px[x, yy][3] >= 128:
-                return True
-        return False
-
-    rows = []
-    cur = []; curw = 0; row_h = 0
-    for fr in frames_meta:
-        w = max(1, fr["w"]); h = max(1, fr["h"])
-        if cur and curw + w > sw:
-            rows.append((cur, row_h))
-            cur = []; curw = 0; row_h = 0
-        cur.append((w, h))
-        curw += w
-        row_h = max(row_h, h)
-    if cur:
-        rows.append((cur, row_h))
-
-    grids: Dict[int, List[List[int]]] = {}
-    fi = 0
-    y = 0
-    for dims, row_h in rows:
-        # skip transparent rows above the content band
-        while y < sh:
-            band_has_opaque = any(px[x, yy][3] >= 128
-                                  for yy in range(y, min(y+row_h, sh))
-                                  for x in range(sw))
-            if band_has_opaque: break
-            y += 1
-
-        # find row start
-        x = 0
-        while x < sw and not col_has_opaque(x, y, y+row_h):
-            x += 1
-
-        for (w, h) in dims:
-            g = [[255]*w for _ in range(h)]
-            for yy in range(h):
-                for xx in range(w):
-                    if x+xx >= sw or y+yy >= sh:
-                        continue
-                    r,gg,b,a = px[x+xx, y+yy]
-                    g[yy][xx] = 255 if a < 128 else nearest_index((r,gg,b), pal)
-            grids[fi] = g
-            fi += 1
-
-            # advance to next opaque column after the block
-            x += w
-            while x < sw and not col_has_opaque(x, y, y+row_h):
-                x += 1
-
-        y += row_h
+    with Image.open(path) as im:
+        rgba = np.asarray(im.convert("RGBA"))
+    indices = pal.quantize(rgba, dither)    # whole sheet in one lookup
+    grids: Dict[int, np.ndarray] = {}
+    for i, (x, y, w, h) in sheet_frame_rects(rgba[..., 3] >= 128, frames_meta).items():
+        g = np.full((h, w), 255, dtype=np.uint8)
+        block = indices[y:y+h, x:x+w]
+        g[:block.shape[0], :block.shape[1]] = block
+        grids[i] = g
     return grids
 
 # ---------------------------------------------------------------------
 # Surface building
 # ---------------------------------------------------------------------
 
-def make_surface_from_indices(grid: List[List[int]], pal: List[Tuple[int,int,int]], scale=1.0) -> Surface:
-    h = len(grid)
-    w = len(grid[0]) if h else 1
-    surf = pygame.Surface((w, h), pygame.SRCALPHA, 32)
-
-    rgb = pygame.surfarray.pixels3d(surf)
-    a = pygame.surfarray.pixels_alpha(surf)
-    for y in range(h):
-        row = grid[y]
-        for x in range(w):
-            idx = row[x]
-            if idx == 255:
-                rgb[x, y] = (0, 0, 0); a[x, y] = 0
-            else:
-                r, g, b = pal[idx]
-                rgb[x, y] = (r, g, b); a[x, y] = 255
-    del rgb, a
-
-    if scale != 1.0:
-        surf = pygame.transform.scale(surf, (int(w*scale), int(h*scale)))
-    return surf
+def make_surface_from_indices(grid, pal: Palette, scale=1.0) -> Surface:
+    """Index grid -> RGBA surface through the palette LUT (255 = transparent)."""
+    return pal.to_surface(grid, scale)
 
 # ---------------------------------------------------------------------
 # Save helpers
@@ -349,8 +174,9 @@ def make_surface_from_indices(grid: List[List[int]], pal: List[Tuple[int,int,int
 
 def try_inplace_write(blob: bytearray, recs, type_index: int, frame_index: int, new_frame: bytes) -> bool:
     rec = recs[type_index]
+    rec_off = rec[0]
     tinfo = read_type_chunk(blob, rec)
-    abs_off = rec["off"] + tinfo["frames"][frame_index]["rel"]
+    abs_off = rec_off + tinfo["frames"][frame_index]["rel"]
     orig_sz = tinfo["frames"][frame_index]["size"]
     if len(new_frame) > orig_sz:
         return False
@@ -360,41 +186,18 @@ def try_inplace_write(blob: bytearray, recs, type_index: int, frame_index: int,
     return True
 
 def rebuild_type_and_file(blob: bytearray, recs, type_index: int, frame_replacements: dict) -> bytearray:
-    rec = recs[type_index]
-    tinfo = read_type_chunk(blob, rec)
-    nf = tinfo["num_frames"]
-    frames = tinfo["frames"]
-
-    head = bytearray()
-    head += tinfo["raw_head04"]
-    head += put_u16(nf)
-
-    base_rel = 6 + nf*6
-    rel_cursor = base_rel
-    hdrs = bytearray()
-    data = bytearray()
-
-    for i in range(nf):
-        unk = frames[i]["unk"]
-        abs_off = rec["off"] + frames[i]["rel"]
-        orig = blob[abs_off: abs_off + frames[i]["size"]]
-        chunk = frame_replacements.get(i, orig)
-        hdrs += put_u24(rel_cursor)
-        hdrs += bytes((unk,))
-        hdrs += put_u16(len(chunk))
-        data += chunk
-        rel_cursor += len(chunk)
-
-    new_chunk = bytes(head + hdrs + data)
-
-    before = blob[:rec["off"]]
-    after  = blob[rec["off"] + rec["size"]:]
+    """Whole-file rebuild (later records shift); patch_type_in_file avoids this."""
+    rec_off, rec_size = recs[type_index]
+    new_chunk = build_shape_record(blob, recs[type_index], frame_replacements)
+
+    before = blob[:rec_off]
+    after  = blob[rec_off + rec_size:]
     new_blob = bytearray(before + new_chunk + after)
 
-    count = u16(new_blob, 84)
-    table_off = 128
+    count = recs.count
+    table_off = recs.table_offset
     new_blob[table_off + type_index*8 + 4: table_off + type_index*8 + 8] = len(new_chunk).to_bytes(4, "little")
-    delta = len(new_chunk) - rec["size"]
+    delta = len(new_chunk) - rec_size
     for i in range(type_index+1, count):
         off = int.from_bytes(new_blob[table_off + i*8 + 0: table_off + i*8 + 4], "little")
         if off != 0:
@@ -468,7 +271,6 @@ class InputBox:
         self.text = str(getter())
         self.focus = False
         self.cursor = len(self.text)
-        self.blink = 0
     def draw(self, surf, font):
         lab = font.render(self.label, True, PANEL_FG)
         surf.blit(lab, (self.rect.x, self.rect.y-20))
@@ -478,8 +280,7 @@ class InputBox:
         txt = font.render(self.text, True, PANEL_FG)
         surf.blit(txt, (inner.x+8, inner.y+6))
         if self.focus:
-            self.blink = (self.blink + 1) % 60
-            if self.blink < 30:
+            if (pygame.time.get_ticks() // IDLE_WAIT_MS) % 2 == 0:
                 cx = inner.x + 8 + font.size(self.text[:self.cursor])[0]
                 cy = inner.y + 6
                 pygame.draw.line(surf, PANEL_FG, (cx, cy), (cx, cy+font.get_height()), 1)
@@ -541,11 +342,15 @@ class ShapeLab:
 
         # loaded frame data cache
         self.shape_frames: Dict[int, Dict] = {}
+        # scaled frame surfaces: (source, shape, frame, zoom, preview version) -> Surface
+        self.surfaces = FrameCache(SURFACE_CACHE_BYTES)
+        self.preview_version = 0
+        self.dirty = True
         self.ensure_shape_loaded(self.shape_idx)
 
         # preview state
-        self.preview_shape_sheet: Optional[Dict[int, List[List[int]]]] = None
-        self.preview_frame_grid: Optional[List[List[int]]] = None
+        self.preview_shape_sheet: Optional[Dict[int, np.ndarray]] = None
+        self.preview_frame_grid: Optional[np.ndarray] = None
         self.preview_resize: bool = False      # true when preview frame differs in size
         self.preview_w = 0
         self.preview_h = 0
@@ -563,16 +368,42 @@ class ShapeLab:
         if idx in self.shape_frames:
             return
         rec = self.recs[idx]
+        rec_off = rec[0]
         t = read_type_chunk(self.flx_blob, rec)
         frames_data = []
-        for i, fh in enumerate(t["frames"]):
-            abs_off = rec["off"] + fh["rel"]
-            grid, w, h, xoff, yoff, comp = decode_frame_to_indices(self.flx_blob, abs_off)
-            surf = make_surface_from_indices(grid, self.pal)
-            frames_data.append({"w":w,"h":h,"xoff":xoff,"yoff":yoff,"grid":grid,"surf":surf,"abs_off":abs_off,"size":fh["size"]})
+        offs = [rec_off + fh["rel"] for fh in t["frames"]]
+        for fh, abs_off, (grid, w, h, xoff, yoff, comp) in zip(t["frames"], offs,
+                                                              decode_frames_to_indices(self.flx_blob, offs)):
+            frames_data.append({"w":w,"h":h,"xoff":xoff,"yoff":yoff,"grid":grid,"abs_off":abs_off,"size":fh["size"]})
         self.shape_frames[idx] = {"num": t["num_frames"], "frames": frames_data, "rec": rec, "tinfo": t}
         self.frame_idx = clamp(self.frame_idx, 0, self.shape_frames[idx]["num"]-1)
 
+    def frame_surface(self, source: str, i: int, grid) -> Surface:
+        """
+        Zoomed surface of frame i of the current shape, built on first use.
+        source is "frame" (archive pixels), "sheet" or "preview"; preview
+        surfaces are keyed by preview_version, so an import or a cleared
+        preview never shows stale pixels.
+        """
+        version = 0 if source == "frame" else self.preview_version
+        key = (source, self.shape_idx, i, self.zoom, version)
+        return self.surfaces.get_or_load(key, lambda: make_surface_from_indices(grid, self.pal, scale=self.zoom))
+
+    def forget_shape(self, idx: int):
+        """Drops the cached surfaces of a shape (after its frames changed)."""
+        for key in self.surfaces.keys():
+            if key[1] == idx:
+                self.surfaces.discard(key)
+
+    def preview_changed(self):
+        self.preview_version += 1
+
+    def set_palette(self, pal: Palette):
+        """Swaps the palette; every cached surface is rebuilt on next draw."""
+        self.pal = pal
+        self.surfaces.clear()
+        self.dirty = True
+
     # ---------- UI ----------
     def build_ui(self):
         px = W-UI_W + PADDING
@@ -696,19 +527,11 @@ class ShapeLab:
             # rescale to match original frame
             tmp = make_surface_from_indices(grid, self.pal)
             tmp = pygame.transform.smoothscale(tmp, (fr["w"], fr["h"]))
-            px = pygame.surfarray.pixels3d(tmp)
-            al = pygame.surfarray.pixels_alpha(tmp)
-            g2 = []
-            for y in range(fr["h"]):
-                row=[]
-                for x in range(fr["w"]):
-                    if al[x,y] < 128: row.append(255)
-                    else: row.append(nearest_index(tuple(px[x,y]), self.pal))
-                g2.append(row)
-            del px, al
-            grid = g2
+            rgba = np.frombuffer(pygame.image.tobytes(tmp, "RGBA"), dtype=np.uint8)
+            grid = self.pal.quantize(rgba.reshape(fr["h"], fr["w"], 4))
         self.preview_frame_grid = grid
         self.preview_resize = False
+        self.preview_changed()
         self.preview_w, self.preview_h = fr["w"], fr["h"]
         self.preview_xoff, self.preview_yoff = fr["xoff"], fr["yoff"]
         self.preview_shape_sheet = None
@@ -721,6 +544,7 @@ class ShapeLab:
         # keep old offsets by default so the anchor remains stable
         self.preview_frame_grid = grid
         self.preview_resize = True
+        self.preview_changed()
         self.preview_w, self.preview_h = w, h
         self.preview_xoff, self.preview_yoff = fr["xoff"], fr["yoff"]
         self.preview_shape_sheet = None
@@ -736,11 +560,13 @@ class ShapeLab:
         self.preview_shape_sheet = grids
         self.preview_frame_grid = None
         self.preview_resize = False
+        self.preview_changed()
 
     def clear_preview(self):
         self.preview_frame_grid = None
         self.preview_shape_sheet = None
         self.preview_resize = False
+        self.preview_changed()
 
     # ---------- Save ----------
     def commit_save(self):
@@ -773,36 +599,19 @@ class ShapeLab:
             enc = patch_type_frame(enc, self.shape_idx, self.frame_idx)
             repl[self.frame_idx] = enc
 
-        # try in-place then rebuild if needed
-        inplace_ok = True
-        for i, enc in repl.items():
-            if len(enc) > frames[i]["size"]:
-                inplace_ok = False
-                break
-
-        if inplace_ok:
-            mod = self.flx_blob
-            for i, enc in repl.items():
-                ok = try_inplace_write(mod, self.recs, self.shape_idx, i, enc)
-                if not ok:
-                    inplace_ok = False
-                    break
-            if not inplace_ok:
-                mod = rebuild_type_and_file(self.flx_blob, self.recs, self.shape_idx, repl)
-        else:
-            mod = rebuild_type_and_file(self.flx_blob, self.recs, self.shape_idx, repl)
-
         bak = self.flx_path + ".bak"
         if not os.path.exists(bak):
             shutil.copyfile(self.flx_path, bak)
             print(f"Backed up original -> {bak}")
-        with open(self.flx_path, "wb") as f:
-            f.write(mod)
-        print("Saved changes to U8SHAPES.FLX")
+        # only this shape's bytes and table entry are written; flx_blob follows along.
+        # In-place writes are not crash safe, hence the .bak above.
+        how = patch_type_in_file(self.flx_path, self.flx_blob, self.recs, self.shape_idx, repl)
+        print(f"Saved changes to U8SHAPES.FLX ({how})")
 
-        self.flx_blob = mod
+        self.count, self.recs = load_flx_table(self.flx_blob)
         if self.shape_idx in self.shape_frames:
             del self.shape_frames[self.shape_idx]
+        self.forget_shape(self.shape_idx)
         self.ensure_shape_loaded(self.shape_idx)
         self.clear_preview()
 
@@ -855,13 +664,12 @@ class ShapeLab:
         if self.show_all:
             pad = 12
             x = pad; y = pad; rowh = 0
-            scale = self.zoom
             for i, fr in enumerate(frames):
                 # Replace from sheet preview if available
                 if (self.preview_shape_sheet is not None) and (i in self.preview_shape_sheet):
-                    img = make_surface_from_indices(self.preview_shape_sheet[i], self.pal, scale=scale)
+                    img = self.frame_surface("sheet", i, self.preview_shape_sheet[i])
                 else:
-                    img = make_surface_from_indices(fr["grid"], self.pal, scale=scale)
+                    img = self.frame_surface("frame", i, fr["grid"])
 
                 if x + img.get_width() > rect.w - pad:
                     x = pad; y += rowh + pad; rowh = 0
@@ -876,13 +684,13 @@ class ShapeLab:
 
             if self.preview_frame_grid is not None:
                 # Show exactly the preview (supports different size)
-                base = make_surface_from_indices(self.preview_frame_grid, self.pal, scale=self.zoom)
+                base = self.frame_surface("preview", i, self.preview_frame_grid)
                 xo, yo = self.preview_xoff, self.preview_yoff
             elif (self.preview_shape_sheet is not None) and (i in self.preview_shape_sheet):
-                base = make_surface_from_indices(self.preview_shape_sheet[i], self.pal, scale=self.zoom)
+                base = self.frame_surface("sheet", i, self.preview_shape_sheet[i])
                 xo, yo = fr["xoff"], fr["yoff"]
             else:
-                base = make_surface_from_indices(fr["grid"], self.pal, scale=self.zoom)
+                base = self.frame_surface("frame", i, fr["grid"])
                 xo, yo = fr["xoff"], fr["yoff"]
 
             x = (rect.w - base.get_width())//2
@@ -904,7 +712,17 @@ class ShapeLab:
         self.sync_offset_inputs()
         running = True
         while running:
-            for ev in pygame.event.get():
+            events = pygame.event.get()
+            if not events and not self.dirty:
+                # idle: sleep until input (or the next cursor blink)
+                ev = pygame.event.wait(IDLE_WAIT_MS)
+                if ev.type != pygame.NOEVENT:
+                    events = [ev] + pygame.event.get()
+                elif any(getattr(w, "focus", False) for w in self.widgets):
+                    self.dirty = True
+            for ev in events:
+                if ev.type != pygame.MOUSEMOTION:     # nothing reacts to plain motion
+                    self.dirty = True
                 if ev.type == pygame.QUIT: running = False
                 elif ev.type == pygame.KEYDOWN:
                     if ev.key == pygame.K_ESCAPE: running = False
@@ -927,6 +745,9 @@ class ShapeLab:
                 for w in self.widgets:
                     if hasattr(w, "handle"): w.handle(ev)
 
+            if not self.dirty:
+                continue
+            self.dirty = False
             self.screen.fill(CANVAS_BG)
             self.draw_canvas(self.screen)
             self.draw_panel(self.screen)
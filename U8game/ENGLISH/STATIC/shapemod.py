@@ -7,16 +7,24 @@ Assumes the BMP uses the exact same arrangement as the vanilla:
 - frames packed left->right; wrap to a new row when width would overflow
 - each imported frame keeps the original width/height and XOff/YOff
 - palette index 255 = transparency
+For many shapes in one archive rewrite, use import_shapes.py with a manifest.
 
-Requires: Pillow  (pip install pillow)
+Requires: Pillow, numpy  (pip install pillow numpy)
 """
 
 import os, sys, struct, shutil
 from typing import List, Tuple
 
+import numpy as np
+
+from flx_lib import FlxIndex
+from palette_lib import Palette
+from shape_lib import build_shape_record, encode_frame, patch_type_in_file
+
 # ---------- Config ----------
 SHAPES_FLX = "U8SHAPES.FLX"
 SHEET_PATH = "NewShape523.bmp"
+PAL_PATH = "U8PAL.PAL"        # only needed for non-indexed sheets
 TARGET_SHAPE_INDEX = 523
 # ----------------------------
 
@@ -28,21 +36,16 @@ def put_u24(v):   return bytes((v & 0xFF, (v>>8)&0xFF, (v>>16)&0xFF))
 
 # ---------- FLX parsing ----------
 def load_flx_table(blob: bytearray):
-    """0-based offsets; at 84: uint16 Count; at 128: Count*(uint32 off, uint32 size)."""
+    """0-based offsets; at 84: Count; at 128: Count*(uint32 off, uint32 size).
+       Returns the count and a packed flx_lib.FlxIndex of (off, size) pairs."""
     if len(blob) < 136:
         raise ValueError("FLX too small.")
-    count = u16(blob, 84)
-    table_off = 128
-    recs = []
-    for i in range(count):
-        off  = int.from_bytes(blob[table_off + i*8 + 0: table_off + i*8 + 4], "little")
-        size = int.from_bytes(blob[table_off + i*8 + 4: table_off + i*8 + 8], "little")
-        recs.append({"off": off, "size": size})
-    return count, recs
+    recs = FlxIndex.from_buffer(blob)
+    return recs.count, recs
 
 def read_type_chunk(blob: bytearray, rec):
     """Return dict with head, frame headers and full bytes for a type (shape)."""
-    off = rec["off"]; size = rec["size"]
+    off, size = rec
     chunk = blob[off: off+size]
     if len(chunk) != size:
         raise ValueError("Type chunk truncated.")
@@ -68,6 +71,16 @@ def read_frame_attrs(blob: bytearray, abs_off: int):
     return comp, xlen, ylen, xoff, yoff
 
 # ---------- U8 RLE encode (compression=1; per u8view.bas) ----------
+def _index_array(index_grid, xlen: int, ylen: int) -> np.ndarray:
+    """Grid of indices as a (ylen, xlen) uint8 array; missing pixels stay transparent."""
+    grid = np.asarray(index_grid, dtype=np.uint8)
+    if grid.shape == (ylen, xlen):
+        return grid
+    out = np.full((ylen, xlen), 255, dtype=np.uint8)
+    h, w = min(ylen, grid.shape[0]), min(xlen, grid.shape[1] if grid.ndim == 2 else 0)
+    out[:h, :w] = grid[:h, :w]
+    return out
+
 def encode_frame_u8(index_grid: List[List[int]], xlen: int, ylen: int, xoff: int, yoff: int) -> bytes:
     """
     Build a compressed=1 frame chunk:
@@ -88,75 +101,12 @@ def encode_frame_u8(index_grid: List[List[int]], xlen: int, ylen: int, xoff: int
       dlen = 1 byte
         if dlen&1 == 1: repeated color follows; paints (dlen>>1) pixels
         else: (dlen>>1) literal bytes follow
+      gap / dlen pairs repeat until the row is full
+
+    Runs are chosen by shape_lib.encode_frame (smallest encoding per row,
+    identical rows shared); type/frame numbers are left 0 for patching.
     """
-    if xlen > 255:
-        raise ValueError("Width > 255 not encodable with 1-byte row opcodes.")
-
-    lines: List[bytes] = []
-    for y in range(ylen):
-        row = index_grid[y]
-        rle = bytearray()
-        xpos = 0
-        while xpos < xlen:
-            # skip transparent gap
-            start = xpos
-            while start < xlen and row[start] == 255:
-                start += 1
-
-            # write gap (may be zero)
-            rle.append((start - xpos) & 0xFF)
-            xpos = start
-            if xpos >= xlen:
-                break
-
-            # non-transparent run [xpos .. end)
-            end = xpos
-            while end < xlen and row[end] != 255:
-                end += 1
-
-            p = xpos
-            while p < end:
-                chunk = min(127, end - p)  # max we can encode in one op
-                # check if repeated color
-                c0 = row[p]
-                repeated = True
-                for xx in range(p+1, p+chunk):
-                    if row[xx] != c0:
-                        repeated = False
-                        break
-                if repeated:
-                    d = (chunk * 2) | 1
-                    rle.append(d & 0xFF)
-                    rle.append(c0 & 0xFF)
-                else:
-                    d = (chunk * 2)
-                    rle.append(d & 0xFF)
-                    rle.extend((row[p+i] & 0xFF) for i in range(chunk))
-                p += chunk
-            xpos = end
-
-        lines.append(bytes(rle))
-
-    # Build line-offset table (word per line): remaining_words*2 + bytes_of_prev_lines
-    rle_blob = bytearray()
-    offsets = []
-    sofar = 0
-    for i, line in enumerate(lines):
-        offsets.append((ylen - i) * 2 + sofar)
-        rle_blob.extend(line)
-        sofar += len(line)
-
-    header = struct.pack("<HHIHHHHH",
-                         0, 0, 0,  # patched later
-                         1,        # compression
-                         xlen, ylen,
-                         xoff, yoff)
-
-    off_table = bytearray()
-    for v in offsets:
-        off_table += put_u16(v & 0xFFFF)
-
-    return header + off_table + rle_blob
+    return encode_frame(_index_array(index_grid, xlen, ylen), xoff, yoff)
 
 def patch_type_frame(frame_bytes: bytes, type_index: int, frame_index: int) -> bytes:
     b = bytearray(frame_bytes)
@@ -167,9 +117,10 @@ def patch_type_frame(frame_bytes: bytes, type_index: int, frame_index: int) -> b
 # ---------- Rebuild helpers ----------
 def try_inplace_write(blob: bytearray, recs, type_index: int, frame_index: int, new_frame: bytes) -> bool:
     rec = recs[type_index]
+    rec_off = rec[0]
     tinfo = read_type_chunk(blob, rec)
     frames = tinfo["frames"]
-    abs_off = rec["off"] + frames[frame_index]["rel"]
+    abs_off = rec_off + frames[frame_index]["rel"]
     orig_sz = frames[frame_index]["size"]
     if len(new_frame) > orig_sz:
         return False
@@ -179,47 +130,22 @@ def try_inplace_write(blob: bytearray, recs, type_index: int, frame_index: int,
     return True
 
 def rebuild_type_and_file(blob: bytearray, recs, type_index: int, frame_replacements: dict) -> bytearray:
-    rec = recs[type_index]
-    tinfo = read_type_chunk(blob, rec)
-    nf = tinfo["num_frames"]
-    frames = tinfo["frames"]
-
-    new_head = bytearray()
-    new_head += tinfo["raw_head04"]
-    new_head += put_u16(nf)
-
-    base_rel = 6 + nf*6
-    rel_cursor = base_rel
-    new_frame_headers = bytearray()
-    new_frames_data = bytearray()
-
-    for i in range(nf):
-        unk = frames[i]["unk"]
-        abs_off = rec["off"] + frames[i]["rel"]
-        orig_size = frames[i]["size"]
-        data = frame_replacements.get(i, bytes(blob[abs_off:abs_off+orig_size]))
-
-        new_frame_headers += put_u24(rel_cursor)
-        new_frame_headers += bytes((unk,))
-        new_frame_headers += put_u16(len(data))
-
-        new_frames_data += data
-        rel_cursor += len(data)
-
-    new_chunk = bytes(new_head + new_frame_headers + new_frames_data)
+    """Whole-file rebuild (later records shift); patch_type_in_file avoids this."""
+    rec_off, rec_size = recs[type_index]
+    new_chunk = build_shape_record(blob, recs[type_index], frame_replacements)
 
     # Splice into file
-    before = blob[:rec["off"]]
-    after  = blob[rec["off"] + rec["size"]:]
+    before = blob[:rec_off]
+    after  = blob[rec_off + rec_size:]
     new_blob = bytearray(before + new_chunk + after)
 
     # Fix record table
-    count = u16(new_blob, 84)
-    table_off = 128
+    count = recs.count
+    table_off = recs.table_offset
     # update this record size
     new_blob[table_off + type_index*8 + 4: table_off + type_index*8 + 8] = len(new_chunk).to_bytes(4, "little")
     # shift later records by delta
-    delta = len(new_chunk) - rec["size"]
+    delta = len(new_chunk) - rec_size
     for i in range(type_index+1, count):
         off = int.from_bytes(new_blob[table_off + i*8 + 0: table_off + i*8 + 4], "little")
         if off != 0:
@@ -229,16 +155,75 @@ def rebuild_type_and_file(blob: bytearray, recs, type_index: int, frame_replacem
     return new_blob
 
 # ---------- Sheet loading (indexed, keep palette indices) ----------
-def load_sheet_indices(path: str) -> Tuple[List[List[int]], int, int]:
+def load_sheet_indices(path: str, pal: Palette = None, dither=None) -> Tuple[np.ndarray, int, int]:
+    """Indexed sheets keep their indices; RGB(A) sheets go through pal.quantize."""
     from PIL import Image  # require Pillow
-    im = Image.open(path)
-    if im.mode != "P":
-        im = im.convert("P")
-    w, h = im.size
-    raw = list(im.getdata())  # indices 0..255
-    grid = [raw[y*w:(y+1)*w] for y in range(h)]
+    with Image.open(path) as im:
+        if im.mode == "P":
+            grid = np.array(im, dtype=np.uint8)
+        elif pal is None:
+            raise ValueError(f"{path} is not indexed; need {PAL_PATH} to map its colors.")
+        else:
+            grid = pal.quantize(np.asarray(im.convert("RGBA")), dither)
+    h, w = grid.shape
     return grid, w, h
 
+# ---------- Sheet -> frames ----------
+def frame_attrs(blob: bytearray, recs, type_index: int) -> List[Tuple[int, int, int, int]]:
+    """(xlen, ylen, xoff, yoff) of every frame of a type."""
+    rec_off = recs[type_index][0]
+    tinfo = read_type_chunk(blob, recs[type_index])
+    return [read_frame_attrs(blob, rec_off + fr["rel"])[1:] for fr in tinfo["frames"]]
+
+def pack_rects(dims, sheet_w: int):
+    """
+    Replays the vanilla packing: frames left->right, wrapping to a new row
+    when the width would overflow. Returns (rects, packed height); empty
+    frames get None and take no room.
+    """
+    rects = []
+    curx = 0
+    cury = 0
+    row_h = 0
+    for w, h in dims:
+        if w == 0 or h == 0:
+            rects.append(None)
+            continue
+        if curx + w > sheet_w:
+            curx = 0
+            cury += row_h
+            row_h = 0
+        rects.append((curx, cury, w, h))
+        curx += w
+        if h > row_h: row_h = h
+    return rects, cury + row_h
+
+def encode_sheet_frames(sheet: np.ndarray, rects, offsets, type_index: int) -> dict:
+    """
+    Encodes the sheet block of every frame with a rect (None = leave frame).
+
+    Args:
+        sheet: (h, w) index array.
+        rects: (x, y, w, h) or None per frame.
+        offsets: (xoff, yoff) per frame.
+        type_index (int): Shape number written into the frame headers.
+
+    Returns:
+        dict: frame index -> encoded frame bytes.
+    """
+    frame_bytes_by_index = {}
+    for i, rect in enumerate(rects):
+        if rect is None:
+            continue
+        x0, y0, w, h = rect
+        # extract indices into grid[h][w] (cut off at the sheet edge);
+        # outside-of-rect stays transparent, inside is whatever indices are
+        grid = sheet[y0:y0+h, x0:x0+w]
+        xoff, yoff = offsets[i]
+        encoded = encode_frame_u8(grid, w, h, xoff, yoff)
+        frame_bytes_by_index[i] = patch_type_frame(encoded, type_index, i)
+    return frame_bytes_by_index
+
 # ---------- Main ----------
 def main():
     # Locate FLX
@@ -253,78 +238,27 @@ def main():
     if not (0 <= TARGET_SHAPE_INDEX < count):
         raise IndexError("TARGET_SHAPE_INDEX out of range.")
 
-    rec = recs[TARGET_SHAPE_INDEX]
-    tinfo = read_type_chunk(blob, rec)
-    nf = tinfo["num_frames"]
-    print(f"Shape {TARGET_SHAPE_INDEX}: {nf} frames")
-
     # Gather vanilla frame sizes & offsets to replicate exactly
-    dims = []
-    offs = []
-    for i in range(nf):
-        abs_off = rec["off"] + tinfo["frames"][i]["rel"]
-        comp, xlen, ylen, xoff, yoff = read_frame_attrs(blob, abs_off)
-        dims.append((xlen, ylen))
-        offs.append((xoff, yoff))
+    attrs = frame_attrs(blob, recs, TARGET_SHAPE_INDEX)
+    print(f"Shape {TARGET_SHAPE_INDEX}: {len(attrs)} frames")
 
     # Load the replacement sheet (indexed)
-    sheet, sw, sh = load_sheet_indices(SHEET_PATH)
+    pal_path = os.path.join(os.path.dirname(flx_path), PAL_PATH)
+    pal = Palette.load(pal_path) if os.path.exists(pal_path) else None
+    sheet, sw, sh = load_sheet_indices(SHEET_PATH, pal)
     print(f"Loaded sheet: {SHEET_PATH} -> {sw}x{sh} (indexed)")
 
     # Compute rectangles by replaying vanilla packing (left->right, wrap when needed)
-    rects = []
-    curx = 0
-    cury = 0
-    row_h = 0
-    for i in range(nf):
-        w, h = dims[i]
-        if w == 0 or h == 0:
-            rects.append((curx, cury, 1, 1))
-            continue
-        if curx + w > sw:
-            curx = 0
-            cury += row_h
-            row_h = 0
-        rects.append((curx, cury, w, h))
-        curx += w
-        if h > row_h: row_h = h
-    expected_h = cury + row_h
+    rects, expected_h = pack_rects([a[:2] for a in attrs], sw)
     if expected_h != sh:
         print(f"WARNING: computed sheet height {expected_h} != actual {sh}. "
               f'Check that your BMP uses the same packing as vanilla.')
 
     # Build new frames with original offsets; respect index 255 transparency
-    frame_bytes_by_index = {}
-    for i in range(nf):
-        x0, y0, w, h = rects[i]
-        # extract indices into grid[h][w]
-        grid = [sheet[y0+yy][x0:x0+w] for yy in range(h)]
-        # enforce: outside-of-rect remains transparent, inside is whatever indices are
-        xoff, yoff = offs[i]
-        encoded = encode_frame_u8(grid, w, h, xoff, yoff)
-        encoded = patch_type_frame(encoded, TARGET_SHAPE_INDEX, i)
-        frame_bytes_by_index[i] = encoded
-
-    # Try in-place; otherwise rebuild
-    inplace_ok = True
-    for i in range(nf):
-        if len(frame_bytes_by_index[i]) > tinfo["frames"][i]["size"]:
-            inplace_ok = False
-            break
-
-    if inplace_ok:
-        mod_blob = blob
-        for i in range(nf):
-            ok = try_inplace_write(mod_blob, recs, TARGET_SHAPE_INDEX, i, frame_bytes_by_index[i])
-            if not ok:
-                inplace_ok = False
-                break
-        if not inplace_ok:
-            mod_blob = rebuild_type_and_file(blob, recs, TARGET_SHAPE_INDEX, frame_bytes_by_index)
-    else:
-        mod_blob = rebuild_type_and_file(blob, recs, TARGET_SHAPE_INDEX, frame_bytes_by_index)
+    frame_bytes_by_index = encode_sheet_frames(sheet, rects, [a[2:] for a in attrs], TARGET_SHAPE_INDEX)
 
-    # Backup & write
+    # Backup first (writes in place are not crash safe), then patch the file
+    # (in place, or move just this record)
     bak = flx_path + ".bak"
     if not os.path.exists(bak):
         shutil.copyfile(flx_path, bak)
@@ -332,8 +266,8 @@ def main():
     else:
         print(f"Backup exists: {bak}")
 
-    with open(flx_path, "wb") as f:
-        f.write(mod_blob)
+    how = patch_type_in_file(flx_path, blob, recs, TARGET_SHAPE_INDEX, frame_bytes_by_index)
+    print(f"Saved: {how}")
 
     print("Done: shape 523 replaced with your sheet frames (keeping vanilla offsets).")
 
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+# sort_lib.py
+# Painter's order for map items, after Pentagram's world/ItemSorter.cpp.
+# - Every item is a world-space box from its TYPEFLAG.DAT footprint
+#   (x/y in 32-unit steps, swapped when the item is flipped; z in 8-unit
+#   steps) and the hexagon that box covers on screen.
+# - Two items are only compared when their hexagons overlap; ItemSorter's
+#   "<" chain (flats, clearly in z/x/y, biased checks, tie breaks) decides
+#   which one is behind, giving a dependency graph.
+# - The paint order is ItemSorter's walk: items in (z, x, y) list order,
+#   each painted after everything it depends on.
+# - ItemSorter keeps the graph, so add/remove/move only compare the moved
+#   item against the items sharing its screen cells; order() re-walks the
+#   graph without comparing anything.
+#
+# Not ported: occlusion culling (ItemSorter skips items hidden behind an
+# occluding hexagon; here they are painted, underneath).
+#
+# Usage (benchmark on the densest maps):
+#   python sort_lib.py [--static DIR] [--maps 4 62] [--top 3] [--moves 200]
+#
+# Requirements: numpy
+
+import argparse
+import bisect
+import os
+import sys
+import time
+
+import numpy as np
+from numpy.lib.recfunctions import repack_fields
+
+from map_lib import ITEM_DTYPE
+from typeflag_lib import SI_DRAW, SI_OCCL, SI_SOLID, SI_TRANSL, TypeFlags
+
+FLG_INVISIBLE = 0x0010
+FLG_FLIPPED = 0x0020
+
+# Screen cells for finding overlap candidates (hexagons are at most ~240px)
+SORT_CELL = 128
+
+# One SortItem: world box, screen hexagon, and the flags "<" looks at.
+SORT_DTYPE = np.dtype([
+    ("x", "<i4"), ("y", "<i4"), ("z", "<i4"),
+    ("xleft", "<i4"), ("yfar", "<i4"), ("ztop", "<i4"),
+    ("sxleft", "<i4"), ("sxright", "<i4"),
+    ("sxtop", "<i4"), ("sytop", "<i4"),
+    ("sxbot", "<i4"), ("sybot", "<i4"),
+    ("shape", "<i4"), ("frame", "<i4"),
+    ("flat", "?"), ("f32x32", "?"), ("anim", "?"), ("trans", "?"),
+    ("draw", "?"), ("solid", "?"), ("occl", "?"),
+])
+
+_HEX_FIELDS = ("sxleft", "sxright", "sxtop", "sytop", "sxbot", "sybot")
+
+
+def _cdiv(a, b: int):
+    """C integer division (truncates toward zero), as ItemSorter computes."""
+    q = np.abs(a) // b
+    return np.where(a < 0, -q, q)
+
+
+def sort_records(items: np.ndarray, typeflags: TypeFlags) -> np.ndarray:
+    """SORT_DTYPE records for ITEM_DTYPE items (ItemSorter::AddItem)."""
+    shape = items["shape"]
+    xd, yd, zd = typeflags.footprint(shape, flipped=(items["flags"] & FLG_FLIPPED) != 0)
+    sf = typeflags.column("flags", shape)
+
+    r = np.empty(len(items), dtype=SORT_DTYPE)
+    x = r["x"] = items["x"]
+    y = r["y"] = items["y"]
+    z = r["z"] = items["z"]
+    xleft = r["xleft"] = x - xd
+    yfar = r["yfar"] = y - yd
+    ztop = r["ztop"] = z + zd
+    r["sxleft"] = _cdiv(xleft, 4) - _cdiv(y, 4)
+    r["sxright"] = _cdiv(x, 4) - _cdiv(yfar, 4)
+    r["sxtop"] = _cdiv(xleft, 4) - _cdiv(yfar, 4)
+    r["sytop"] = _cdiv(xleft, 8) + _cdiv(yfar, 8) - ztop
+    r["sxbot"] = _cdiv(x, 4) - _cdiv(y, 4)
+    r["sybot"] = _cdiv(x, 8) + _cdiv(y, 8) - z
+    r["shape"] = shape
+    r["frame"] = items["frame"]
+    r["flat"] = zd == 0
+    r["f32x32"] = (xd == 128) & (yd == 128)
+    r["anim"] = typeflags.column("animtype", shape) != 0
+    r["trans"] = (sf & SI_TRANSL) != 0
+    r["draw"] = (sf & SI_DRAW) != 0
+    r["solid"] = (sf & SI_SOLID) != 0
+    r["occl"] = ((sf & SI_OCCL) != 0) & ((items["flags"] & FLG_INVISIBLE) == 0)
+    return r
+
+
+def overlap(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """SortItem::overlap, element-wise: do the screen hexagons intersect."""
+    tdx = a["sxtop"] - b["sxbot"]
+    tdy = a["sytop"] - b["sybot"]
+    bdx = a["sxbot"] - b["sxtop"]
+    bdy = a["sybot"] - b["sytop"]
+    clear = ((a["sxright"] <= b["sxleft"]) | (a["sxleft"] >= b["sxright"])
+             | (tdx + tdy * 2 >= 0) | (-tdx + tdy * 2 >= 0)
+             | (bdx - bdy * 2 >= 0) | (-bdx - bdy * 2 >= 0))
+    return ~clear
+
+
+def _flats(a, b):
+    return a["flat"] & b["flat"]
+
+
+def _differ(field):
+    return lambda a, b: _flats(a, b) & (a[field] != b[field])
+
+
+def _before(field):
+    return lambda a, b: a[field] < b[field]
+
+
+def _after(field):
+    return lambda a, b: a[field] > b[field]
+
+
+def _sum_differ(f1, f2):
+    return lambda a, b: a[f1] + a[f2] != b[f1] + b[f2]
+
+
+def _sum_before(f1, f2):
+    return lambda a, b: a[f1] + a[f2] < b[f1] + b[f2]
+
+
+def _half(a, f1, f2):
+    return _cdiv(a[f1] + a[f2], 2)
+
+
+# SortItem::operator< as (condition, result) rules; the first rule whose
+# condition holds decides, the last one (frame) always does.
+_LESS_RULES = (
+    # both flat
+    (_differ("ztop"), _before("ztop")),
+    (_differ("anim"), _before("anim")),         # animated after
+    (_differ("trans"), _before("trans")),       # translucent after
+    (_differ("draw"), _after("draw")),          # draw first
+    (_differ("solid"), _after("solid")),        # solid first
+    (_differ("occl"), _after("occl")),          # occluders first
+    (_differ("f32x32"), _after("f32x32")),      # 32x32 flats first
+    # mixed or not flat: clearly in z
+    (lambda a, b: ~_flats(a, b) & (a["ztop"] <= b["z"]), True),
+    (lambda a, b: ~_flats(a, b) & (a["z"] >= b["ztop"]), False),
+    # clearly in x, then y
+    (lambda a, b: a["x"] <= b["xleft"], True),
+    (lambda a, b: a["xleft"] >= b["x"], False),
+    (lambda a, b: a["y"] <= b["yfar"], True),
+    (lambda a, b: a["yfar"] >= b["y"], False),
+    # z base
+    (lambda a, b: a["z"] < b["z"], True),
+    (lambda a, b: a["z"] > b["z"], False),
+    # biased clearly in z, x, y
+    (lambda a, b: _half(a, "ztop", "z") <= b["z"], True),
+    (lambda a, b: a["z"] >= _half(b, "ztop", "z"), False),
+    (lambda a, b: _half(a, "x", "xleft") <= b["xleft"], True),
+    (lambda a, b: a["xleft"] >= _half(b, "x", "xleft"), False),
+    (lambda a, b: _half(a, "y", "yfar") <= b["yfar"], True),
+    (lambda a, b: a["yfar"] >= _half(b, "y", "yfar"), False),
+    # partial: front sum, back sum, x, y, shape, frame
+    (_sum_differ("x", "y"), _sum_before("x", "y")),
+    (_sum_differ("xleft", "yfar"), _sum_before("xleft", "yfar")),
+    (lambda a, b: a["x"] != b["x"], _before("x")),
+    (lambda a, b: a["y"] != b["y"], _before("y")),
+    (lambda a, b: a["shape"] != b["shape"], _before("shape")),
+)
+
+
+def less(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """SortItem::operator<, element-wise: True where a is painted behind b."""
+    a, b = np.broadcast_arrays(a, b)
+    out = np.zeros(len(a), dtype=bool)
+    live = np.arange(len(a))
+    for cond, result in _LESS_RULES:
+        if not len(live):
+            return out
+        hit = cond(a, b)
+        if hit.any():
+            out[live[hit]] = result if isinstance(result, bool) else result(a[hit], b[hit])
+            keep = ~hit
+            live, a, b = live[keep], a[keep], b[keep]
+    out[live] = a["frame"] < b["frame"]
+    return out
+
+
+class ItemSorter:
+    """
+    Dependency graph of the items of one map. Items get integer ids (reused
+    after removal); order() returns the ids in paint order.
+
+    Like Pentagram, an item added later is "si1" in the comparison with an
+    item already present, so the result matches ItemSorter fed the same
+    items in the same order.
+    """
+
+    def __init__(self, typeflags: TypeFlags, cell: int = SORT_CELL):
+        self.typeflags = typeflags
+        self.cell = cell
+        self.clear()
+
+    def clear(self):
+        self.items = np.zeros(0, dtype=ITEM_DTYPE)   # by id
+        self.recs = np.zeros(0, dtype=SORT_DTYPE)    # by id
+        self.seq = np.zeros(0, dtype=np.int64)       # insertion sequence by id
+        self.alive = np.zeros(0, dtype=bool)
+        self.behind = []    # id -> ids painted before it (SortItem::depends)
+        self.front = []     # id -> ids that depend on it
+        self.cells = {}     # (cx, cy) -> ids whose hexagon touches the cell
+        self.listed = []    # sorted (z, x, y, seq, id): ItemSorter's list order
+        self.free = []
+        self.count = 0
+        self._next_seq = 0
+        self._order = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    # ---------- ids and storage ----------
+
+    def _alloc(self, n: int) -> np.ndarray:
+        reuse = [self.free.pop() for _ in range(min(n, len(self.free)))]
+        start = len(self.alive)
+        new = n - len(reuse)
+        if new:
+            grow = start + new
+            self.items = np.resize(self.items, grow)
+            self.recs = np.resize(self.recs, grow)
+            self.seq = np.resize(self.seq, grow)
+            self.alive = np.resize(self.alive, grow)
+            self.alive[start:] = False
+            self.behind.extend(set() for _ in range(new))
+            self.front.extend(set() for _ in range(new))
+        return np.array(reuse + list(range(start, start + new)), dtype=np.int64)
+
+    def _cell_range(self, rec):
+        c = self.cell
+        return (int(rec["sxleft"]) // c, int(rec["sytop"]) // c,
+                int(rec["sxright"]) // c, int(rec["sybot"]) // c)
+
+    def _place(self, ids: np.ndarray, items: np.ndarray):
+        recs = sort_records(items, self.typeflags)
+        self.items[ids] = items
+        self.recs[ids] = recs
+        self.seq[ids] = np.arange(self._next_seq, self._next_seq + len(ids))
+        self._next_seq += len(ids)
+        self.alive[ids] = True
+        self.count += len(ids)
+        c = self.cell
+        keys = zip(items["z"].tolist(), items["x"].tolist(), items["y"].tolist(),
+                   self.seq[ids].tolist(), ids.tolist())
+        boxes = zip((recs["sxleft"] // c).tolist(), (recs["sytop"] // c).tolist(),
+                    (recs["sxright"] // c).tolist(), (recs["sybot"] // c).tolist())
+        for key, (cx0, cy0, cx1, cy1) in zip(keys, boxes):
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    self.cells.setdefault((cx, cy), set()).add(key[4])
+            if len(ids) == 1:
+                bisect.insort(self.listed, key)
+            else:
+                self.listed.append(key)
+        if len(ids) > 1:
+            self.listed.sort()
+        self._order = None
+
+    def _link(self, si1: np.ndarray, si2: np.ndarray):
+        """Adds the edges for overlapping pairs where si1 is the newer item."""
+        behind1 = less(self.recs[si1], self.recs[si2])
+        for a, b, lt in zip(si1.tolist(), si2.tolist(), behind1.tolist()):
+            if lt:
+                self.behind[b].add(a)
+                self.front[a].add(b)
+            else:
+                self.behind[a].add(b)
+                self.front[b].add(a)
+
+    # ---------- editing ----------
+
+    def add(self, item) -> int:
+        """Adds one ITEM_DTYPE item; returns its id."""
+        items = np.asarray([item], dtype=ITEM_DTYPE) if not isinstance(item, np.ndarray) else item.reshape(1)
+        i = int(self._alloc(1)[0])
+        self._place(np.array([i]), items)
+        self._connect(i)
+        return i
+
+    def _connect(self, i: int):
+        cx0, cy0, cx1, cy1 = self._cell_range(self.recs[i])
+        near = set()
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                near |= self.cells.get((cx, cy), ())
+        near.discard(i)
+        if not near:
+            return
+        others = np.fromiter(near, dtype=np.int64, count=len(near))
+        rec = self.recs[i:i + 1]
+        others = others[overlap(rec, self.recs[others])]
+        self._link(np.full(len(others), i, dtype=np.int64), others)
+
+    def add_many(self, items: np.ndarray) -> np.ndarray:
+        """
+        Adds ITEM_DTYPE items in order; returns their ids. Large batches
+        compare all candidate pairs in one vectorized pass.
+        """
+        if len(items) < 64:
+            return np.array([self.add(it) for it in items], dtype=np.int64)
+        ids = self._alloc(len(items))
+        self._place(ids, items)
+        fresh = np.zeros(len(self.alive), dtype=bool)
+        fresh[ids] = True
+        si1, si2 = self._candidate_pairs(np.flatnonzero(self.alive), fresh)
+        # only the hexagon columns for the (many) candidate pairs
+        hexes = repack_fields(self.recs[list(_HEX_FIELDS)])
+        keep = overlap(hexes[si1], hexes[si2])
+        self._link(si1[keep], si2[keep])
+        return ids
+
+    def remove(self, i: int):
+        """Removes item i and its edges; nothing else is compared."""
+        if not (0 <= i < len(self.alive) and self.alive[i]):
+            raise KeyError(i)
+        for f in self.front[i]:
+            self.behind[f].discard(i)
+        for b in self.behind[i]:
+            self.front[b].discard(i)
+        self.front[i].clear()
+        self.behind[i].clear()
+        cx0, cy0, cx1, cy1 = self._cell_range(self.recs[i])
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(i)
+                    if not cell:
+                        del self.cells[(cx, cy)]
+        it = self.items[i]
+        k = bisect.bisect_left(self.listed, (int(it["z"]), int(it["x"]), int(it["y"]), int(self.seq[i]), i))
+        del self.listed[k]
+        self.alive[i] = False
+        self.count -= 1
+        self.free.append(i)
+        self._order = None
+
+    def move(self, i: int, x: int, y: int, z: int) -> int:
+        """Moves item i (keeping its id) and re-links only its neighbours."""
+        item = self.items[i].copy()
+        self.remove(i)
+        item["x"], item["y"], item["z"] = x, y, z
+        j = self.add(item)
+        assert j == i
+        return j
+
+    def sync(self, items: np.ndarray):
+        """
+        Makes the sorter hold exactly items (as a multiset): removes the ids
+        no longer present and adds the new rows, or rebuilds when most of
+        the set changed.
+        """
+        have = {}
+        for i in np.flatnonzero(self.alive).tolist():
+            have.setdefault(self.items[i].tobytes(), []).append(i)
+        rows = np.ascontiguousarray(items, dtype=ITEM_DTYPE)
+        add = []
+        for k, row in enumerate(rows):
+            ids = have.get(row.tobytes())
+            if ids:
+                ids.pop()
+            else:
+                add.append(k)
+        drop = [i for ids in have.values() for i in ids]
+        if len(add) + len(drop) > max(64, len(rows) // 2):
+            self.clear()
+            self.add_many(rows)
+            return
+        for i in drop:
+            self.remove(i)
+        if add:
+            self.add_many(rows[add])
+
+    # ---------- ordering ----------
+
+    def _candidate_pairs(self, ids: np.ndarray, fresh: np.ndarray):
+        """
+        (si1, si2) id pairs sharing a screen cell where at least one side is
+        fresh; si1 is the newer of the two.
+        """
+        r = self.recs[ids]
+        c = self.cell
+        cx0, cy0 = r["sxleft"] // c, r["sytop"] // c
+        w = (r["sxright"] // c - cx0 + 1).astype(np.int64)
+        spans = w * (r["sybot"] // c - cy0 + 1)
+        owner = np.repeat(np.arange(len(ids)), spans)
+        k = np.arange(len(owner)) - np.repeat(np.cumsum(spans) - spans, spans)
+        cy = cy0[owner] + k // w[owner]
+        cx = cx0[owner] + k % w[owner]
+        cid = (cy.astype(np.int64) << 32) + cx
+        order = np.argsort(cid, kind="stable")
+        owner, cid, cx, cy = owner[order], cid[order], cx[order], cy[order]
+        # pairs within each run of equal cid
+        start = np.flatnonzero(np.r_[True, cid[1:] != cid[:-1]])
+        run = np.diff(np.r_[start, len(cid)])
+        pos = np.arange(len(cid)) - np.repeat(start, run)
+        after = np.repeat(run, run) - 1 - pos
+        a = np.repeat(np.arange(len(cid)), after)
+        b = a + 1 + (np.arange(len(a)) - np.repeat(np.cumsum(after) - after, after))
+        oa, ob = owner[a], owner[b]
+        # a pair shares a rectangle of cells; keep it only in its top-left one
+        keep = ((cx[a] == np.maximum(cx0[oa], cx0[ob])) & (cy[a] == np.maximum(cy0[oa], cy0[ob])))
+        i, j = ids[oa[keep]], ids[ob[keep]]
+        keep = fresh[i] | fresh[j]
+        i, j = i[keep], j[keep]
+        newer = self.seq[i] > self.seq[j]
+        return np.where(newer, i, j), np.where(newer, j, i)
+
+    def order(self) -> np.ndarray:
+        """Ids of all items in paint order (cached until the next edit)."""
+        if self._order is not None:
+            return self._order
+        listed = [t[4] for t in self.listed]
+        rank = [0] * len(self.alive)
+        for r, i in enumerate(listed):
+            rank[i] = r
+        rank_of = rank.__getitem__
+        behind = self.behind
+        state = bytearray(len(self.alive))    # 0 unpainted, 1 in progress, 2 painted
+        out = []
+        for root in listed:
+            if state[root]:
+                continue
+            state[root] = 1
+            stack = [(root, iter(sorted(behind[root], key=rank_of)))]
+            while stack:
+                node, deps = stack[-1]
+                for d in deps:
+                    if not state[d]:      # ItemSorter skips cycles the same way
+                        state[d] = 1
+                        stack.append((d, iter(sorted(behind[d], key=rank_of))))
+                        break
+                else:
+                    stack.pop()
+                    state[node] = 2
+                    out.append(node)
+        self._order = np.array(out, dtype=np.int64)
+        return self._order
+
+    def ordered_items(self) -> np.ndarray:
+        """The items (ITEM_DTYPE) in paint order."""
+        return self.items[self.order()]
+
+    def edge_count(self) -> int:
+        return sum(len(s) for s in self.behind)
+
+
+def sorted_order(items: np.ndarray, typeflags: TypeFlags) -> np.ndarray:
+    """Indices sorting items into ItemSorter's paint order (one-shot)."""
+    sorter = ItemSorter(typeflags)
+    ids = sorter.add_many(items)
+    pos = np.empty(len(sorter.alive), dtype=np.int64)
+    pos[ids] = np.arange(len(ids))
+    return pos[sorter.order()]
+
+
+# ---------- benchmark ----------
+
+def _check(sorter: ItemSorter) -> int:
+    """
+    Number of dependency edges the current order violates; only edges on
+    dependency cycles, which the walk breaks like ItemSorter does.
+    """
+    order = sorter.order()
+    where = np.empty(len(sorter.alive), dtype=np.int64)
+    where[order] = np.arange(len(order))
+    return sum(1 for f in order.tolist() for b in sorter.behind[f] if where[b] > where[f])
+
+
+def main(argv=None) -> int:
+    from map_lib import GLOB_EGG_SHAPE, GlobTable, MapFile, paint_order, to_items
+
+    ap = argparse.ArgumentParser(description="Benchmark the ItemSorter port on the densest maps.")
+    ap.add_argument("--static", default=os.path.dirname(os.path.abspath(__file__)),
+                    help="directory with FIXED.DAT, GLOB.FLX and TYPEFLAG.DAT")
+    ap.add_argument("--maps", type=int, nargs="*", help="maps to time (default: the --top densest)")
+    ap.add_argument("--top", type=int, default=3)
+    ap.add_argument("--moves", type=int, default=200, help="single-item moves to time per map")
+    args = ap.parse_args(argv)
+
+    tf = TypeFlags.load(os.path.join(args.static, "TYPEFLAG.DAT"))
+    globs = GlobTable.load(os.path.join(args.static, "GLOB.FLX"))
+    with MapFile(os.path.join(args.static, "FIXED.DAT")) as fixed:
+        def map_items(idx):
+            objs = fixed.objects(idx)
+            eggs = objs["shape"] == GLOB_EGG_SHAPE
+            return np.concatenate([to_items(objs[~eggs]), globs.expand(objs[eggs])])
+
+        maps = args.maps
+        if not maps:
+            sizes = sorted(((len(map_items(i)), i) for i in range(len(fixed))), reverse=True)
+            maps = [i for _, i in sizes[:args.top]]
+        rng = np.random.default_rng(0)
+        for idx in maps:
+            items = map_items(idx)
+            t0 = time.perf_counter()
+            paint_order(items)
+            t_key = time.perf_counter() - t0
+
+            sorter = ItemSorter(tf)
+            t0 = time.perf_counter()
+            sorter.add_many(items)
+            t_build = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            sorter.order()
+            t_order = time.perf_counter() - t0
+
+            ids = rng.choice(np.flatnonzero(sorter.alive), size=min(args.moves, len(items)), replace=False)
+            t0 = time.perf_counter()
+            for i in ids.tolist():
+                it = sorter.items[i]
+                sorter.move(i, int(it["x"]) + 16, int(it["y"]) - 16, int(it["z"]))
+            t_move = (time.perf_counter() - t0) / max(1, len(ids))
+            t0 = time.perf_counter()
+            sorter.order()
+            t_reorder = time.perf_counter() - t0
+
+            print(f"map {idx}: {len(items)} items, {sorter.edge_count()} edges")
+            print(f"  (x+y, z, x) key sort  {t_key * 1000:8.1f} ms")
+            print(f"  build graph           {t_build * 1000:8.1f} ms")
+            print(f"  paint order           {t_order * 1000:8.1f} ms")
+            print(f"  move one item         {t_move * 1000:8.2f} ms  (avg of {len(ids)})")
+            print(f"  paint order after     {t_reorder * 1000:8.1f} ms")
+            print(f"  edges broken (cycles) {_check(sorter)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
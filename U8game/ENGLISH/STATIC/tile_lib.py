@@ -0,0 +1,133 @@
+# tile_lib.py
+# Tiled, cached drawing for the map viewers.
+# - TileCache: splits the zoomed map into fixed-size screen tiles and keeps
+#   rendered tiles per zoom level in a byte-budget LRU (cache_lib). Panning
+#   only renders the tiles that become exposed.
+# - update() is the dirty-tile scheduler: missing visible tiles are rendered
+#   nearest the view centre first, optionally within a time budget, and the
+#   rest are reported as pending for the next frame.
+# - invalidate() drops the tiles under world-space boxes (e.g. objects that
+#   appeared or disappeared after a layer toggle) on every cached zoom.
+#
+# Tile contents come from a render callback, so the same cache serves the
+# pygame viewer (maps.py) and the Tk/PIL viewer (mapviewer.py).
+
+import math
+import time
+from typing import Callable, List, Optional, Tuple
+
+from cache_lib import FrameCache, sizeof
+
+TILE_SIZE = 256
+TILE_CACHE_BYTES = 128 * 1024 * 1024
+
+
+class TileCache:
+    """
+    Tile (tx, ty) at zoom z covers zoomed-world pixels
+    [tx*T, (tx+1)*T) x [ty*T, (ty+1)*T), where a world (projected screen)
+    coordinate c lands on pixel floor(c * z).
+    """
+
+    def __init__(self, render: Callable, tile_size: int = TILE_SIZE,
+                 max_bytes: int = TILE_CACHE_BYTES, sizer: Callable = sizeof):
+        """
+        Args:
+            render: render(zoom, tx, ty) -> tile (Surface, PhotoImage, ...).
+            tile_size (int): Tile edge in zoomed pixels.
+            max_bytes (int): Budget for cached tiles.
+            sizer: Bytes of one tile, for the budget.
+        """
+        self.render = render
+        self.tile_size = tile_size
+        self.cache = FrameCache(max_bytes, sizer)
+        self.rendered = 0       # tiles rendered since creation
+
+    def clear(self):
+        self.cache.clear()
+
+    def tile_range(self, left: int, top: int, width: int, height: int) -> Tuple[int, int, int, int]:
+        """Inclusive (tx0, ty0, tx1, ty1) of the tiles under a zoomed-world rect."""
+        t = self.tile_size
+        return left // t, top // t, (left + width - 1) // t, (top + height - 1) // t
+
+    def update(self, zoom: float, left: int, top: int, width: int, height: int,
+               budget: Optional[float] = None, extent: Optional[Tuple[int, int, int, int]] = None):
+        """
+        Tiles covering a view, rendering missing ones.
+
+        Args:
+            zoom (float): Zoom level (part of the cache key).
+            left, top (int): Zoomed-world pixel at the view's top-left.
+            width, height (int): View size.
+            budget (float): Seconds to spend rendering; None renders all.
+                At least one missing tile is rendered per call.
+            extent: Optional zoomed-world (left, top, right, bottom) outside
+                which there are no tiles.
+
+        Returns:
+            tuple: ([(tx, ty, tile), ...] ready to draw, pending count).
+        """
+        tx0, ty0, tx1, ty1 = self.tile_range(left, top, width, height)
+        if extent is not None:
+            ex0, ey0, ex1, ey1 = self.tile_range(extent[0], extent[1],
+                                                 extent[2] - extent[0], extent[3] - extent[1])
+            tx0, ty0, tx1, ty1 = max(tx0, ex0), max(ty0, ey0), min(tx1, ex1), min(ty1, ey1)
+        t = self.tile_size
+        cx, cy = left + width / 2.0, top + height / 2.0
+        ready: List[Tuple[int, int, object]] = []
+        missing = []
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                tile = self.cache.get((zoom, tx, ty))
+                if tile is None:
+                    d = ((tx + 0.5) * t - cx) ** 2 + ((ty + 0.5) * t - cy) ** 2
+                    missing.append((d, tx, ty))
+                else:
+                    ready.append((tx, ty, tile))
+        missing.sort()
+        start = time.perf_counter()
+        done = 0
+        for _, tx, ty in missing:
+            if budget is not None and done and time.perf_counter() - start > budget:
+                break
+            tile = self.render(zoom, tx, ty)
+            self.cache.put((zoom, tx, ty), tile)
+            ready.append((tx, ty, tile))
+            done += 1
+        self.rendered += done
+        return ready, len(missing) - done
+
+    def invalidate(self, boxes, pad: int = 1) -> int:
+        """
+        Drops the cached tiles, on every zoom level, that overlap any of the
+        world-space [left, top, right, bottom) boxes (grown by pad zoomed
+        pixels for rounding). Returns the number of tiles dropped.
+        """
+        keys = self.cache.keys()
+        if not keys or not len(boxes):
+            return 0
+        t = self.tile_size
+        by_zoom = {}
+        for zoom, tx, ty in keys:
+            by_zoom.setdefault(zoom, set()).add((tx, ty))
+        dropped = 0
+        for zoom, cached in by_zoom.items():
+            dirty = set()
+            for left, top, right, bottom in boxes.tolist() if hasattr(boxes, "tolist") else boxes:
+                tx0 = (math.floor(left * zoom) - pad) // t
+                ty0 = (math.floor(top * zoom) - pad) // t
+                tx1 = (math.ceil(right * zoom) + pad) // t
+                ty1 = (math.ceil(bottom * zoom) + pad) // t
+                for ty in range(ty0, ty1 + 1):
+                    for tx in range(tx0, tx1 + 1):
+                        if (tx, ty) in cached:
+                            dirty.add((tx, ty))
+            for tx, ty in dirty:
+                dropped += self.cache.discard((zoom, tx, ty))
+        return dropped
+
+    def summary(self) -> str:
+        s = self.cache.stats()
+        return (f"{s['entries']} tiles, {s['bytes'] / 1048576:.1f}/{s['max_bytes'] / 1048576:.0f} MB, "
+                f"{self.rendered} rendered")
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# typeflag_lib.py
+# U8 TYPEFLAG.DAT (8 bytes per shape) as NumPy columns, after Pentagram's
+# graphics/TypeFlags.cpp and the layout in tools/u8typeflag.txt.
+# - TypeFlags: one array per ShapeInfo field (flags, family, equiptype,
+#   x/y/z footprint, animtype, animdata, unknown, weight, volume), indexed
+#   by shape number; nothing is decoded per shape.
+# - Vectorized queries: column() / has() for the shapes of many items at
+#   once, footprint() in world units (sorter, culling), find() for search.
+#
+# Usage (search):
+#   python typeflag_lib.py [--static DIR] --shape 123 456
+#   python typeflag_lib.py --flags SOLID TRANSL --family container
+#   python typeflag_lib.py --not-flags EDITOR --min-weight 10 --dims 2 2 -
+#
+# Requirements: numpy
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+TYPEFLAG_RECORD = 8
+
+# ShapeInfo::SFlags (graphics/ShapeInfo.h)
+SI_FIXED = 0x0001
+SI_SOLID = 0x0002
+SI_SEA = 0x0004
+SI_LAND = 0x0008
+SI_OCCL = 0x0010
+SI_BAG = 0x0020
+SI_DAMAGING = 0x0040
+SI_NOISY = 0x0080
+SI_DRAW = 0x0100
+SI_IGNORE = 0x0200
+SI_ROOF = 0x0400
+SI_TRANSL = 0x0800
+SI_EDITOR = 0x1000
+SI_EXPLODE = 0x2000
+SI_UNKNOWN46 = 0x4000
+SI_UNKNOWN47 = 0x8000
+
+FLAG_NAMES = {
+    "FIXED": SI_FIXED, "SOLID": SI_SOLID, "SEA": SI_SEA, "LAND": SI_LAND,
+    "OCCL": SI_OCCL, "BAG": SI_BAG, "DAMAGING": SI_DAMAGING, "NOISY": SI_NOISY,
+    "DRAW": SI_DRAW, "IGNORE": SI_IGNORE, "ROOF": SI_ROOF, "TRANSL": SI_TRANSL,
+    "EDITOR": SI_EDITOR, "EXPLODE": SI_EXPLODE,
+    "UNKNOWN46": SI_UNKNOWN46, "UNKNOWN47": SI_UNKNOWN47,
+}
+
+# ShapeInfo::SFamily
+SF_GENERIC = 0
+SF_QUALITY = 1
+SF_QUANTITY = 2
+SF_GLOBEGG = 3
+SF_UNKEGG = 4
+SF_BREAKABLE = 5
+SF_CONTAINER = 6
+SF_MONSTEREGG = 7
+SF_TELEPORTEGG = 8
+SF_REAGENT = 9
+
+FAMILY_NAMES = {
+    "generic": SF_GENERIC, "quality": SF_QUALITY, "quantity": SF_QUANTITY,
+    "globegg": SF_GLOBEGG, "unkegg": SF_UNKEGG, "breakable": SF_BREAKABLE,
+    "container": SF_CONTAINER, "monsteregg": SF_MONSTEREGG,
+    "teleportegg": SF_TELEPORTEGG, "reagent": SF_REAGENT,
+}
+
+# ShapeInfo::SEquipType
+EQUIP_NAMES = ("none", "shield", "arm", "head", "body", "legs", "weapon")
+
+# Footprint units: x/y dims are in 32 world units, z in 8
+FOOT_XY = 32
+FOOT_Z = 8
+
+# Shapes Pentagram marks not solid although TYPEFLAG.DAT says they are
+# (they block a passage otherwise)
+_NOT_SOLID = range(459, 465)
+
+COLUMNS = ("flags", "family", "equiptype", "x", "y", "z",
+           "animtype", "animdata", "unknown", "weight", "volume")
+
+
+class TypeFlags:
+    """
+    Per-shape columns indexed by shape number. Shapes past the end of the
+    file read as zero (no footprint, no flags) through the accessors.
+    """
+
+    def __init__(self, raw: np.ndarray):
+        """
+        Args:
+            raw: (count, 8) uint8 records.
+        """
+        self.raw = raw
+        self.count = len(raw)
+        b = raw.astype(np.uint16)
+        # bytes 0, 1 and 5 hold the SI_ bits in the same order as ShapeInfo
+        self.flags = b[:, 0] | (b[:, 1] & 0x0F) << 8 | (b[:, 5] & 0xF0) << 8
+        self.family = raw[:, 1] >> 4
+        self.equiptype = raw[:, 2] & 0x0F
+        self.x = raw[:, 2] >> 4
+        self.y = raw[:, 3] & 0x0F
+        self.z = raw[:, 3] >> 4
+        self.animtype = raw[:, 4] & 0x0F
+        self.animdata = raw[:, 4] >> 4
+        self.unknown = raw[:, 5] & 0x0F
+        self.weight = raw[:, 6].copy()
+        self.volume = raw[:, 7].copy()
+        self.flags[_NOT_SOLID.start:_NOT_SOLID.stop] &= np.uint16(0xFFFF ^ SI_SOLID)
+
+    @classmethod
+    def from_buffer(cls, buf) -> "TypeFlags":
+        n = len(buf) // TYPEFLAG_RECORD
+        raw = np.frombuffer(buf, dtype=np.uint8, count=n * TYPEFLAG_RECORD).reshape(n, TYPEFLAG_RECORD)
+        return cls(raw)
+
+    @classmethod
+    def load(cls, path) -> "TypeFlags":
+        with open(path, "rb") as f:
+            return cls.from_buffer(f.read())
+
+    def __len__(self) -> int:
+        return self.count
+
+    def column(self, name: str, shapes) -> np.ndarray:
+        """Column name for an array of shape numbers (0 past the table)."""
+        col = getattr(self, name)
+        shapes = np.asarray(shapes, dtype=np.int64)
+        inside = (shapes >= 0) & (shapes < self.count)
+        out = np.zeros(shapes.shape, dtype=col.dtype)
+        out[inside] = col[shapes[inside]]
+        return out
+
+    def has(self, shapes, mask: int) -> np.ndarray:
+        """True where any SI_ bit of mask is set for the shape."""
+        return (self.column("flags", shapes) & mask) != 0
+
+    def footprint(self, shapes, flipped=None):
+        """
+        World-unit footprint (xd, yd, zd) of shapes, as int32 arrays
+        (ShapeInfo::getFootpadWorld).
+
+        Args:
+            shapes: Shape numbers.
+            flipped: Optional bool array; x and y swap where set.
+        """
+        fx = self.column("x", shapes).astype(np.int32) * FOOT_XY
+        fy = self.column("y", shapes).astype(np.int32) * FOOT_XY
+        zd = self.column("z", shapes).astype(np.int32) * FOOT_Z
+        if flipped is None:
+            return fx, fy, zd
+        return np.where(flipped, fy, fx), np.where(flipped, fx, fy), zd
+
+    def find(self, flags: int = 0, not_flags: int = 0, family=None, equiptype=None,
+             dims=(None, None, None), min_weight: int = 0, min_volume: int = 0) -> np.ndarray:
+        """
+        Shape numbers matching every given condition.
+
+        Args:
+            flags (int): SI_ bits that must all be set.
+            not_flags (int): SI_ bits that must all be clear.
+            family (int): SF_ family, or None for any.
+            equiptype (int): Equipment slot, or None for any.
+            dims: (x, y, z) footprint in TYPEFLAG units; None matches any.
+            min_weight, min_volume (int): Lower bounds.
+        """
+        keep = (self.flags & flags) == flags
+        keep &= (self.flags & not_flags) == 0
+        if family is not None:
+            keep &= self.family == family
+        if equiptype is not None:
+            keep &= self.equiptype == equiptype
+        for col, want in zip((self.x, self.y, self.z), dims):
+            if want is not None:
+                keep &= col == want
+        keep &= (self.weight >= min_weight) & (self.volume >= min_volume)
+        return np.flatnonzero(keep)
+
+    def describe(self, shape: int) -> dict:
+        """All fields of one shape, with flag and family names."""
+        row = {name: int(self.column(name, [shape])[0]) for name in COLUMNS}
+        row["shape"] = shape
+        row["flag_names"] = [n for n, bit in FLAG_NAMES.items() if row["flags"] & bit]
+        row["family_name"] = next((n for n, f in FAMILY_NAMES.items() if f == row["family"]), str(row["family"]))
+        return row
+
+
+# ---------- search CLI ----------
+
+def _format(row: dict) -> str:
+    equip = EQUIP_NAMES[row["equiptype"]] if row["equiptype"] < len(EQUIP_NAMES) else str(row["equiptype"])
+    return (f"{row['shape']:5d}  {row['x']:2d}x{row['y']:2d}x{row['z']:2d}  "
+            f"family={row['family_name']:<11} equip={equip:<6} "
+            f"anim={row['animtype']}/{row['animdata']:<2} "
+            f"weight={row['weight']:<3} volume={row['volume']:<3} "
+            f"{' '.join(row['flag_names'])}")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Search U8 shapes by TYPEFLAG.DAT properties.")
+    ap.add_argument("--static", default=os.path.dirname(os.path.abspath(__file__)),
+                    help="directory with TYPEFLAG.DAT")
+    ap.add_argument("--shape", type=int, nargs="*", help="show these shapes")
+    ap.add_argument("--flags", nargs="*", default=[], choices=sorted(FLAG_NAMES), metavar="FLAG",
+                    help="flags that must be set: " + " ".join(FLAG_NAMES))
+    ap.add_argument("--not-flags", nargs="*", default=[], choices=sorted(FLAG_NAMES), metavar="FLAG")
+    ap.add_argument("--family", choices=sorted(FAMILY_NAMES))
+    ap.add_argument("--equip", choices=EQUIP_NAMES)
+    ap.add_argument("--dims", nargs=3, metavar=("X", "Y", "Z"), default=["-", "-", "-"],
+                    help="footprint in TYPEFLAG units, '-' matches any")
+    ap.add_argument("--min-weight", type=int, default=0)
+    ap.add_argument("--min-volume", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    tf = TypeFlags.load(os.path.join(args.static, "TYPEFLAG.DAT"))
+    if args.shape:
+        shapes = args.shape
+    else:
+        bits = 0
+        for name in args.flags:
+            bits |= FLAG_NAMES[name]
+        clear = 0
+        for name in args.not_flags:
+            clear |= FLAG_NAMES[name]
+        shapes = tf.find(flags=bits, not_flags=clear,
+                         family=FAMILY_NAMES[args.family] if args.family else None,
+                         equiptype=EQUIP_NAMES.index(args.equip) if args.equip else None,
+                         dims=tuple(None if d == "-" else int(d) for d in args.dims),
+                         min_weight=args.min_weight, min_volume=args.min_volume).tolist()
+    for shape in shapes:
+        print(_format(tf.describe(shape)))
+    print(f"{len(shapes)} shape(s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
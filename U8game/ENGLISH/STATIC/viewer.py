@@ -1,11 +1,13 @@
 # viewer.py
 # Ultima VIII shape viewer with an in-app GUI (faithful to u8view.bas).
 # Place this in the STATIC folder alongside U8PAL.PAL and U8SHAPES.FLX.
-# Requires: pygame
+# Requires: pygame, numpy
 
 import os
 import pygame
 
+import shape_lib
+
 # -------------------- binary helpers --------------------
 
 def ru8(f):
@@ -50,184 +52,38 @@ def load_palette(path):
 
 # -------------------- FLX access --------------------
 
-class ShapeFrameInfo:
-    __slots__ = ("pos", "size")
-    def __init__(self, pos, size):
-        self.pos = pos
-        self.size = size
-
-class ShapeTypeInfo:
-    __slots__ = ("pos", "size", "frames")
-    def __init__(self, pos, size, frames):
-        self.pos = pos
-        self.size = size
-        self.frames = frames
-
 class U8Shapes:
     def __init__(self, flx_path):
         self.path = flx_path
-        self.f = open(flx_path, "rb")
-        self.num_types = self._read_num_types()
-        self.type_index = [None] * self.num_types
-        self.frame_counts = self._read_frame_counts_only()
+        # mmap + frame table for all types (cached on disk next to the FLX)
+        self.file = shape_lib.ShapeFile(flx_path)
+        self.index = self.file.index
+        self.num_types = self.index.num_shapes
+        self.frame_counts = self.index.frame_counts
 
     def close(self):
         try:
-            self.f.close()
+            self.file.close()
         except:
             pass
 
-    def _read_num_types(self):
-        self.f.seek(84, os.SEEK_SET)
-        return ru16(self.f, signed=False)
-
-    def _read_type_record(self, type_index):
-        table_off = 128 + type_index * 8
-        self.f.seek(table_off, os.SEEK_SET)
-        type_pos = ru32(self.f)
-        type_size = ru32(self.f)
-        return type_pos, type_size
-
-    def _read_type_info(self, type_index):
-        if self.type_index[type_index] is not None:
-            return self.type_index[type_index]
-        type_pos, type_size = self._read_type_record(type_index)
-        self.f.seek(type_pos, os.SEEK_SET)
-        _unknown4 = self.f.read(4)   # ignored
-        num_frames = ru16(self.f, signed=False)
-        frames = []
-        for _ in range(num_frames):
-            rel = ru24(self.f)
-            _unk1 = ru8(self.f)
-            fsize = ru16(self.f, signed=False)
-            frames.append(ShapeFrameInfo(type_pos + rel, fsize))
-        ti = ShapeTypeInfo(type_pos, type_size, frames)
-        self.type_index[type_index] = ti
-        return ti
-
-    def _read_frame_counts_only(self):
-        counts = [0] * self.num_types
-        for i in range(self.num_types):
-            type_pos, _ = self._read_type_record(i)
-            self.f.seek(type_pos, os.SEEK_SET)
-            _unknown4 = self.f.read(4)
-            num_frames = ru16(self.f, signed=False)
-            counts[i] = num_frames
-        return counts
-
-    def get_frame_info(self, type_index, frame_index):
-        ti = self._read_type_info(type_index)
-        if not (0 <= frame_index < len(ti.frames)):
-            raise IndexError("Frame index out of range")
-        return ti.frames[frame_index]
-
 # -------------------- exact VB frame draw --------------------
 
-def draw_frame_vb_exact(f, frame_info, target_surface, palette):
+def draw_frame_vb_exact(shapes, type_index, frame_index, target_surface, palette):
     """
-    Exact translation of u8view.bas frame decode/draw.
-
-    Frame header:
-      0  u16 TypNum  (ignored)
-      2  u16 FrmNum  (ignored)
-      4  4  unknown  (ignored)
-      8  u16 Compr
-     10  u16 XLen
-     12  u16 YLen
-     14  i16 XOff
-     16  i16 YOff
-     18  YLen * u16 line position deltas
-           (absolute file offset = position_of_this_word + delta)
+    Draws a frame the way u8view.bas does: the 320x200 buffer is cleared to
+    color 0 and the frame's hotspot lands at (160, 150). Offscreen parts are
+    clipped. The RLE decode itself is shape_lib.decode_frame.
     """
-    f.seek(frame_info.pos, os.SEEK_SET)
-
-    _typnum = ru16(f)       # not used by VB viewer
-    _frmnum = ru16(f)
-    _unk4   = f.read(4)
-    compr   = ru16(f)
-    xlen    = ru16(f)
-    ylen    = ru16(f)
-    xoff    = ru16(f, signed=True)
-    yoff    = ru16(f, signed=True)
-
-    # Build absolute line offsets using *current* word position + delta
-    line_offsets = []
-    for _ in range(ylen):
-        base = f.tell()
-        delta = ru16(f)
-        line_offsets.append(base + delta)
-
-    # VB starting pos
-    st_xpos = 160 - xoff
-    st_ypos = 150 - yoff
-
-    # Clear to color 0
+    pixels, xoff, yoff, _ = shapes.file.decode(type_index, frame_index)
     target_surface.fill(palette[0])
-
-    xpos = xlen
-    y = -1
-    while True:
-        # Advance to next line with valid StartX
-        while xpos >= xlen:
-            y += 1
-            if y >= ylen:
-                return  # all lines done
-            f.seek(line_offsets[y], os.SEEK_SET)
-            xpos = ru8(f)  # StartX
-
-        datlen = ru8(f)
-
-        if compr == 1:
-            if (datlen & 1) == 1:
-                # Repeat: len = datlen \ 2, one color byte
-                run = datlen // 2
-                color = ru8(f)
-                if run > 0:
-                    ypix = y + st_ypos
-                    if 0 <= ypix < 200:
-                        start = xpos + st_xpos
-                        for i in range(run):
-                            xpix = start + i
-                            if 0 <= xpix < 320:
-                                target_surface.set_at((xpix, ypix), palette[color])
-            else:
-                # Literal: len = datlen \ 2, then that many bytes
-                run = datlen // 2
-                if run > 0:
-                    ypix = y + st_ypos
-                    if 0 <= ypix < 200:
-                        start = xpos + st_xpos
-                        for i in range(run):
-                            color = ru8(f)
-                            xpix = start + i
-                            if 0 <= xpix < 320:
-                                target_surface.set_at((xpix, ypix), palette[color])
-                    else:
-                        # offscreen but still consume
-                        _ = f.read(run)
-        else:
-            # Uncompressed: datlen literal pixels
-            run = datlen
-            if run > 0:
-                ypix = y + st_ypos
-                if 0 <= ypix < 200:
-                    start = xpos + st_xpos
-                    for i in range(run):
-                        color = ru8(f)
-                        xpix = start + i
-                        if 0 <= xpix < 320:
-                            target_surface.set_at((xpix, ypix), palette[color])
-                else:
-                    _ = f.read(run)
-
-        # Step 4: advance by run length (already halved when compressed)
-        xpos += run
-
-        # Step 5: optional gap byte
-        if xpos < xlen:
-            gap = ru8(f)
-            xpos += gap
-        # when xpos == xlen, next loop iteration will advance to next line
+    ylen, xlen = pixels.shape
+    if xlen == 0 or ylen == 0:
+        return
+    frame_surf = pygame.image.frombuffer(pixels.tobytes(), (xlen, ylen), "P")
+    frame_surf.set_palette(palette)
+    frame_surf.set_colorkey(shape_lib.TRANSPARENT_INDEX)
+    target_surface.blit(frame_surf, (160 - xoff, 150 - yoff))
 
 # -------------------- GUI helpers --------------------
 
@@ -335,8 +191,7 @@ def main():
             status = f"Shape {shape_idx} has 0 frames."
             return
         try:
-            finfo = shapes.get_frame_info(shape_idx, frame_idx)
-            draw_frame_vb_exact(shapes.f, finfo, game_buf, palette)
+            draw_frame_vb_exact(shapes, shape_idx, frame_idx, game_buf, palette)
         except Exception as e:
             game_buf.fill((64, 0, 0))
             status = f"Error: {e}"